@@ -1,12 +1,14 @@
 # api_parser.py method to parse and extract data from Kaspi API
+import asyncio
 import json
 import os
 import random
-import re
+import time
 import uuid
 from decimal import Decimal
-from collections import defaultdict
-from datetime import datetime
+from collections import defaultdict, deque
+from contextlib import aclosing
+from datetime import datetime, timedelta
 from typing import Literal, Any, Optional
 
 import aiohttp
@@ -18,14 +20,23 @@ from fastapi import HTTPException, status
 from httpx import HTTPError
 from playwright.async_api import async_playwright, Page, Cookie
 
+from core.metrics import counter
 from db import create_pool
+from deadlines import kaspi_http_timeout
 from error_handlers import ErrorHandler, logger
+from job_queue import request_reprice
+from kaspi_replay import FAMILY_ORDER_TABS, KASPI_BASE_URL, KASPI_MC_URL, KASPI_REPLAY_URL, kaspi_recorder
+from offers import Offer, extract_offer_prices, json_loads, map_offer, parse_offer_view
 from proxy_balancer import proxy_balancer
 from proxy_config import get_proxy_config
+from rate_budget import FAMILY_MERCHANT_LIST, FAMILY_OFFER_VIEW, FAMILY_PRICEFEED, kaspi_budget
 from utils import LoginError, has_active_subscription, get_product_count
 
 
 def _proxy_url(proxy_dict: dict | None = None) -> str | None:
+    if KASPI_REPLAY_URL:
+        # локальный сервер проигрывания ходит напрямую
+        return None
     cfg = get_proxy_config(proxy_dict)
     return cfg.get('http') if cfg else None
 
@@ -33,6 +44,11 @@ def _proxy_url(proxy_dict: dict | None = None) -> str | None:
 OUTPUT_DIR = 'preorder_exports'
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Сколько товар может отсутствовать в каталоге Kaspi, прежде чем мы пометим его снятым
+DELIST_GRACE = timedelta(hours=float(os.getenv("DELIST_GRACE_HOURS", "24")))
+# Размер пачки офферов, которую синхронизация пишет в базу за раз
+SYNC_BATCH_SIZE = 500
+
 
 class SessionManager:
     """Менеджер сессий для работы с cookies и авторизацией"""
@@ -166,7 +182,7 @@ class SessionManager:
                 "Pragma": "no-cache",
             }
 
-            response = requests.get("https://mc.shop.kaspi.kz/s/m", headers=headers, cookies=cookies)
+            response = requests.get(f"{KASPI_MC_URL}/s/m", headers=headers, cookies=cookies)
             if response.status_code != 200:
                 # print(response.status_code)
                 # print(response.text)
@@ -347,12 +363,8 @@ async def sync_store_api(store_id: str):
     if not cookies:
         raise HTTPException(status_code=400, detail="Cookies для сессии не найдены")
 
-    # Получение товаров для магазина
     merchant_id = session_manager.merchant_uid
-    products = await get_products(cookies, merchant_id)
-    
-    current_count = len(products)
-    
+
     pool = await create_pool()
     async with pool.acquire() as conn:
         user_id_result = await conn.fetchrow(
@@ -363,13 +375,15 @@ async def sync_store_api(store_id: str):
             """,
             store_id
         )
-    
+
     if not user_id_result:
         raise HTTPException(status_code=404, detail="Магазин не найден")
     user_id = user_id_result["user_id"]
     has_subscription = await has_active_subscription(user_id)
     current_product_count = await get_product_count(store_id)
-    
+
+    # Без подписки синхронизируем не больше max_products товаров
+    limit = None
     if not has_subscription:
         max_products = 20
         if current_product_count >= max_products:
@@ -378,16 +392,36 @@ async def sync_store_api(store_id: str):
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Cannot add more than {max_products} products without an active subscription"
             )
-        products = products[:max_products - current_product_count]
-
-    current_count = len(products)
+        limit = max_products - current_product_count
 
-    # Получаем пул соединений
-    pool = await create_pool()
-
-    # Вставка товаров, если они не существуют в базе данных
-    for product in products:
-        await insert_product_if_not_exists(product, store_id, pool)
+    async with pool.acquire() as conn:
+        sync_started_at = await conn.fetchval("SELECT now()")
+
+    # Товары идут потоком со страниц Kaspi прямо в базу пачками по SYNC_BATCH_SIZE
+    current_count = 0
+    reactivated = 0
+    truncated = False
+    batch = []
+    async with aclosing(iter_products(cookies, merchant_id)) as offers:
+        async for product in offers:
+            if limit is not None and current_count >= limit:
+                truncated = True
+                break
+            batch.append(product)
+            current_count += 1
+            if len(batch) >= SYNC_BATCH_SIZE:
+                reactivated += await save_offers_batch(pool, store_id, batch, sync_started_at)
+                batch = []
+    if batch:
+        reactivated += await save_offers_batch(pool, store_id, batch, sync_started_at)
+
+    # Снимаем с демпинга товары, которых нет в полном снимке каталога дольше DELIST_GRACE.
+    # По неполному (обрезанному лимитом) или пустому снимку ничего не помечаем.
+    delisted = 0
+    if not truncated and current_count > 0:
+        delisted = await tombstone_missing_products(pool, store_id, sync_started_at)
+    if delisted or reactivated:
+        logger.info(f"Магазин {store_id}: снято с продажи {delisted}, вернулось {reactivated}")
 
     # Обновление количества товаров и метки времени синхронизации
     update_data = {
@@ -413,17 +447,104 @@ async def sync_store_api(store_id: str):
     return {
         "success": True,
         "products_count": update_data["products_count"],
+        "delisted": delisted,
+        "reactivated": reactivated,
         "message": "Товары успешно синхронизированы"
     }
 
 
-async def insert_product_if_not_exists(product: dict, store_id: str, pool=None):
-    product["store_id"] = store_id
+async def save_offers_batch(pool, store_id: str, offers: list[Offer], seen_at: datetime) -> int:
+    """Сохраняет пачку офферов: мастер-товары, строки магазина, отметка last_seen_at"""
+    await upsert_master_products(pool, offers)
+    price_changed = []
+    for offer in offers:
+        await insert_product_if_not_exists(offer, store_id, pool, price_changed)
+    # цену магазина поменяли в кабинете — пересчитываем эти товары сразу
+    await request_reprice(pool, store_id, price_changed)
+    skus = [o.kaspi_sku for o in offers if o.kaspi_sku]
+    return await mark_products_seen(pool, store_id, skus, seen_at) if skus else 0
+
+
+async def upsert_master_products(pool, offers: list[Offer]) -> None:
+    """
+    Обновляет общий для всех магазинов справочник мастер-товаров Kaspi.
+    Строка переписывается, только если название, категория или картинка изменились.
+    """
+    masters = {}
+    for o in offers:
+        if o.external_kaspi_id:
+            masters[o.external_kaspi_id] = o
+    if not masters:
+        return
+
+    async with pool.acquire() as connection:
+        await connection.execute(
+            """
+            INSERT INTO kaspi_master_products (kaspi_id, name, category, image_url)
+            SELECT *
+            FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+            ON CONFLICT (kaspi_id) DO UPDATE
+                SET name       = EXCLUDED.name,
+                    category   = EXCLUDED.category,
+                    image_url  = EXCLUDED.image_url,
+                    updated_at = now()
+            WHERE (kaspi_master_products.name, kaspi_master_products.category, kaspi_master_products.image_url)
+                      IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.category, EXCLUDED.image_url)
+            """,
+            list(masters),
+            [o.name for o in masters.values()],
+            [o.category for o in masters.values()],
+            [o.image_url for o in masters.values()],
+        )
+
+
+async def mark_products_seen(pool, store_id: str, skus: list[str], seen_at: datetime) -> int:
+    """Отмечает товары как присутствующие в каталоге. Возвращает, сколько из них было снято и вернулось"""
+    async with pool.acquire() as connection:
+        return await connection.fetchval(
+            """
+            WITH prev AS (SELECT id, delisted_at IS NOT NULL AS was_delisted
+                          FROM products
+                          WHERE store_id = $1
+                            AND kaspi_sku = ANY ($2::text[])),
+                 upd AS (UPDATE products p
+                         SET last_seen_at = $3,
+                             delisted_at  = NULL
+                         FROM prev
+                         WHERE p.id = prev.id
+                         RETURNING prev.was_delisted)
+            SELECT count(*) FILTER (WHERE was_delisted)
+            FROM upd
+            """,
+            str(store_id), skus, seen_at
+        )
 
-    # Преобразуем UUID в строку, если они есть в product
-    for key, value in product.items():
-        if isinstance(value, uuid.UUID):
-            product[key] = str(value)
+
+async def tombstone_missing_products(pool, store_id: str, snapshot_at: datetime) -> int:
+    """Помечает delisted_at у товаров, не встречавшихся в каталоге дольше DELIST_GRACE"""
+    async with pool.acquire() as connection:
+        result = await connection.execute(
+            """
+            UPDATE products
+            SET delisted_at = $2
+            WHERE store_id = $1
+              AND delisted_at IS NULL
+              AND last_seen_at < $2 - $3::interval
+            """,
+            str(store_id), snapshot_at, DELIST_GRACE
+        )
+    return int(result.split()[-1])
+
+
+async def insert_product_if_not_exists(product: Offer, store_id: str, pool=None, price_changed: list | None = None):
+    """
+    Добавляет товар магазина или обновляет его цену. Название, категорию и картинку
+    бэкенд читает из kaspi_master_products по master_id, но в строке магазина они
+    тоже поддерживаются: фронтенд пока читает products напрямую через Supabase.
+    В price_changed добавляются id товаров с включённым ботом, у которых изменилась цена.
+    """
+    store_id = str(store_id)
+    master_id = product.external_kaspi_id
 
     # Если pool не передан, используем синглтон для получения пула соединений
     if not pool:
@@ -432,47 +553,53 @@ async def insert_product_if_not_exists(product: dict, store_id: str, pool=None):
     try:
         # Проверяем, существует ли продукт с таким kaspi_sku и store_id
         async with pool.acquire() as connection:
-            existing = await connection.fetch(
+            existing = await connection.fetchrow(
                 """
-                SELECT id, price, external_kaspi_id, category, image_url
+                SELECT id, price, master_id, bot_active, name, category, image_url
                 FROM products
                 WHERE kaspi_sku = $1
                   AND store_id = $2
                 LIMIT 1
                 """,
-                product["kaspi_sku"], product["store_id"]
+                product.kaspi_sku, store_id
             )
 
             if existing:
-                existing_price = existing[0].get("price")
+                existing_price = existing["price"]
 
-                if existing_price != product["price"] or product['category'] != existing[0].get('category') or product[
-                    'image_url'] != existing[0].get('image_url'):
+                metadata = (product.name, product.category, product.image_url)
+                stale_metadata = (existing["name"], existing["category"], existing["image_url"]) != metadata
+                if existing_price != product.price or existing["master_id"] != master_id or stale_metadata:
                     await connection.execute(
                         """
                         UPDATE products
                         SET price     = $1,
-                            category  = $2,
-                            image_url = $3
-                        WHERE id = $4
+                            master_id = $2,
+                            name      = $4,
+                            category  = $5,
+                            image_url = $6
+                        WHERE id = $3
                         """,
-                        product["price"], product['category'], product['image_url'], existing[0]["id"]
+                        product.price, master_id, existing["id"], *metadata
                     )
-                    print(f"🔄 Цена обновлена для товара: {product['name']} (с {existing_price} на {product['price']})")
+                    if existing_price != product.price:
+                        print(f"🔄 Цена обновлена для товара: {product.name} (с {existing_price} на {product.price})")
+                    if price_changed is not None and existing["bot_active"] and existing_price != product.price:
+                        price_changed.append(existing["id"])
 
                 return False
 
             # Если продукта нет, вставляем новый товар
             await connection.execute(
                 """
-                INSERT INTO products (kaspi_product_id, kaspi_sku, store_id, price, name, external_kaspi_id, category,
-                                      image_url)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                INSERT INTO products (kaspi_product_id, kaspi_sku, store_id, price, name, external_kaspi_id, master_id,
+                                      category, image_url)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
                 """,
-                product["kaspi_product_id"], product["kaspi_sku"], product["store_id"], product["price"],
-                product["name"], product.get("external_kaspi_id"), product.get('category'), product.get('image_url')
+                product.kaspi_product_id, product.kaspi_sku, store_id, product.price,
+                product.name, product.external_kaspi_id, master_id, product.category, product.image_url
             )
-            print(f"✅ Добавлен товар: {product['name']}")
+            print(f"✅ Добавлен товар: {product.name}")
             return True
 
     except asyncpg.exceptions.PostgresError as e:
@@ -485,14 +612,15 @@ async def insert_product_if_not_exists(product: dict, store_id: str, pool=None):
         return False
 
 
-async def get_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100) -> list[dict]:
+async def iter_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100):
     """
-    Получает все товары продавца по пагинации асинхронно, с прокси и авторизацией.
+    Асинхронно отдаёт товары продавца по одному, постранично, с прокси и авторизацией.
+    Весь каталог в памяти не держим — в каждый момент жива только текущая страница.
 
     :param cookie_jar: словарь с куки для аутентификации
     :param merchant_uid: уникальный идентификатор продавца
     :param page_size: количество товаров на страницу (максимум 100)
-    :return: список всех предложений
+    :return: асинхронный генератор Offer
     """
     headers = {
         "x-auth-version": "3",
@@ -514,22 +642,30 @@ async def get_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100
     proxy_dict = proxy_balancer.get_balanced_proxy(f"merchant_{merchant_uid}")
     proxy_url = _proxy_url(proxy_dict)
 
-    all_offers = []
+    total = 0
     page = 0
 
-    async with ClientSession() as session:
+    async with ClientSession(timeout=kaspi_http_timeout) as session:
         while True:
             url = (
-                f"https://mc.shop.kaspi.kz/bff/offer-view/list"
+                f"{KASPI_MC_URL}/bff/offer-view/list"
                 f"?m={merchant_uid}&p={page}&l={page_size}&a=true"
             )
 
+            # общий для всех процессов лимит запросов к Kaspi
+            await kaspi_budget.acquire(FAMILY_MERCHANT_LIST, proxy_dict)
+
+            started = time.monotonic()
             try:
                 # Асинхронный запрос с использованием aiohttp, прокси и авторизации
                 async with session.get(url, headers=headers, cookies=cookie_jar, proxy=proxy_url) as response:
+                    kaspi_responses.inc(family=FAMILY_MERCHANT_LIST, status=response.status)
+                    payload = await response.read()
+                    kaspi_recorder.record(FAMILY_MERCHANT_LIST, "GET", url, None, response.status,
+                                          time.monotonic() - started, payload)
                     if response.status == 401:
                         raise HTTPError("Ошибка аутентификации: 401 Unauthorized")
-                    
+
                     if response.status == 429:
                         rate_limit_error = Exception("Too Many Requests from Kaspi API")
                         rate_limit_error.status_code = 429
@@ -537,20 +673,7 @@ async def get_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100
 
                     response.raise_for_status()
 
-                    data = await response.json()
-                    offers = data.get('data', [])
-
-                    # Если на странице нет офферов — выходим из цикла
-                    if not offers:
-                        break
-
-                    # Добавляем офферы в общий список
-                    for o in offers:
-                        all_offers.append(map_offer(o))
-
-                    logger.info(f"Получено {len(offers)} офферов на странице {page}")
-
-                    page += 1
+                    data = json_loads(payload)
 
             except HTTPError as http_err:
                 logger.error(f"Ошибка авторизации при получении офферов: {http_err}")
@@ -559,28 +682,47 @@ async def get_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100
                 logger.error(f"Ошибка при запросе офферов: {err}")
                 raise
 
-    logger.info(f"Всего получено офферов: {len(all_offers)}")
-    return all_offers
+            offers = data.get('data')
 
+            # Если на странице нет офферов — выходим из цикла
+            if not offers:
+                break
 
-def map_offer(raw_offer: dict) -> dict:
-    # Извлекаем ID товара из URL, используя регулярное выражение
-    product_url = raw_offer.get("shopLink", "")
-    match = re.search(r'\/p\/.*-(\d+)\/', product_url)
+            logger.info(f"Получено {len(offers)} офферов на странице {page}")
+            total += len(offers)
+            page += 1
 
-    # Если ID найден, используем его как external_kaspi_id
-    external_kaspi_id = match.group(1) if match else None
+            # Отдаём офферы вызывающему коду, сырой ответ страницы освобождается после цикла
+            for o in offers:
+                yield map_offer(o)
 
-    return {
-        "kaspi_product_id": raw_offer.get("offerId"),  # Оставляем offerId как kaspi_product_id
-        "kaspi_sku": raw_offer.get("sku"),  # SKU товара
-        "name": raw_offer.get("masterTitle"),
-        "category": raw_offer.get("masterCategory"),
-        "price": raw_offer.get("minPrice", {}),
-        "image_url": f"https://resources.cdn-kaspi.kz/img/m/p/{raw_offer.get('images', [])[0]}",
-        "external_kaspi_id": external_kaspi_id,  # Спарсенный ID из URL
-        "updated_at": raw_offer.get("updatedAt")
-    }
+    logger.info(f"Всего получено офферов: {total}")
+
+
+async def get_products(cookie_jar: dict, merchant_uid: str, page_size: int = 100) -> list[Offer]:
+    """Получает все товары продавца списком (для мест, где нужен весь каталог сразу)"""
+    return [offer async for offer in iter_products(cookie_jar, merchant_uid, page_size)]
+
+
+async def get_store_offer_prices(store_id: str) -> dict[str, Any] | None:
+    """
+    Возвращает {kaspi_sku: minPrice} по всем офферам магазина из кабинета продавца.
+    Один запрос на 100 офферов. None — если сессия магазина недоступна.
+    """
+    session_manager = SessionManager(shop_uid=str(store_id))
+    if not await session_manager.load():
+        return None
+
+    cookies = session_manager.get_cookies()
+    if not cookies:
+        return None
+
+    prices = {}
+    async with aclosing(iter_products(cookies, session_manager.merchant_uid)) as offers:
+        async for offer in offers:
+            if offer.kaspi_sku and offer.price:
+                prices[offer.kaspi_sku] = offer.price
+    return prices
 
 
 USER_AGENTS = [
@@ -608,9 +750,16 @@ X_KS_CITY = [
     "730000000",  # Шымкент
     # …другие коды, если нужно
 ]
+DEFAULT_CITY_ID = X_KS_CITY[0]
+
+# сколько запросов offer-view уходит по каждому городу
+kaspi_city_requests = counter(
+    "kaspi_offer_view_requests_total", "Запросы offer-view к Kaspi по городам", ("city", "status"))
+# ответы Kaspi по типу запроса (семейства из rate_budget) и HTTP-статусу — здесь видны 401 и 429
+kaspi_responses = counter("kaspi_responses_total", "Ответы Kaspi по типу запроса и статусу", ("family", "status"))
 
 
-def get_random_headers(sku: str = None) -> dict:
+def get_random_headers(sku: str = None, city_id: str = DEFAULT_CITY_ID) -> dict:
     return {
         "accept": random.choice([
             "application/json, text/*",
@@ -626,21 +775,71 @@ def get_random_headers(sku: str = None) -> dict:
         "pragma": random.choice(["no-cache", ""]),
         "referer": f"https://kaspi.kz/shop/p/{sku}" if sku else "https://kaspi.kz/",
         "user-agent": random.choice(USER_AGENTS),
-        "x-ks-city": X_KS_CITY[0],
+        "x-ks-city": city_id,
     }
 
 
-async def parse_product_by_sku(sku: str) -> list:
-    """Парсит данные о товаре по SKU через API Kaspi асинхронно"""
+# ── Хеджирование запросов offer-view ─────────────────────────────────────────
+# если ответ не пришёл за HEDGE_QUANTILE-перцентиль обычной задержки, дублируем
+# запрос через другой здоровый прокси и берём первый успешный ответ
+HEDGE_LOOKUPS = os.getenv("HEDGE_LOOKUPS", "false").lower() in ("1", "true", "yes")
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.9"))
+# доля дополнительных запросов от числа обычных, больше которой не хеджируем
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+# порог не ниже этого, сек (пока замеров мало — тоже он)
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.3"))
+
+kaspi_hedges = counter("kaspi_offer_view_hedges_total", "Хеджирующие запросы offer-view", ("outcome",))
+
+
+class LatencyWindow:
+    """Последние задержки запросов; перцентиль пересчитываем не на каждом замере"""
+
+    def __init__(self, size: int = 512, recompute_every: int = 32):
+        self._values = deque(maxlen=size)
+        self._recompute_every = recompute_every
+        self._since_recompute = 0
+        self._cached: dict[float, float] = {}
+
+    def observe(self, value: float):
+        self._values.append(value)
+        self._since_recompute += 1
+        if self._since_recompute >= self._recompute_every:
+            self._cached.clear()
+            self._since_recompute = 0
+
+    def quantile(self, q: float) -> float | None:
+        if len(self._values) < self._recompute_every:
+            return None
+        if q not in self._cached:
+            ordered = sorted(self._values)
+            self._cached[q] = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return self._cached[q]
+
+
+offer_view_latency = LatencyWindow()
+_hedge_stats = {"primary": 0, "hedged": 0}
+
+
+def _hedge_delay() -> float:
+    return max(offer_view_latency.quantile(HEDGE_QUANTILE) or HEDGE_MIN_DELAY, HEDGE_MIN_DELAY)
+
+
+def _hedge_allowed() -> bool:
+    return _hedge_stats["hedged"] + 1 <= HEDGE_BUDGET * _hedge_stats["primary"]
+
+
+async def _offer_view_request(sku: str, city_id: str, proxy_dict: dict | None) -> list[tuple]:
+    """Один запрос offer-view через заданный прокси; ошибки не глушит"""
     # URL API Kaspi для запроса
-    url = f"https://kaspi.kz/yml/offer-view/offers/{sku}"
+    url = f"{KASPI_BASE_URL}/yml/offer-view/offers/{sku}"
 
     # Заголовки для запроса
-    headers = get_random_headers(sku)
+    headers = get_random_headers(sku, city_id)
 
     # Тело запроса
     body = {
-        "cityId": "750000000",  # Убедитесь, что cityId корректный
+        "cityId": city_id,
         "id": sku,
         "merchantUID": [],
         "limit": 5,
@@ -652,22 +851,100 @@ async def parse_product_by_sku(sku: str) -> list:
         "installationId": "-1"
     }
 
+    await kaspi_budget.acquire(FAMILY_OFFER_VIEW, proxy_dict)
+    started = time.monotonic()
+    ok = False
     try:
-        # Получаем прокси через балансировщик
-        proxy_dict = proxy_balancer.get_balanced_proxy(f"sku_{sku}")
-        proxy_url = _proxy_url(proxy_dict)
-
-        # Создаем сессию для отправки запроса
-        async with aiohttp.ClientSession() as session:
+        # Создаем сессию для отправки запроса (с таймаутами, чтобы зависший прокси не держал слот)
+        async with aiohttp.ClientSession(timeout=kaspi_http_timeout) as session:
             # Отправляем POST запрос с аутентификацией прокси
-            async with session.post(url, json=body, headers=headers, proxy=proxy_url) as response:
+            async with session.post(url, json=body, headers=headers, proxy=_proxy_url(proxy_dict)) as response:
+                kaspi_city_requests.inc(city=city_id, status=response.status)
+                kaspi_responses.inc(family=FAMILY_OFFER_VIEW, status=response.status)
+                payload = await response.read()
+                kaspi_recorder.record(FAMILY_OFFER_VIEW, "POST", url, body, response.status,
+                                      time.monotonic() - started, payload)
+
                 # Проверяем, что запрос прошел успешно
                 response.raise_for_status()  # В случае ошибки выбросит HTTPError
 
-                # Получаем данные из ответа
-                product_data = await response.json()
-                return parse_merchant_price_from_offers(product_data)
+                # Из сырых байтов достаём только merchantId и price
+                offers = parse_offer_view(payload)
+                ok = True
+                return offers
+    except asyncio.TimeoutError:
+        kaspi_city_requests.inc(city=city_id, status="timeout")
+        raise
+    except aiohttp.ClientError as e:
+        if not isinstance(e, aiohttp.ClientResponseError):
+            kaspi_city_requests.inc(city=city_id, status="error")
+        raise
+    finally:
+        latency = time.monotonic() - started
+        proxy_balancer.record_result(proxy_dict, latency, ok)
+        if ok:
+            offer_view_latency.observe(latency)
+
+
+async def _hedged_offer_view(sku: str, city_id: str) -> list[tuple]:
+    """
+    Запрос с хеджированием: если основной не ответил за _hedge_delay(), в рамках
+    HEDGE_BUDGET отправляем второй через другой прокси; побеждает первый успешный,
+    проигравший отменяется
+    """
+    proxy_dict = proxy_balancer.get_balanced_proxy(f"sku_{sku}")
+    _hedge_stats["primary"] += 1
+    primary = asyncio.create_task(_offer_view_request(sku, city_id, proxy_dict))
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=_hedge_delay())
+        if done:
+            return primary.result()
+
+        hedge_proxy = proxy_balancer.get_hedge_proxy(exclude=proxy_dict) if _hedge_allowed() else None
+        if hedge_proxy is None:
+            kaspi_hedges.inc(outcome="not_sent")
+            return await primary
+
+        _hedge_stats["hedged"] += 1
+        hedge = asyncio.create_task(_offer_view_request(sku, city_id, hedge_proxy))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    kaspi_hedges.inc(outcome="hedge_won" if task is hedge else "primary_won")
+                    return task.result()
+                error = task.exception()
+        kaspi_hedges.inc(outcome="both_failed")
+        raise error
+    finally:
+        # отмена вызывающего (дедлайн этапа) не должна оставлять запросы висеть
+        pending = [task for task in pending if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def parse_product_by_sku(sku: str, city_id: str = DEFAULT_CITY_ID) -> list[tuple]:
+    """
+    Парсит цены конкурентов по SKU в городе city_id через API Kaspi асинхронно,
+    возвращает [(merchant_id, price), ...]. При HEDGE_LOOKUPS медленные запросы
+    дублируются через другой прокси.
+    """
+    try:
+        if HEDGE_LOOKUPS:
+            return await _hedged_offer_view(sku, city_id)
+        # Получаем прокси через балансировщик
+        proxy_dict = proxy_balancer.get_balanced_proxy(f"sku_{sku}")
+        return await _offer_view_request(sku, city_id, proxy_dict)
 
+    except asyncio.TimeoutError:
+        # таймауты aiohttp (ServerTimeoutError, ConnectionTimeoutError) — тоже ClientError,
+        # но это не «конкурентов нет»: пробрасываем, run_stage перенесёт товар как timeout
+        raise
     except aiohttp.ClientError as e:
         print(f"Ошибка parse_product_by_sku: {e}")
         return []
@@ -676,28 +953,9 @@ async def parse_product_by_sku(sku: str) -> list:
         return []
 
 
-def parse_merchant_price_from_offers(response_data: dict) -> list:
-    """Парсит данные о продавцах и их ценах из ответа API Kaspi"""
-
-    # Проверка, есть ли в ответе данные о предложениях
-    if 'offers' not in response_data:
-        raise ValueError("Ответ не содержит данных о предложениях")
-
-    merchant_data = []
-
-    # Извлекаем данные для каждого предложения
-    for offer in response_data['offers']:
-        merchant_id = offer.get('merchantId')
-        price = offer.get('price')
-
-        # Добавляем данные в список, если они есть
-        if merchant_id and price:
-            merchant_data.append({
-                'merchant_id': merchant_id,
-                'price': price
-            })
-
-    return merchant_data
+def parse_merchant_price_from_offers(response_data: dict) -> list[tuple]:
+    """Парсит данные о продавцах и их ценах из декодированного ответа API Kaspi"""
+    return extract_offer_prices(response_data)
 
 
 # Метод для отправки запроса с обновлением информации о товаре
@@ -705,7 +963,7 @@ async def send_price_update_request(product_data: dict, cookies: dict):
     """Отправляет запрос на обновление цены и наличия товара по SKU асинхронно"""
 
     # URL API Kaspi для обновления информации о товаре
-    url = "https://mc.shop.kaspi.kz/pricefeed/upload/merchant/process"
+    url = f"{KASPI_MC_URL}/pricefeed/upload/merchant/process"
 
     # Заголовки для запроса
     headers = {
@@ -737,11 +995,17 @@ async def send_price_update_request(product_data: dict, cookies: dict):
         # Получаем прокси через балансировщик
         proxy_dict = proxy_balancer.get_balanced_proxy(f"merchant_{merchant_id}")
         proxy_url = _proxy_url(proxy_dict)
+        await kaspi_budget.acquire(FAMILY_PRICEFEED, proxy_dict)
 
         # Создаем сессию для асинхронного запроса
-        async with aiohttp.ClientSession() as session:
+        started = time.monotonic()
+        async with aiohttp.ClientSession(timeout=kaspi_http_timeout) as session:
             # Отправляем POST запрос с cookies и прокси
             async with session.post(url, json=body, headers=headers, cookies=cookies, proxy=proxy_url) as response:
+                kaspi_responses.inc(family=FAMILY_PRICEFEED, status=response.status)
+                payload = await response.read()
+                kaspi_recorder.record(FAMILY_PRICEFEED, "POST", url, body, response.status,
+                                      time.monotonic() - started, payload)
                 # Проверяем, что запрос прошел успешно
                 response.raise_for_status()  # В случае ошибки выбросит HTTPError
 
@@ -754,7 +1018,11 @@ async def send_price_update_request(product_data: dict, cookies: dict):
                 else:
                     print(
                         f"Не удалось обновить цену и наличие для товара {product_data['sku']}. Ответ: {response_data}")
+                return response_data
 
+    except asyncio.TimeoutError:
+        # не уложились в таймаут — цена не отправлена, это не ошибка запроса, а повод перенести товар
+        raise
     except aiohttp.ClientError as e:
         print(f"Ошибка при запросе: {e}")
         return {}
@@ -823,8 +1091,14 @@ async def sync_product(product_id: str, price: Decimal):
         raise HTTPException(status_code=400, detail="Cookies для сессии не найдены")
     product_data['price'] = float(price)
     # Отправляем запрос для обновления товара
-    await send_price_update_request(product_data, cookies)
+    response_data = await send_price_update_request(product_data, cookies)
 
+    # Kaspi подтверждает приём цены статусом success; ошибка запроса — пустой ответ
+    if not response_data or response_data.get('status') != 'success':
+        return {
+            "success": False,
+            "message": f"Kaspi не принял цену товара {product_id}: {response_data}"
+        }
     return {
         "success": True,
         "message": f"Товар {product_id} успешно синхронизирован"
@@ -832,7 +1106,10 @@ async def sync_product(product_id: str, price: Decimal):
 
 
 def fetch_orders(url: str, headers: dict, cookies: dict):
+    started = time.monotonic()
     response = requests.get(url, headers=headers, cookies=cookies)
+    kaspi_recorder.record(FAMILY_ORDER_TABS, "GET", url, None, response.status_code,
+                          time.monotonic() - started, response.content)
     response.raise_for_status()
     return response.json()
 
@@ -916,8 +1193,8 @@ def get_sells_delivery_request(merchant_id: str, cookies: dict):
     }
 
     urls = [
-        f"https://mc.shop.kaspi.kz/mc/api/orderTabs/active?count=100&selectedTabs=DELIVERY&startIndex=0&loadPoints=false&_m={merchant_id}",
-        f"https://mc.shop.kaspi.kz/mc/api/orderTabs/active?count=100&selectedTabs=PICKUP&startIndex=0&loadPoints=false&_m={merchant_id}"
+        f"{KASPI_MC_URL}/mc/api/orderTabs/active?count=100&selectedTabs=DELIVERY&startIndex=0&loadPoints=false&_m={merchant_id}",
+        f"{KASPI_MC_URL}/mc/api/orderTabs/active?count=100&selectedTabs=PICKUP&startIndex=0&loadPoints=false&_m={merchant_id}"
     ]
 
     combined_json_data = []
@@ -1305,9 +1582,14 @@ async def create_preorder_from_product(
                 # 2) Получаем данные о товаре
                 prod = await conn.fetchrow(
                     """
-                    SELECT id, kaspi_sku, name, category, price
-                    FROM products
-                    WHERE id = $1
+                    SELECT p.id,
+                           p.kaspi_sku,
+                           COALESCE(m.name, p.name)         AS name,
+                           COALESCE(m.category, p.category) AS category,
+                           p.price
+                    FROM products p
+                             LEFT JOIN kaspi_master_products m ON m.kaspi_id = p.master_id
+                    WHERE p.id = $1
                     """,
                     product_id
                 )
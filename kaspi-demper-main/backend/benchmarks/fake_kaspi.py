@@ -0,0 +1,108 @@
+# benchmarks/fake_kaspi.py
+# Запуск из backend/: python -m benchmarks.fake_kaspi --port 8898 --latency 0.05 --rate-429 0.01 --churn 0.2
+"""
+Фейковый Kaspi для стендов: offer-view (цены конкурентов), список офферов
+кабинета, pricefeed и проверка сессии /s/m. Задержка ответа, доля 429 и
+частота смены цен конкурентов задаются параметрами. Демпер направляется сюда
+через KASPI_REPLAY_URL. Счётчики запросов — GET /__bench/stats.
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from collections import defaultdict
+
+from aiohttp import web
+
+
+class FakeKaspi:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, rate_429: float = 0.0, churn: float = 0.2,
+                 competitors: int = 5, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.churn = churn
+        self.competitors = competitors
+        self.rnd = random.Random(seed)
+        self.prices: dict[str, list[int]] = {}
+        self.stats = defaultdict(int)
+
+    async def _delay(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self.rnd.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _throttled(self, family: str) -> bool:
+        self.stats[family] += 1
+        if self.rate_429 and self.rnd.random() < self.rate_429:
+            self.stats[f"{family}_429"] += 1
+            return True
+        return False
+
+    def _competitor_prices(self, sku: str) -> list[int]:
+        prices = self.prices.get(sku)
+        if prices is None:
+            # стабильная базовая цена по SKU, чтобы прогоны были сравнимы
+            base = 2_000 + zlib.crc32(sku.encode()) % 500_000
+            count = 1 + zlib.crc32(sku.encode()[::-1]) % self.competitors
+            prices = self.prices[sku] = [int(base * (0.9 + 0.05 * i)) for i in range(count)]
+        elif self.churn and self.rnd.random() < self.churn:
+            i = self.rnd.randrange(len(prices))
+            prices[i] = max(100, int(prices[i] * self.rnd.uniform(0.95, 1.05)))
+        return prices
+
+    async def offer_view(self, request):
+        await self._delay()
+        if self._throttled("offer_view"):
+            return web.json_response({"error": "Too Many Requests"}, status=429)
+        sku = request.match_info["sku"]
+        offers = [{"merchantId": f"C{i}", "merchantName": f"Competitor {i}", "price": price}
+                  for i, price in enumerate(self._competitor_prices(sku))]
+        return web.json_response({"offers": offers, "total": len(offers)})
+
+    async def merchant_list(self, request):
+        await self._delay()
+        if self._throttled("merchant_list"):
+            return web.json_response({"error": "Too Many Requests"}, status=429)
+        # пустой каталог: двухфазный режим проверит все товары через offer-view
+        return web.json_response({"data": [], "total": 0})
+
+    async def pricefeed(self, request):
+        await self._delay()
+        if self._throttled("pricefeed"):
+            return web.json_response({"error": "Too Many Requests"}, status=429)
+        return web.json_response({"status": "success"})
+
+    async def session(self, request):
+        self.stats["session"] += 1
+        return web.json_response({"merchantUid": "bench"})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/yml/offer-view/offers/{sku}", self.offer_view)
+        app.router.add_get("/bff/offer-view/list", self.merchant_list)
+        app.router.add_post("/pricefeed/upload/merchant/process", self.pricefeed)
+        app.router.add_get("/s/m", self.session)
+        app.router.add_get("/__bench/stats", self.handle_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Kaspi для бенчмарков демпера")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8898)
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.5, help="разброс задержки, доля от средней")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--churn", type=float, default=0.2, help="вероятность смены цены конкурента на запрос")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeKaspi(args.latency, args.jitter, args.rate_429, args.churn, seed=args.seed)
+    web.run_app(fake.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/fixtures.py базовые таблицы Supabase и синтетические магазины/товары для стендов
+"""
+Таблицы products / kaspi_stores / preorders в проде живут в Supabase и schema.py
+их только дорабатывает. Для пустой локальной базы создаём их минимальную версию со всеми
+колонками, которые читают бэкенд и демпер, затем накатываем ensure_schema().
+"""
+import json
+import random
+import uuid
+from contextlib import asynccontextmanager
+
+BASE_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pgcrypto",
+    """
+    CREATE TABLE IF NOT EXISTS kaspi_stores (
+        id             UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        user_id        UUID,
+        merchant_id    TEXT,
+        name           TEXT,
+        api_key        TEXT,
+        guid           JSONB,
+        last_login     TIMESTAMPTZ,
+        products_count INTEGER     DEFAULT 0,
+        last_sync      TIMESTAMPTZ,
+        is_active      BOOLEAN     DEFAULT TRUE,
+        created_at     TIMESTAMPTZ DEFAULT now(),
+        updated_at     TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id                UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        store_id          UUID REFERENCES kaspi_stores (id) ON DELETE CASCADE,
+        kaspi_product_id  TEXT,
+        kaspi_sku         TEXT,
+        external_kaspi_id TEXT,
+        name              TEXT,
+        category          TEXT,
+        image_url         TEXT,
+        price             NUMERIC(12, 2),
+        min_profit        NUMERIC(12, 2),
+        max_profit        NUMERIC(12, 2),
+        bot_active        BOOLEAN     DEFAULT FALSE,
+        strategy          TEXT,
+        created_at        TIMESTAMPTZ DEFAULT now(),
+        updated_at        TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_products_store_id ON products (store_id)",
+    """
+    CREATE TABLE IF NOT EXISTS preorders (
+        id            UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        product_id    UUID REFERENCES products (id) ON DELETE CASCADE,
+        store_id      UUID REFERENCES kaspi_stores (id) ON DELETE CASCADE,
+        article       TEXT,
+        name          TEXT,
+        brand         TEXT,
+        status        TEXT,
+        price         INTEGER,
+        warehouses    JSONB,
+        delivery_days INTEGER,
+        created_at    TIMESTAMP DEFAULT now(),
+        updated_at    TIMESTAMP DEFAULT now(),
+        UNIQUE (product_id, store_id)
+    )
+    """,
+    # как в waha/database.py — WAHA создаёт эти таблицы сам при старте
+    """
+    CREATE TABLE IF NOT EXISTS whatsapp_templates (
+        id            UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        store_id      UUID REFERENCES kaspi_stores (id) ON DELETE CASCADE,
+        template_name VARCHAR(255) NOT NULL,
+        template_text TEXT         NOT NULL,
+        is_active     BOOLEAN   DEFAULT TRUE,
+        created_at    TIMESTAMP DEFAULT NOW(),
+        updated_at    TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS whatsapp_messages_log (
+        id             UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        store_id       UUID REFERENCES kaspi_stores (id) ON DELETE CASCADE,
+        order_id       VARCHAR(255),
+        customer_phone VARCHAR(20) NOT NULL,
+        message_text   TEXT        NOT NULL,
+        template_id    UUID REFERENCES whatsapp_templates (id),
+        status         VARCHAR(50) DEFAULT 'pending',
+        waha_response  JSONB,
+        sent_at        TIMESTAMP   DEFAULT NOW(),
+        delivered_at   TIMESTAMP,
+        error_message  TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_whatsapp_messages_log_store_id ON whatsapp_messages_log (store_id)",
+]
+
+STORE_COLUMNS = ("id", "user_id", "merchant_id", "name", "guid", "last_login")
+PRODUCT_COLUMNS = ("id", "store_id", "kaspi_product_id", "kaspi_sku", "external_kaspi_id", "name", "category",
+                   "price", "min_profit", "max_profit", "bot_active")
+
+# сессия, которую принимает фейковый кабинет (куки не проверяются)
+FAKE_SESSION = json.dumps({"cookies": [{"name": "X-Mc-Api-Session-Id", "value": "bench"}],
+                           "email": None, "password": None})
+
+
+async def create_base_schema(conn) -> None:
+    for statement in BASE_SCHEMA:
+        await conn.execute(statement)
+
+
+@asynccontextmanager
+async def without_change_notifications(conn):
+    """
+    Массовая загрузка товаров без построчного триггера products_notify_changed:
+    иначе на каждую строку COPY — json_build_object и pg_notify, очередь NOTIFY
+    переполняется, а слушающий демпер получает сотни тысяч событий.
+    Триггер выключен только внутри транзакции загрузки.
+    """
+    async with conn.transaction():
+        await conn.execute("ALTER TABLE products DISABLE TRIGGER products_notify_changed")
+        yield
+        await conn.execute("ALTER TABLE products ENABLE TRIGGER products_notify_changed")
+
+
+async def populate(conn, stores: int, products_per_store: int, seed: int = 1, shared_ratio: float = 0.3) -> int:
+    """
+    Магазины и их активные товары. Часть external_kaspi_id общая для нескольких
+    магазинов (shared_ratio) — как в проде, где один мастер-товар продают многие.
+    Возвращает число товаров.
+    """
+    rnd = random.Random(seed)
+    store_rows, product_rows = [], []
+    shared_pool = [str(100_000_000 + i) for i in range(max(1, int(products_per_store * shared_ratio)))]
+    for s in range(stores):
+        store_id = uuid.UUID(int=rnd.getrandbits(128))
+        store_rows.append((store_id, uuid.UUID(int=rnd.getrandbits(128)), f"M{s:06d}", f"Bench store {s}",
+                           FAKE_SESSION, None))
+        for p in range(products_per_store):
+            external_id = rnd.choice(shared_pool) if rnd.random() < shared_ratio else str(200_000_000 + s * 100_000 + p)
+            price = rnd.randint(2_000, 500_000)
+            product_rows.append((uuid.UUID(int=rnd.getrandbits(128)), store_id, f"{s}-{p}", f"SKU{s:05d}{p:06d}",
+                                 external_id, f"Товар {external_id}", "Bench", price, int(price * 0.8),
+                                 int(price * 1.2), True))
+    await conn.copy_records_to_table("kaspi_stores", records=store_rows, columns=STORE_COLUMNS)
+    async with without_change_notifications(conn):
+        await conn.copy_records_to_table("products", records=product_rows, columns=PRODUCT_COLUMNS)
+    return len(product_rows)
@@ -0,0 +1,266 @@
+# benchmarks/hot_functions.py
+# Запуск из backend/:
+#   python -m benchmarks.hot_functions run                      # замер всех функций
+#   python -m benchmarks.hot_functions run --save-baseline      # обновить эталон в репозитории
+#   python -m benchmarks.hot_functions compare --threshold 0.15 # замер и сравнение с эталоном
+"""
+Микробенчмарки чистых функций горячего пути на реалистичных данных: разбор
+офферов и ответов offer-view, куки сессии, аналитика заказов, отзывы,
+предзаказы для Excel, нормализация дат и шаблоны WAHA.
+
+Каждая функция вызывается number раз за раунд, раундов repeat; в результат
+идёт лучшее (min) и медианное время одного вызова в микросекундах. Эталон
+хранится в hot_functions_baseline.json; compare падает с кодом 1, если лучшее
+время хотя бы одной функции хуже эталона больше чем на threshold. Эталон
+зависит от машины — сравнивайте прогоны на одном и том же железе.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "hot_functions_baseline.json")
+DEFAULT_THRESHOLD = 0.15
+SEED = 7
+
+
+# ── Данные ────────────────────────────────────────────────────────────────────
+def raw_offer(rnd: random.Random, n: int) -> dict:
+    """Оффер из offer-view/list кабинета продавца"""
+    master_id = 100_000_000 + rnd.randint(0, 9_999_999)
+    return {
+        "offerId": f"OFFER-{n}",
+        "sku": f"SKU{n:08d}",
+        "masterSku": str(master_id),
+        "masterTitle": f"Смартфон Example Model {n % 977} 128 ГБ черный",
+        "masterCategory": "Smartphones",
+        "minPrice": rnd.randint(1_000, 900_000),
+        "maxPrice": rnd.randint(1_000, 900_000),
+        "images": [f"h{n % 97:02x}/h{n % 89:02x}/{master_id}.jpg"],
+        "shopLink": f"/shop/p/smartfon-example-model-{n % 977}-128gb-chernyi-{master_id}/",
+        "updatedAt": "2025-08-01T10:15:30.000+06:00",
+        "available": True,
+        "brand": "Example",
+    }
+
+
+def offer_view_response(rnd: random.Random, offers: int = 20) -> dict:
+    """Декодированный ответ offer-view/offers со всеми полями, которые отдаёт Kaspi"""
+    return {
+        "offers": [{
+            "merchantId": f"M{rnd.randint(10_000, 99_999)}",
+            "merchantName": f"Магазин {i}",
+            "merchantSku": f"SKU-{i}",
+            "merchantRating": round(rnd.uniform(3.5, 5), 1),
+            "merchantReviewsQuantity": rnd.randint(0, 50_000),
+            "price": rnd.randint(10_000, 500_000),
+            "deliveryType": "DELIVERY",
+            "kaspiDelivery": True,
+            "delivery": "2025-08-03T00:00:00.000+06:00",
+            "pickup": None,
+            "preorder": 0,
+        } for i in range(offers)],
+        "total": offers,
+        "offersCount": offers,
+    }
+
+
+def session_cookies(rnd: random.Random, count: int = 25) -> list:
+    """Куки сессии кабинета в формате Playwright, как они лежат в kaspi_stores.guid"""
+    return [{
+        "name": f"cookie_{i}", "value": f"{rnd.getrandbits(128):032x}", "domain": ".kaspi.kz", "path": "/",
+        "expires": 1_760_000_000 + i, "httpOnly": bool(i % 2), "secure": True, "sameSite": "Lax",
+    } for i in range(count)]
+
+
+def order_tabs(rnd: random.Random, orders: int = 100) -> list:
+    """Две вкладки orderTabs (DELIVERY, PICKUP) по orders заказов"""
+    base = int(datetime(2025, 8, 1).timestamp() * 1000)
+    tabs = []
+    for tab in ("DELIVERY", "PICKUP"):
+        tab_orders = []
+        for i in range(orders):
+            entries = [{
+                "masterProductCode": str(100_000_000 + rnd.randint(0, 300)),
+                "name": f"Товар {rnd.randint(0, 300)}",
+                "quantity": rnd.randint(1, 3),
+                "totalPrice": rnd.randint(1_000, 300_000),
+            } for _ in range(rnd.randint(1, 3))]
+            tab_orders.append({
+                "code": f"{tab}-{i}",
+                "createDate": base - rnd.randint(0, 30 * 86_400_000),
+                "totalPrice": sum(e["totalPrice"] for e in entries),
+                "entries": entries,
+            })
+        tabs.append({"tab": tab, "orders": tab_orders})
+    return tabs
+
+
+def reviews(rnd: random.Random, count: int = 500) -> list:
+    now = datetime.now()
+    return [{"date": (now - timedelta(days=rnd.randint(0, 720))).strftime("%d.%m.%Y"),
+             "rating": rnd.randint(1, 5), "author": f"Покупатель {i}"} for i in range(count)]
+
+
+def preorder_rows(rnd: random.Random, count: int = 500) -> list:
+    """Строки preorders; warehouses приходит как json-строка (jsonb без кодека)"""
+    rows = []
+    for i in range(count):
+        warehouses = [{"id": wid, "quantity": rnd.randint(1, 50)} for wid in range(1, rnd.randint(2, 6))]
+        rows.append({"article": f"SKU{i:06d}", "name": f"Товар {i}", "brand": "Example",
+                     "price": rnd.randint(1_000, 500_000), "warehouses": json.dumps(warehouses)})
+    return rows
+
+
+DATE_STRINGS = (
+    "2025-08-01T10:15:30.000+06:00",
+    "2025-08-01T10:15:30Z",
+    "2025-08-01 10:15:30",
+    "2025-08-01T10:15:30.123456+00:00",
+)
+
+TEMPLATE_TEXT = ("Здравствуйте, {user_name}! Ваш заказ №{order_num} ({product_name}, {item_qty} шт.) "
+                 "в магазине {shop_name} оформлен {order_date}. Доставка: {delivery_type}. "
+                 "Сумма: {total_amount} ₸.")
+ORDER_DATA = {"customer_name": "Айгерим", "order_id": "523456789", "product_name": "Смартфон Example 128 ГБ",
+              "quantity": 2, "shop_name": "Example Store", "delivery_type": "Kaspi Доставка",
+              "order_date": "01.08.2025", "total_amount": 259_980, "customer_phone": "+77011234567"}
+
+
+# ── Набор бенчмарков ─────────────────────────────────────────────────────────
+def build_benchmarks() -> dict:
+    """
+    name -> (функция без аргументов, number). Модули импортируются здесь,
+    чтобы недоступный модуль (например, WAHA без своих зависимостей) пропускал
+    только свой бенчмарк.
+    """
+    rnd = random.Random(SEED)
+    benchmarks = {}
+
+    from offers import map_offer
+    offers = [raw_offer(rnd, n) for n in range(100)]
+    benchmarks["map_offer"] = (lambda: [map_offer(o) for o in offers], 200)
+
+    from api_parser import (calculate_metrics, get_formatted_cookies, map_order_data, map_top_products,
+                            parse_merchant_price_from_offers, process_preorders_for_excel)
+    offer_view = offer_view_response(rnd)
+    benchmarks["parse_merchant_price_from_offers"] = (lambda: parse_merchant_price_from_offers(offer_view), 20_000)
+    cookies = session_cookies(rnd)
+    benchmarks["get_formatted_cookies"] = (lambda: get_formatted_cookies(cookies), 20_000)
+    tabs = order_tabs(rnd)
+    benchmarks["map_order_data"] = (lambda: map_order_data(tabs), 200)
+    benchmarks["map_top_products"] = (lambda: map_top_products(tabs), 200)
+    benchmarks["calculate_metrics"] = (lambda: calculate_metrics(tabs), 2_000)
+    preorders = preorder_rows(rnd)
+    benchmarks["process_preorders_for_excel"] = (lambda: process_preorders_for_excel(preorders), 50)
+
+    from utils import normalize_date_string
+    benchmarks["normalize_date_string"] = (lambda: [normalize_date_string(s) for s in DATE_STRINGS], 5_000)
+
+    from main import analyze_reviews_mapped
+    review_list = reviews(rnd)
+    benchmarks["analyze_reviews_mapped"] = (lambda: analyze_reviews_mapped(review_list, "Смартфон"), 5)
+
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        from waha.template_manager import TemplateManager
+    except Exception as e:  # у WAHA свои зависимости (requirements.txt в waha/)
+        print(f"TemplateManager.process_template пропущен: {e.__class__.__name__}: {e}", file=sys.stderr)
+    else:
+        manager = TemplateManager(db=None)
+        benchmarks["TemplateManager.process_template"] = (
+            lambda: manager.process_template(TEMPLATE_TEXT, ORDER_DATA), 20_000)
+
+    return benchmarks
+
+
+def measure(fn, number: int, repeat: int) -> dict:
+    fn()  # прогрев
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter_ns() - started) / number / 1000)
+    return {"best_us": round(min(rounds), 3), "median_us": round(statistics.median(rounds), 3),
+            "number": number, "repeat": repeat}
+
+
+def run(only: list[str] | None, repeat: int) -> dict:
+    results = {}
+    for name, (fn, number) in build_benchmarks().items():
+        if only and name not in only:
+            continue
+        results[name] = measure(fn, number, repeat)
+        print(f"{name:40s} {results[name]['best_us']:12.3f} мкс", file=sys.stderr)
+    return {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "processor": platform.processor() or platform.machine()},
+        "timestamp": int(time.time()),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Функции, у которых лучшее время хуже эталона больше чем на threshold"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:40s} {'нет в эталоне':>12s}")
+            continue
+        change = result["best_us"] / base["best_us"] - 1
+        flag = "РЕГРЕССИЯ" if change > threshold else ""
+        print(f"{name:40s} {base['best_us']:12.3f} -> {result['best_us']:12.3f} мкс {change:+8.1%} {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки чистых функций горячего пути")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("run", "compare"):
+        p = sub.add_parser(command)
+        p.add_argument("--only", nargs="*", help="только эти бенчмарки")
+        p.add_argument("--repeat", type=int, default=7)
+        p.add_argument("--baseline", default=BASELINE_PATH)
+    sub.choices["run"].add_argument("--output", help="записать результат в файл")
+    sub.choices["run"].add_argument("--save-baseline", action="store_true", help="перезаписать эталон")
+    sub.choices["compare"].add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                        help="допустимое замедление, доля (0.15 = 15%%)")
+    sub.choices["compare"].add_argument("--current", help="сравнить готовый результат вместо нового замера")
+    args = parser.parse_args()
+
+    if args.command == "compare" and args.current:
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run(args.only, args.repeat)
+
+    if args.command == "run":
+        output = args.baseline if args.save_baseline else args.output
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+        else:
+            print(json.dumps(current, ensure_ascii=False, indent=2))
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"Замедление больше {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
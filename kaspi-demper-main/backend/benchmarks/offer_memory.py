@@ -0,0 +1,132 @@
+# benchmarks/offer_memory.py
+# Запуск из backend/: python -m benchmarks.offer_memory --offers 50000
+"""
+Память на один оффер при синхронизации каталога: старый путь (dict на оффер,
+весь каталог списком) против Offer со __slots__ и потоковой обработки страниц.
+"""
+import argparse
+import gc
+import json
+import random
+import re
+import time
+import tracemalloc
+
+from offers import json_loads, map_offer
+
+
+def make_raw_page(page: int, page_size: int, rnd: random.Random) -> bytes:
+    """Страница offer-view/list в том виде, в каком её отдаёт кабинет Kaspi"""
+    offers = []
+    for i in range(page_size):
+        n = page * page_size + i
+        master_id = 100000000 + rnd.randint(0, 9999999)
+        offers.append({
+            "offerId": f"OFFER-{n}",
+            "sku": f"SKU{n:08d}",
+            "masterSku": str(master_id),
+            "masterTitle": f"Смартфон Example Model {n % 977} 128 ГБ черный",
+            "masterCategory": "Smartphones",
+            "minPrice": rnd.randint(1000, 900000),
+            "maxPrice": rnd.randint(1000, 900000),
+            "images": [f"h{n % 97:02x}/h{n % 89:02x}/{master_id}.jpg"],
+            "shopLink": f"/shop/p/smartfon-example-model-{n % 977}-128gb-chernyi-{master_id}/",
+            "updatedAt": "2025-08-01T10:15:30.000+06:00",
+            "available": True,
+            "brand": "Example",
+        })
+    return json.dumps({"data": offers, "total": page_size}).encode()
+
+
+def legacy_map_offer(raw_offer: dict) -> dict:
+    """map_offer до перехода на Offer: dict на оффер и некомпилированная регулярка"""
+    product_url = raw_offer.get("shopLink", "")
+    match = re.search(r'\/p\/.*-(\d+)\/', product_url)
+    external_kaspi_id = match.group(1) if match else None
+
+    return {
+        "kaspi_product_id": raw_offer.get("offerId"),
+        "kaspi_sku": raw_offer.get("sku"),
+        "name": raw_offer.get("masterTitle"),
+        "category": raw_offer.get("masterCategory"),
+        "price": raw_offer.get("minPrice", {}),
+        "image_url": f"https://resources.cdn-kaspi.kz/img/m/p/{raw_offer.get('images', [])[0]}",
+        "external_kaspi_id": external_kaspi_id,
+        "updated_at": raw_offer.get("updatedAt")
+    }
+
+
+def measure(label: str, pages: list[bytes], offers_total: int, fn) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    retained = fn(pages)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retained
+    gc.collect()
+    return {
+        "label": label,
+        "retained_bytes_per_offer": current / offers_total,
+        "peak_bytes_per_offer": peak / offers_total,
+        "seconds": elapsed,
+    }
+
+
+def legacy_path(pages: list[bytes]):
+    # get_products до изменений: json.loads всей страницы и накопление dict в списке
+    all_offers = []
+    for raw in pages:
+        data = json.loads(raw)
+        for o in data.get("data", []):
+            all_offers.append(legacy_map_offer(o))
+    return all_offers
+
+
+def slotted_list_path(pages: list[bytes]):
+    # get_products сейчас: тот же список, но из Offer
+    all_offers = []
+    for raw in pages:
+        for o in json_loads(raw)["data"]:
+            all_offers.append(map_offer(o))
+    return all_offers
+
+
+def streaming_path(pages: list[bytes]):
+    # sync_store_api сейчас: офферы потоком, в памяти только текущая страница
+    seen = 0
+    for raw in pages:
+        for o in json_loads(raw)["data"]:
+            offer = map_offer(o)
+            seen += offer.price > 0
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    page_count = max(1, args.offers // args.page_size)
+    pages = [make_raw_page(p, args.page_size, rnd) for p in range(page_count)]
+    total = page_count * args.page_size
+
+    results = [
+        measure("dict + list (до)", pages, total, legacy_path),
+        measure("Offer + list", pages, total, slotted_list_path),
+        measure("Offer + поток (после)", pages, total, streaming_path),
+    ]
+
+    print(f"Офферов: {total}, страниц: {page_count}")
+    print(f"{'вариант':<24}{'удержано Б/оффер':>18}{'пик Б/оффер':>14}{'сек':>8}")
+    for r in results:
+        print(f"{r['label']:<24}{r['retained_bytes_per_offer']:>18.0f}"
+              f"{r['peak_bytes_per_offer']:>14.0f}{r['seconds']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# checkpoint.py сохранение состояния демпера между перезапусками и корректная остановка
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".")
+# чекпоинт пишем раз в N циклов (и всегда при остановке)
+CHECKPOINT_EVERY = max(1, int(os.getenv("CHECKPOINT_EVERY", "1")))
+# чекпоинт старше этого считаем бесполезным и начинаем с чистого листа
+CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", "3600"))
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(name: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{name}.checkpoint.json")
+
+
+def restore_id(value):
+    """id товара или магазина из JSON чекпоинта: в памяти демпера это uuid.UUID, как отдаёт asyncpg"""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return value
+
+
+def load_checkpoint(path: str) -> dict:
+    """Читает чекпоинт; при отсутствии, порче или устаревании возвращает пустое состояние"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Чекпоинт {path} не прочитан: {e}")
+        return {}
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        logger.warning(f"Чекпоинт {path} другой версии, игнорируем")
+        return {}
+    age = time.time() - state.get("saved_at", 0)
+    if age > CHECKPOINT_MAX_AGE:
+        logger.info(f"Чекпоинт {path} устарел ({age:.0f} сек), игнорируем")
+        return {}
+    return state
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    """Атомарная запись: пишем во временный файл и подменяем им старый"""
+    state = {**state, "version": CHECKPOINT_VERSION, "saved_at": time.time()}
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить чекпоинт {path}: {e}")
+
+
+def install_stop_handlers(stop: asyncio.Event, *on_stop) -> None:
+    """
+    SIGTERM/SIGINT не убивают процесс сразу, а выставляют stop и вызывают on_stop,
+    чтобы перестать брать новую работу; начатое цикл доделывает сам.
+    """
+    loop = asyncio.get_running_loop()
+
+    def request_stop(signame):
+        if stop.is_set():
+            return
+        logger.info(f"Получен {signame}: завершаем начатое и останавливаемся")
+        stop.set()
+        for callback in on_stop:
+            callback()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_stop, sig.name)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows / не главный поток — остаёмся на поведении по умолчанию
+
+
+async def sleep_or_stop(stop: asyncio.Event, seconds: float) -> None:
+    """Пауза между циклами, прерываемая сигналом остановки"""
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
@@ -1,6 +1,11 @@
 import os
+import atexit
+import json
 import logging
+import queue
 import sys
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
 from core.colors import *
 
 LOG_FILE = "logs/api.log"
@@ -87,4 +92,136 @@ def setup_demper_logger():
     ))
     demper_logger.addHandler(demper_file_handler)
     demper_logger.addFilter(NoHttpRequestFilter())
-    return demper_logger
\ No newline at end of file
+    return demper_logger
+
+
+# ── Неблокирующие логи демпера ────────────────────────────────────────────────
+# Запись в файл/консоль делает поток QueueListener, цикл событий только кладёт
+# запись в очередь. Частые сообщения (по одному на товар) помечаются
+# extra={"kind": ...} и прореживаются по LOG_SAMPLING; сколько их было на самом
+# деле, раз в цикл пишет log_sampler.log_cycle_summary().
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() in ("1", "true", "yes")
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+
+
+def _parse_sampling(raw: str) -> dict:
+    """LOG_SAMPLING="price_pushed=0.01,no_competitors=0.1" -> {kind: каждая N-я запись}"""
+    every = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        kind, _, rate = item.partition("=")
+        rate = float(rate or 1)
+        every[kind.strip()] = max(1, round(1 / rate)) if rate > 0 else 0
+    return every
+
+
+LOG_SAMPLING = _parse_sampling(os.getenv("LOG_SAMPLING", ""))
+
+# типы частых сообщений демпера
+KIND_PRICE_PUSHED = "price_pushed"
+KIND_NO_COMPETITORS = "no_competitors"
+KIND_CITY_MINIMUMS = "city_minimums"
+KIND_STAGE_TIMEOUT = "stage_timeout"
+KIND_PRODUCT_ERROR = "product_error"
+KIND_BATCH_SUMMARY = "batch_summary"
+KIND_CYCLE_SUMMARY = "cycle_summary"
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra попадают в неё как есть"""
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает каждую N-ю запись своего kind (N из LOG_SAMPLING, 0 — ни одной).
+    ERROR и выше не прореживаются. Считает все записи по kind для итогов цикла.
+    """
+
+    def __init__(self, every: dict = LOG_SAMPLING):
+        super().__init__()
+        self.every = every
+        self.seen = Counter()
+        self.kept = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        kind = getattr(record, "kind", None)
+        if kind is None or kind == KIND_CYCLE_SUMMARY:
+            return True
+        decided = getattr(record, "_sampled", None)
+        if decided is not None:
+            # запись уже прошла через фильтр другого обработчика — не считаем дважды
+            return decided
+        n = self.seen[kind]
+        self.seen[kind] = n + 1
+        every = self.every.get(kind, 1)
+        keep = record.levelno >= logging.ERROR or (every > 0 and n % every == 0)
+        if keep:
+            self.kept[kind] += 1
+        record._sampled = keep
+        return keep
+
+    def log_cycle_summary(self, target: logging.Logger, cycle: int) -> None:
+        """Сколько частых сообщений было за цикл и сколько из них попало в лог"""
+        if not self.seen:
+            return
+        counts = {kind: {"total": total, "logged": self.kept[kind]} for kind, total in self.seen.items()}
+        self.seen.clear()
+        self.kept.clear()
+        text = ", ".join(f"{kind}: {c['total']} (в логе {c['logged']})" for kind, c in sorted(counts.items()))
+        target.info(f"Сообщения цикла {cycle}: {text}", extra={"kind": KIND_CYCLE_SUMMARY, "counts": counts})
+
+
+log_sampler = SamplingFilter()
+
+
+def async_handlers(*handlers: logging.Handler, filters=()) -> list:
+    """
+    QueueHandler, за которым handlers пишут в отдельном потоке (при LOG_QUEUE=false —
+    сами handlers). filters вешаются на то, что возвращено; LOG_JSON включает JSON.
+    """
+    if LOG_JSON:
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+    if LOG_QUEUE:
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # дописываем очередь при выходе процесса
+        atexit.register(listener.stop)
+        queue_handler = QueueHandler(log_queue)
+        # текст сообщения (с traceback) собирается здесь, оформление — у handlers
+        queue_handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers = (queue_handler,)
+    for handler in handlers:
+        for f in filters:
+            handler.addFilter(f)
+    return list(handlers)
+
+
+def setup_demper_logging(log_file: str, fmt: str, filters=()) -> None:
+    """
+    Корневой логгер демпера: файл и консоль через очередь, прореживание частых
+    сообщений (log_sampler) и фильтры контекста (например, номер шарда)
+    """
+    formatter = logging.Formatter(fmt)
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    stream_handler = logging.StreamHandler()
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+    logging.basicConfig(level=logging.INFO,
+                        handlers=async_handlers(file_handler, stream_handler, filters=(*filters, log_sampler)))
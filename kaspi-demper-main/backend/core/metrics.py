@@ -0,0 +1,266 @@
+# core/metrics.py простые метрики процесса (счётчики с метками) без внешних зависимостей
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    """Монотонный счётчик; значения хранятся по кортежу значений меток"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        return self._values.get(key, 0)
+
+    def samples(self) -> list[tuple[dict, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(dict(zip(self.labels, key)), value) for key, value in items]
+
+
+class Gauge(Counter):
+    """
+    Текущее значение (может уменьшаться). aggregate — как свести значения
+    разных процессов: "sum" для скорости и размеров, "max" для отставаний
+    и для величин, которые все процессы читают из общего источника.
+    """
+
+    AGGREGATES = ("sum", "max")
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), aggregate: str = "sum"):
+        if aggregate not in self.AGGREGATES:
+            raise ValueError(f"Неизвестная агрегация gauge {name}: {aggregate}")
+        super().__init__(name, help_text, labels)
+        self.aggregate = aggregate
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Распределение значений по корзинам (как в Prometheus) с оценкой перцентилей"""
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[tuple, list[int]] = {}  # последняя ячейка — значения выше всех корзин
+        self._sums: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def samples(self) -> list[tuple[dict, float]]:
+        """Накопительные счётчики по корзинам с меткой le (последняя — "+Inf")"""
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._counts.items()]
+        result = []
+        for key, counts in items:
+            total = 0
+            for bound, count in zip((*map(str, self.buckets), "+Inf"), counts):
+                total += count
+                result.append(({**dict(zip(self.labels, key)), "le": bound}, total))
+        return result
+
+    def sums(self) -> list[tuple[dict, float]]:
+        with self._lock:
+            items = list(self._sums.items())
+        return [(dict(zip(self.labels, key)), value) for key, value in items]
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        return sum(self._counts.get(key, ()))
+
+    def counts(self, **labels) -> list[int]:
+        """Некумулятивные счётчики по корзинам (последний — выше всех корзин)"""
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            return list(self._counts.get(key, [0] * (len(self.buckets) + 1)))
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """Оценка перцентиля линейной интерполяцией внутри корзины; None — нет наблюдений"""
+        return bucket_quantile(self.buckets, self.counts(**labels), q)
+
+
+def bucket_quantile(buckets, counts, q: float) -> float | None:
+    """Перцентиль по счётчикам корзин (например, по разнице двух снимков counts())"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if i == len(buckets):
+                return buckets[-1]  # выше последней корзины точнее не оценить
+            lower = buckets[i - 1] if i else 0.0
+            return lower + (buckets[i] - lower) * (rank - seen) / count
+        seen += count
+    return buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def metrics(self) -> list:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+
+registry = Registry()
+
+
+def counter(name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+    """Счётчик из общего реестра (повторный вызов с тем же именем вернёт тот же объект)"""
+    return registry.register(Counter(name, help_text, labels))
+
+
+def gauge(name: str, help_text: str, labels: tuple[str, ...] = (), aggregate: str = "sum") -> Gauge:
+    return registry.register(Gauge(name, help_text, labels, aggregate))
+
+
+def histogram(name: str, help_text: str, labels: tuple[str, ...] = (), buckets=Histogram.DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help_text, labels, buckets))
+
+
+# ── Текстовый формат Prometheus ───────────────────────────────────────────────
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus() -> str:
+    """Все метрики реестра в текстовом формате экспозиции Prometheus (0.0.4)"""
+    lines = []
+    for metric in registry.metrics():
+        kind = type(metric).__name__.lower()
+        lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        if isinstance(metric, Histogram):
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}_bucket{_format_labels(labels)} {_format_value(value)}")
+                if labels["le"] == "+Inf":
+                    base = {k: v for k, v in labels.items() if k != "le"}
+                    lines.append(f"{metric.name}_count{_format_labels(base)} {_format_value(value)}")
+            for labels, value in metric.sums():
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(value)}")
+        else:
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ── Снимки для агрегации между процессами ─────────────────────────────────────
+# каталог, куда воркеры под супервизором пишут свои снимки (см. supervisor.py)
+METRICS_DIR = os.getenv("METRICS_DIR")
+
+
+def _metric_snapshot(metric) -> dict:
+    data = {
+        "type": type(metric).__name__.lower(),
+        "help": metric.help,
+        "labels": list(metric.labels),
+        "samples": [[labels, value] for labels, value in metric.samples()],
+    }
+    if isinstance(metric, Histogram):
+        data["sums"] = [[labels, value] for labels, value in metric.sums()]
+    if isinstance(metric, Gauge):
+        data["aggregate"] = metric.aggregate
+    return data
+
+
+def snapshot() -> dict:
+    """Значения всех метрик реестра в виде, пригодном для JSON"""
+    return {metric.name: _metric_snapshot(metric) for metric in registry.metrics()}
+
+
+def merge_snapshots(snapshots) -> dict:
+    """
+    Сводит снимки нескольких процессов по имени метрики и значениям меток:
+    счётчики и гистограммы суммирует, gauge — по своей агрегации (сумма или максимум)
+    """
+    merged: dict = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, {**metric, "samples": {}, **({"sums": {}} if "sums" in metric else {})})
+            for field in ("samples", "sums"):
+                for labels, value in metric.get(field, ()):
+                    key = tuple(sorted(labels.items()))
+                    if key in target[field] and metric.get("aggregate") == "max":
+                        # например, отставание магазина: берём худшее значение среди шардов
+                        target[field][key] = max(target[field][key], value)
+                    else:
+                        target[field][key] = target[field].get(key, 0) + value
+    for metric in merged.values():
+        for field in ("samples", "sums"):
+            if field in metric:
+                metric[field] = [[dict(key), value] for key, value in metric[field].items()]
+    return merged
+
+
+def write_snapshot(name: str, extra: dict | None = None) -> None:
+    """Атомарно пишет снимок метрик процесса в METRICS_DIR/<name>.json (если каталог задан)"""
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{name}.json")
+    data = {"pid": os.getpid(), "written_at": time.time(), "metrics": snapshot(), **(extra or {})}
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Не удалось записать снимок метрик {path}: {e}")
@@ -0,0 +1,49 @@
+# core/metrics_server.py лёгкий HTTP-эндпоинт /metrics (формат Prometheus) внутри процесса демпера
+import inspect
+import logging
+import os
+
+from aiohttp import web
+
+from core.metrics import render_prometheus
+
+logger = logging.getLogger(__name__)
+
+# порт эндпоинта; 0 — не поднимать. Инстансы под супервизором прибавляют свой INSTANCE_INDEX
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def start_metrics_server(port: int = METRICS_PORT, collectors=()) -> web.AppRunner | None:
+    """
+    Поднимает /metrics на aiohttp в текущем цикле событий. collectors — функции
+    (обычные или async), которые обновляют gauge перед каждым чтением метрик.
+    """
+    if port <= 0:
+        return None
+
+    async def handle_metrics(_request):
+        for collect in collectors:
+            try:
+                result = collect()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Сборщик метрик {getattr(collect, '__name__', collect)} упал: {e}")
+        return web.Response(body=render_prometheus().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        # метрики не должны мешать демперу работать
+        logger.error(f"Не удалось открыть порт метрик {port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Метрики демпера: http://{METRICS_HOST}:{port}/metrics")
+    return runner
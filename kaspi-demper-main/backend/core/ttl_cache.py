@@ -0,0 +1,43 @@
+# core/ttl_cache.py кэш значений с временем жизни и ограничением размера в памяти процесса
+import time
+
+
+class TTLCache:
+    """
+    Значения по ключу, которые живут ttl секунд. При переполнении сначала
+    выкидываются просроченные, затем самые старые. ttl <= 0 выключает кэш.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: dict = {}  # key -> (время записи, значение)
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        stored_at, value = item
+        if time.time() - stored_at > self.ttl:
+            del self._items[key]
+            return default
+        return value
+
+    def put(self, key, value, stored_at: float | None = None) -> None:
+        if self.ttl <= 0:
+            return
+        if len(self._items) >= self.max_size:
+            self.evict_expired()
+            if len(self._items) >= self.max_size:
+                # словарь упорядочен по вставке — выкидываем самую старую запись
+                del self._items[next(iter(self._items))]
+        self._items.pop(key, None)
+        self._items[key] = (stored_at if stored_at is not None else time.time(), value)
+
+    def evict_expired(self) -> None:
+        deadline = time.time() - self.ttl
+        for key in [k for k, (stored_at, _) in self._items.items() if stored_at < deadline]:
+            del self._items[key]
+
+    def __len__(self):
+        return len(self._items)
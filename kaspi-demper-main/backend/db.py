@@ -1,9 +1,22 @@
 import asyncpg
 import asyncio
+import os
 
 _pool: asyncpg.Pool | None = None
 _lock = asyncio.Lock()
 
+_CONNECT_KWARGS = dict(
+    user="demper_user",
+    password="tUrGenTLaMySHWARestOrecKERguEb",
+    database="demper",
+    host="95.179.187.42",
+    port=6432,
+)
+
+# строка подключения вместо _CONNECT_KWARGS — только для бенчмарков (benchmarks/) с отдельной базой.
+# Намеренно не DATABASE_URL: она уже приходит в контейнеры из docker-compose и не должна менять прод
+BENCH_DATABASE_URL = os.getenv("DEMPER_BENCH_DATABASE_URL") or None
+
 
 async def create_pool() -> asyncpg.Pool:
     """Возвращает пул соединений (синглтон). Пересоздаёт, если закрыт."""
@@ -12,11 +25,8 @@ async def create_pool() -> asyncpg.Pool:
     async with _lock:  # защищаем от одновременного вызова
         if _pool is None or _pool._closed:
             _pool = await asyncpg.create_pool(
-                user="demper_user",
-                password="tUrGenTLaMySHWARestOrecKERguEb",
-                database="demper",
-                host="95.179.187.42",
-                port=6432,
+                BENCH_DATABASE_URL,
+                **({} if BENCH_DATABASE_URL else _CONNECT_KWARGS),
                 min_size=10,
                 max_size=50,
                 max_queries=50000,
@@ -30,4 +40,19 @@ async def close_pool():
     global _pool
     if _pool and not _pool._closed:
         await _pool.close()
-        _pool = None
\ No newline at end of file
+        _pool = None
+
+
+# прямой адрес Postgres (минуя pgbouncer) для LISTEN/NOTIFY; пусто — индекс товаров опрашивает БД
+DATABASE_LISTEN_URL = os.getenv("DATABASE_LISTEN_URL") or BENCH_DATABASE_URL
+
+
+async def create_listen_connection() -> asyncpg.Connection:
+    """
+    Отдельное долгоживущее соединение для LISTEN/NOTIFY.
+    pgbouncer в transaction-режиме LISTEN не поддерживает и молча теряет
+    уведомления, поэтому нужен прямой адрес Postgres в DATABASE_LISTEN_URL.
+    """
+    if not DATABASE_LISTEN_URL:
+        raise RuntimeError("DATABASE_LISTEN_URL не задан: LISTEN через pgbouncer не работает")
+    return await asyncpg.connect(DATABASE_LISTEN_URL, timeout=30)
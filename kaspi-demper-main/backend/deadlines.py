@@ -0,0 +1,108 @@
+# deadlines.py таймауты HTTP-запросов к Kaspi и дедлайны этапов цикла демпера
+"""
+У цикла есть бюджет времени (CYCLE_TIME_BUDGET). Каждый этап обработки товара —
+поиск конкурентов (lookup), отправка цены (push), запись в БД (db) — получает
+таймаут min(лимит этапа, остаток бюджета цикла) и отменяется по его истечении.
+Товар, не уложившийся в дедлайн, помечается как timeout и переносится на
+следующий цикл (или возвращается в очередь с задержкой), а не держит слот
+семафора и gather цикла.
+
+Дедлайн цикла передаётся через contextvar, поэтому задачи, созданные внутри
+цикла (gather, drain очереди), видят его без явной передачи аргументом.
+"""
+import asyncio
+import contextvars
+import os
+import time
+
+import aiohttp
+
+from core.metrics import counter, histogram
+
+# ── HTTP-таймауты Kaspi ───────────────────────────────────────────────────────
+KASPI_CONNECT_TIMEOUT = float(os.getenv("KASPI_CONNECT_TIMEOUT", "5"))
+KASPI_READ_TIMEOUT = float(os.getenv("KASPI_READ_TIMEOUT", "15"))
+KASPI_TOTAL_TIMEOUT = float(os.getenv("KASPI_TOTAL_TIMEOUT", "20"))
+
+kaspi_http_timeout = aiohttp.ClientTimeout(
+    total=KASPI_TOTAL_TIMEOUT, connect=KASPI_CONNECT_TIMEOUT, sock_read=KASPI_READ_TIMEOUT)
+
+# ── Дедлайны этапов ───────────────────────────────────────────────────────────
+STAGE_FETCH = "fetch"    # список активных товаров цикла (без дедлайна)
+STAGE_LOOKUP = "lookup"
+STAGE_DECIDE = "decide"  # пакетный расчёт цен (без дедлайна)
+STAGE_PUSH = "push"
+STAGE_DB = "db"
+STAGES = (STAGE_FETCH, STAGE_LOOKUP, STAGE_DECIDE, STAGE_PUSH, STAGE_DB)
+
+# бюджет одного цикла демпера, сек (0 — без ограничения)
+CYCLE_TIME_BUDGET = float(os.getenv("CYCLE_TIME_BUDGET", "600"))
+# потолок на один товар для каждого этапа, сек
+STAGE_TIMEOUTS = {
+    STAGE_LOOKUP: float(os.getenv("STAGE_TIMEOUT_LOOKUP", "30")),
+    STAGE_PUSH: float(os.getenv("STAGE_TIMEOUT_PUSH", "30")),
+    STAGE_DB: float(os.getenv("STAGE_TIMEOUT_DB", "10")),
+}
+# через сколько секунд повторять задачу очереди, не уложившуюся в дедлайн
+TIMEOUT_RETRY_DELAY = float(os.getenv("TIMEOUT_RETRY_DELAY", "30"))
+
+stage_seconds = histogram("demper_stage_seconds", "Длительность этапов обработки товара", ("stage",))
+stage_timeouts = counter("demper_stage_timeouts_total", "Этапы, не уложившиеся в дедлайн", ("stage",))
+
+# момент (time.monotonic), к которому должен закончиться текущий цикл
+_cycle_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("cycle_deadline", default=None)
+
+
+class StageTimeout(Exception):
+    """Этап не уложился в свой дедлайн или в остаток бюджета цикла"""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"этап {stage} не уложился в {timeout:.1f} сек")
+        self.stage = stage
+
+
+def start_cycle_deadline(budget: float = CYCLE_TIME_BUDGET) -> None:
+    """Начинает отсчёт бюджета цикла для всего, что выполняется дальше в этой задаче"""
+    _cycle_deadline.set(time.monotonic() + budget if budget > 0 else None)
+
+
+def stage_timeout(stage: str) -> float:
+    """Таймаут этапа: его потолок, но не дольше остатка бюджета цикла"""
+    timeout = STAGE_TIMEOUTS[stage]
+    deadline = _cycle_deadline.get()
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+    return max(timeout, 0.0)
+
+
+async def run_stage(stage: str, awaitable):
+    """
+    Выполняет этап с его дедлайном. По истечении отменяет его и поднимает
+    StageTimeout; таймауты aiohttp внутри этапа тоже считаются timeout.
+    """
+    timeout = stage_timeout(stage)
+    started = time.monotonic()
+    try:
+        if timeout <= 0:
+            # бюджет цикла исчерпан — не начинаем, а сразу переносим
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        stage_timeouts.inc(stage=stage)
+        raise StageTimeout(stage, timeout) from None
+    finally:
+        stage_seconds.observe(time.monotonic() - started, stage=stage)
+
+
+def stage_latency_summary() -> str:
+    """p50 / p90 / p99 по этапам с начала работы процесса, для лога цикла"""
+    parts = []
+    for stage in STAGES:
+        if not stage_seconds.count(stage=stage):
+            continue
+        p50, p90, p99 = (stage_seconds.quantile(q, stage=stage) for q in (0.5, 0.9, 0.99))
+        timeouts = int(stage_timeouts.value(stage=stage))
+        parts.append(f"{stage} p50={p50:.2f} p90={p90:.2f} p99={p99:.2f} timeout={timeouts}")
+    return "; ".join(parts)
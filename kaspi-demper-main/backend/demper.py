@@ -2,14 +2,23 @@
 # nohup python3 demper.py > demper.log 2>&1 &
 import asyncio
 import logging
-import random
 import time
-from decimal import Decimal
 
-from supabase import create_client, Client
-
-from api_parser import parse_product_by_sku, sync_product, sync_store_api  # ваши функции
+from checkpoint import (CHECKPOINT_EVERY, checkpoint_path, install_stop_handlers, load_checkpoint, save_checkpoint,
+                        sleep_or_stop)
+from core.logger import log_sampler, setup_demper_logging
+from core.metrics import write_snapshot
+from core.metrics_server import METRICS_PORT, start_metrics_server
+from deadlines import stage_latency_summary, start_cycle_deadline
 from db import create_pool
+from history_writer import history_writer
+from product_index import ActiveProductIndex
+from job_queue import JobWorker
+from repricing import (USE_JOB_QUEUE, city_request_summary, dump_state, enqueue_cycle, job_handlers, lag_summary,
+                       metrics_collectors, observe_fetch, products_for_cycle, record_cycle, refresh_store_settings,
+                       reprice_batch, request_stop, restore_state, shutdown, sync_store)
+from run_report import begin_cycle, finish_cycle
+from schema import ensure_schema
 
 logging.getLogger("postgrest").setLevel(logging.WARNING)
 
@@ -21,9 +30,6 @@ for lib in ("supabase", "httpx", "httpcore", "urllib3", "postgrest", "gotrue"):
     lg.setLevel(logging.WARNING)
     lg.propagate = False
 
-MAX_CONCURRENT_TASKS = 100
-semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
-
 
 class NoHttpRequestFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
@@ -32,118 +38,95 @@ class NoHttpRequestFilter(logging.Filter):
 
 
 logging.getLogger().addFilter(NoHttpRequestFilter())
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[logging.FileHandler("price_worker.log", encoding="utf-8"), logging.StreamHandler()]
-)
+# файл и консоль пишет отдельный поток, частые сообщения прореживаются (core/logger.py)
+setup_demper_logging("price_worker.log", "%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("price_worker")
 
 
-# добавляем фильтр на уровень корневого логгера
+async def check_and_update_prices():
+    clogger = logging.getLogger("price_checker")
+    clogger.setLevel(logging.INFO)
+    pool = await create_pool()
+    await ensure_schema(pool)
 
+    # активные товары держим в памяти, изменения приходят через LISTEN/NOTIFY
+    index = ActiveProductIndex()
+    await index.start(pool)
 
-async def process_product(product, clogger, pool):
-    """Обрабатывает данные о продукте и обновляет цену в базе данных Supabase"""
-    start_time = time.time()
-    # clogger.info(f"Начинаем обработку продукта [{product['kaspi_sku']}]")
+    # задачи из demper_jobs (от API, синхронизации и других процессов) разбираем в фоне
+    handlers, batch_handlers = job_handlers(pool, clogger)
+    worker = JobWorker(pool, handlers, batch_handlers=batch_handlers)
+    worker_task = asyncio.create_task(worker.run_forever())
 
-    async with semaphore:
-        product_id = product["id"]
-        product_external_id = product["external_kaspi_id"]
-        sku = product["kaspi_sku"]
-        current_price = Decimal(product["price"])
-        min_profit = Decimal(product['min_profit']) if product['min_profit'] else Decimal('0.00')
-        try:
-            product_data = await parse_product_by_sku(str(product_external_id))
-            if product_data and len(product_data):
-                min_offer_price = min(Decimal(offer["price"]) for offer in product_data)
-
-                if current_price > max(min_offer_price, min_profit):
-                    new_price = min_offer_price - Decimal('1.00')
-
-                    # Синхронизация с базой данных
-                    sync_result = await sync_product(product_id, new_price)
-
-                    if sync_result.get('success'):
-                        # Получаем соединение с базой данных
-                        async with pool.acquire() as connection:
-                            # Обновляем цену продукта в Supabase
-                            await connection.execute(
-                                """
-                                UPDATE products
-                                SET price = $1
-                                WHERE id = $2
-                                """,
-                                int(new_price), product_id
-                            )
-                        clogger.info(f"Демпер: Успешно - [{sku}] -> {new_price}")
-            else:
-                clogger.warning(f"Конкурентов нет [{sku}]")
-        except Exception as e:
-            clogger.error(f"Ошибка при обработке продукта [{sku}]: {e}")
-            # traceback.print_exc()
-        # Пауза для имитации случайной задержки между запросами
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-    elapsed_time = time.time() - start_time
-    clogger.info(f"Время обработки продукта [{product['kaspi_sku']}]: {elapsed_time:.2f} секунд")
-
-
-async def fetch_products(pool):
-    """Асинхронно извлекает список продуктов из базы данных Supabase через пул соединений"""
-    async with pool.acquire() as connection:
-        query = """
-        SELECT id, store_id, kaspi_sku, external_kaspi_id, price, min_profit
-        FROM products
-        WHERE bot_active = TRUE
-        """
-        products = await connection.fetch(query)
-        return products
-
-
-async def sync_store(sid, clogger):
-    """Синхронизация магазина"""
-    async with semaphore:
-        try:
-            result = await sync_store_api(sid)
-            clogger.info(f"Синхронизирован магазин {sid}: {result}")
-        except Exception as e:
-            clogger.error(f"Ошибка sync_store_api для {sid}: {e}", exc_info=True)
+    # история цен конкурентов и решений пишется пачками в фоне (PRICE_HISTORY)
+    history_writer.start(pool)
 
+    # тёплый старт: номер цикла и свежие снимки конкурентов из чекпоинта
+    checkpoint_file = checkpoint_path("demper")
+    cycle = restore_state(load_checkpoint(checkpoint_file), clogger)
 
-async def check_and_update_prices():
-    clogger = logging.getLogger("price_checker")
-    clogger.setLevel(logging.INFO)
-    pool = await create_pool()
+    # по SIGTERM перестаём брать новую работу, доделываем начатое и выходим
+    stop = asyncio.Event()
+    install_stop_handlers(stop, request_stop, worker.stop)
 
-    while True:
+    # /metrics в формате Prometheus
+    metrics_runner = await start_metrics_server(METRICS_PORT, metrics_collectors(pool))
+
+    while not stop.is_set():
+        cycle_started = time.monotonic()
+        checked = 0
+        begin_cycle("demper", cycle)
         try:
+            # у каждого этапа дедлайн не дольше остатка бюджета цикла (deadlines.py)
+            start_cycle_deadline()
             clogger.info("Начинаем работу демпера...")
-            products = await fetch_products(pool)
+            await index.ensure_fresh()
+            await refresh_store_settings(pool)
+            products = index.products()
+            observe_fetch(cycle_started)
             clogger.info(f"Нашли {len(products)} активных продуктов.")
 
-            # Список задач для обработки продуктов
-            tasks = []
-            for product in products:
-                task = asyncio.create_task(process_product(product, clogger, pool))
-                tasks.append(task)
-
-            # Ограничиваем количество одновременно выполняемых задач
-            await asyncio.gather(*tasks)
+            # В двухфазном режиме конкурентов запрашиваем только для кандидатов
+            to_check = await products_for_cycle(products, cycle, clogger)
+            checked = len(to_check)
 
-            # Список задач для синхронизации магазинов
             store_ids = {p["store_id"] for p in products}
-            clogger.info(f"Найдено {len(store_ids)} магазинов для синхронизации.")
 
-            # Обрабатываем каждый магазин по очереди
-            for sid in store_ids:
-                await sync_store(sid, clogger)  # Синхронизируем магазин последовательно
+            if USE_JOB_QUEUE:
+                # задачи разбирают все процессы демпера, а не только этот
+                await enqueue_cycle(pool, to_check, store_ids, clogger)
+                await worker.drain()
+            else:
+                # Поиск конкурентов и пакетный расчёт цен
+                await reprice_batch(to_check, clogger, pool)
+
+                # Список задач для синхронизации магазинов
+                clogger.info(f"Найдено {len(store_ids)} магазинов для синхронизации.")
+
+                # Обрабатываем каждый магазин по очереди
+                for sid in store_ids:
+                    await sync_store(sid, clogger)  # Синхронизируем магазин последовательно
 
         except Exception as e:
             clogger.error(f"Error during price check/update: {e}", exc_info=True)
 
-        await asyncio.sleep(5)
+        record_cycle(cycle_started, checked)
+        await finish_cycle(pool)
+        clogger.info(f"Запросы offer-view по городам: {city_request_summary()}")
+        clogger.info(f"Наибольшее отставание проверки по магазинам: {lag_summary()}")
+        clogger.info(f"Длительность этапов, сек: {stage_latency_summary()}")
+        log_sampler.log_cycle_summary(clogger, cycle)
+        cycle += 1
+        if cycle % CHECKPOINT_EVERY == 0:
+            # состояние снимаем в цикле событий, а пишем файл в отдельном потоке
+            await asyncio.to_thread(save_checkpoint, checkpoint_file, dump_state(cycle))
+        # снимок метрик для супервизора (если запущены под supervisor.py)
+        await asyncio.to_thread(write_snapshot, "demper", {"cycle": cycle})
+        await sleep_or_stop(stop, 5)
+
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await shutdown(worker, worker_task, index, checkpoint_file, cycle, clogger)
 
 
 if __name__ == "__main__":
@@ -2,12 +2,24 @@
 import asyncio
 import logging
 import os
-import random
 import time
-from decimal import Decimal
 
-from api_parser import parse_product_by_sku, sync_product, sync_store_api  # твои функции
+from checkpoint import (CHECKPOINT_EVERY, checkpoint_path, install_stop_handlers, load_checkpoint, save_checkpoint,
+                        sleep_or_stop)
+from core.logger import log_sampler, setup_demper_logging
+from core.metrics import write_snapshot
+from core.metrics_server import METRICS_PORT, start_metrics_server
+from deadlines import stage_latency_summary, start_cycle_deadline
 from db import create_pool  # должен возвращать asyncpg-пул
+from fair_scheduler import fair_scheduler
+from history_writer import history_writer
+from product_index import ActiveProductIndex
+from job_queue import JobWorker
+from repricing import (USE_JOB_QUEUE, city_request_summary, dump_state, enqueue_cycle, job_handlers, lag_summary,
+                       metrics_collectors, observe_fetch, products_for_cycle, record_cycle, refresh_store_settings,
+                       reprice_batch, request_stop, restore_state, shutdown, sync_store)
+from run_report import begin_cycle, finish_cycle
+from schema import ensure_schema
 
 # ── Параметры шардирования ────────────────────────────────────────────────────
 INSTANCE_INDEX = int(os.getenv("INSTANCE_INDEX", "0"))  # 0..N-1
@@ -23,15 +35,8 @@ class NoHttpRequestFilter(logging.Filter):
         return not record.getMessage().startswith("HTTP Request:")
 
 
-logging.getLogger().addFilter(NoHttpRequestFilter())
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s [shard %(shard_idx)s/%(shard_cnt)s] %(message)s",
-    handlers=[logging.FileHandler("price_worker.log", encoding="utf-8"), logging.StreamHandler()]
-)
-
-
-# добавим значения шардов во все записи логов
+# добавим значения шардов во все записи логов (фильтр висит на обработчиках,
+# поэтому доходит и до записей логгеров других модулей)
 class ShardContext(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         record.shard_idx = INSTANCE_INDEX
@@ -39,95 +44,15 @@ class ShardContext(logging.Filter):
         return True
 
 
-logger = logging.getLogger("price_worker")
-logger.addFilter(ShardContext())
-
-# ── Параллелизм внутри инстанса ───────────────────────────────────────────────
-MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", "100"))
-semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
-
-
-# ── Логика обработки товара ───────────────────────────────────────────────────
-async def process_product(product, clogger, pool):
-    """Обрабатывает данные о продукте и обновляет цену в БД"""
-    start_time = time.time()
+logging.getLogger().addFilter(NoHttpRequestFilter())
+# файл и консоль пишет отдельный поток, частые сообщения прореживаются (core/logger.py)
+setup_demper_logging("price_worker.log", "%(asctime)s %(levelname)s [shard %(shard_idx)s/%(shard_cnt)s] %(message)s",
+                     filters=(ShardContext(),))
 
-    async with semaphore:
-        product_id = product["id"]
-        product_external_id = product["external_kaspi_id"]
-        sku = product["kaspi_sku"]
-        current_price = Decimal(product["price"])
-        min_profit = Decimal(product['min_profit']) if product['min_profit'] else Decimal('0.00')
-        try:
-            product_data = await parse_product_by_sku(str(product_external_id))
-            if product_data and len(product_data):
-                min_offer_price = min(Decimal(offer["price"]) for offer in product_data)
-
-                if current_price > max(min_offer_price, min_profit):
-                    new_price = min_offer_price - Decimal('1.00')
-
-                    # Синхронизация с внешней системой (если требуется)
-                    sync_result = await sync_product(product_id, new_price)
-
-                    if sync_result.get('success'):
-                        # Обновляем цену продукта в нашей БД
-                        async with pool.acquire() as connection:
-                            await connection.execute(
-                                """
-                                UPDATE products
-                                SET price = $1
-                                WHERE id = $2
-                                """,
-                                int(new_price), product_id
-                            )
-                        clogger.info(f"Демпер: OK [{sku}] -> {new_price}")
-            else:
-                clogger.warning(f"Конкурентов нет [{sku}]")
-        except Exception as e:
-            clogger.error(f"Ошибка при обработке продукта [{sku}]: {e}", exc_info=False)
-
-        # легкая рандомная задержка, чтобы не долбить API синхронно
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-    elapsed_time = time.time() - start_time
-    clogger.info(f"Время обработки [{sku}]: {elapsed_time:.2f} сек")
-
-
-# ── Выборка шардов ────────────────────────────────────────────────────────────
-async def fetch_products(pool):
-    """
-    Извлекаем только свой шард:
-      - если id INT:     (id % INSTANCE_COUNT) = INSTANCE_INDEX
-      - если id UUID:    mod(abs(hashtext(id::text)), INSTANCE_COUNT) = INSTANCE_INDEX
-    """
-    async with pool.acquire() as connection:
-        if ID_IS_UUID:
-            query = """
-                    SELECT id, store_id, kaspi_sku, external_kaspi_id, price, min_profit
-                    FROM products
-                    WHERE bot_active = TRUE
-                      AND mod(abs(hashtext(id::text)), $1) = $2 \
-                    """
-        else:
-            query = """
-                    SELECT id, store_id, kaspi_sku, external_kaspi_id, price, min_profit
-                    FROM products
-                    WHERE bot_active = TRUE
-                      AND mod(abs(hashtext(id::text)), $1) = $2 \
-                    """
-        return await connection.fetch(query, INSTANCE_COUNT, INSTANCE_INDEX)
+logger = logging.getLogger("price_worker")
 
 
 # ── Синхронизация магазинов ───────────────────────────────────────────────────
-async def sync_store(sid, clogger):
-    async with semaphore:
-        try:
-            result = await sync_store_api(sid)
-            clogger.info(f"Синхронизирован магазин {sid}: {result}")
-        except Exception as e:
-            clogger.error(f"Ошибка sync_store_api для {sid}: {e}", exc_info=False)
-
-
 def _should_sync_stores_for_sid(sid: int) -> bool:
     """Если распределяем синхронизацию по шардам (SYNC_STORES_MODE=shard)"""
     if SYNC_STORES_MODE != "shard":
@@ -143,39 +68,98 @@ def _should_sync_stores_for_sid(sid: int) -> bool:
 # ── Главный цикл ──────────────────────────────────────────────────────────────
 async def check_and_update_prices():
     clogger = logging.getLogger("price_checker")
-    clogger.addFilter(ShardContext())
     clogger.setLevel(logging.INFO)
 
     pool = await create_pool()
-
-    while True:
+    await ensure_schema(pool)
+
+    # активные товары держим в памяти, изменения приходят через LISTEN/NOTIFY
+    index = ActiveProductIndex(shard=(INSTANCE_INDEX, INSTANCE_COUNT))
+    await index.start(pool)
+    # товары магазина делятся между шардами, часовая квота магазина — тоже
+    fair_scheduler.quota_share = 1 / max(1, INSTANCE_COUNT)
+
+    # задачи из demper_jobs (от API, синхронизации и других инстансов) разбираем в фоне
+    handlers, batch_handlers = job_handlers(pool, clogger)
+    worker = JobWorker(pool, handlers, batch_handlers=batch_handlers)
+    worker_task = asyncio.create_task(worker.run_forever())
+
+    # история цен конкурентов и решений пишется пачками в фоне (PRICE_HISTORY)
+    history_writer.start(pool)
+
+    # тёплый старт: номер цикла и свежие снимки конкурентов из чекпоинта;
+    # в имени и число шардов — после перераспределения чужое состояние не подхватываем
+    checkpoint_file = checkpoint_path(f"demper_{INSTANCE_INDEX}_of_{INSTANCE_COUNT}")
+    cycle = restore_state(load_checkpoint(checkpoint_file), clogger)
+
+    # по SIGTERM перестаём брать новую работу, доделываем начатое и выходим
+    stop = asyncio.Event()
+    install_stop_handlers(stop, request_stop, worker.stop)
+
+    # /metrics в формате Prometheus
+    metrics_runner = await start_metrics_server(METRICS_PORT + INSTANCE_INDEX if METRICS_PORT else 0, metrics_collectors(pool))
+
+    while not stop.is_set():
+        cycle_started = time.monotonic()
+        checked = 0
+        begin_cycle(f"demper_{INSTANCE_INDEX}", cycle)
         try:
+            # у каждого этапа дедлайн не дольше остатка бюджета цикла (deadlines.py)
+            start_cycle_deadline()
             clogger.info("Старт цикла демпера...")
-            products = await fetch_products(pool)
+            await index.ensure_fresh()
+            await refresh_store_settings(pool)
+            products = index.products()
+            observe_fetch(cycle_started)
             clogger.info(f"Найдено {len(products)} активных продуктов в моём шарде.")
 
-            # обработка товаров
-            tasks = [asyncio.create_task(process_product(p, clogger, pool)) for p in products]
-            if tasks:
-                await asyncio.gather(*tasks)
+            # в двухфазном режиме конкурентов запрашиваем только для кандидатов
+            to_check = await products_for_cycle(products, cycle, clogger)
+            checked = len(to_check)
 
-            # синхронизация магазинов
+            # магазины, которые синхронизирует этот инстанс
             store_ids = {p["store_id"] for p in products}
-            if store_ids:
-                if SYNC_STORES_MODE == "leader" and INSTANCE_INDEX == 0:
-                    clogger.info(f"[leader] Синхронизируем {len(store_ids)} магазинов.")
-                    for sid in store_ids:
-                        await sync_store(sid, clogger)
-                elif SYNC_STORES_MODE == "shard":
-                    my_store_ids = [sid for sid in store_ids if _should_sync_stores_for_sid(sid)]
-                    clogger.info(f"[shard] Моих магазинов: {len(my_store_ids)}")
+            if SYNC_STORES_MODE == "leader":
+                my_store_ids = list(store_ids) if INSTANCE_INDEX == 0 else []
+            elif SYNC_STORES_MODE == "shard":
+                my_store_ids = [sid for sid in store_ids if _should_sync_stores_for_sid(sid)]
+            else:
+                my_store_ids = []
+
+            if USE_JOB_QUEUE:
+                # задачи разбирают все инстансы, не только тот, кто их поставил
+                await enqueue_cycle(pool, to_check, my_store_ids, clogger)
+                await worker.drain()
+            else:
+                # поиск конкурентов и пакетный расчёт цен
+                await reprice_batch(to_check, clogger, pool)
+
+                # синхронизация магазинов
+                if my_store_ids:
+                    clogger.info(f"[{SYNC_STORES_MODE}] Синхронизируем {len(my_store_ids)} магазинов.")
                     for sid in my_store_ids:
                         await sync_store(sid, clogger)
 
         except Exception as e:
             clogger.error(f"Error during price check/update: {e}", exc_info=False)
 
-        await asyncio.sleep(5)
+        record_cycle(cycle_started, checked)
+        await finish_cycle(pool)
+        clogger.info(f"Запросы offer-view по городам: {city_request_summary()}")
+        clogger.info(f"Наибольшее отставание проверки по магазинам: {lag_summary()}")
+        clogger.info(f"Длительность этапов, сек: {stage_latency_summary()}")
+        log_sampler.log_cycle_summary(clogger, cycle)
+        cycle += 1
+        if cycle % CHECKPOINT_EVERY == 0:
+            # состояние снимаем в цикле событий, а пишем файл в отдельном потоке
+            await asyncio.to_thread(save_checkpoint, checkpoint_file, dump_state(cycle))
+        # снимок метрик для супервизора (если запущены под supervisor.py)
+        await asyncio.to_thread(write_snapshot, f"demper_{INSTANCE_INDEX}", {"cycle": cycle})
+        await sleep_or_stop(stop, 5)
+
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await shutdown(worker, worker_task, index, checkpoint_file, cycle, clogger)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+# downsample.py прореживание временных рядов для графиков (Largest-Triangle-Three-Buckets)
+
+
+def lttb(points: list[tuple[float, float]], threshold: int) -> list[tuple[float, float]]:
+    """
+    Сокращает ряд [(x, y), ...] (x по возрастанию) до threshold точек, сохраняя
+    форму: первая и последняя точки остаются, из каждой корзины берётся точка,
+    образующая наибольший треугольник с уже выбранной и средним следующей корзины.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # индекс последней выбранной точки
+
+    for i in range(threshold - 2):
+        # среднее следующей корзины
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_bucket = points[next_start:next_end] or [points[-1]]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        # точка текущей корзины с наибольшей площадью треугольника
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,178 @@
+# fair_scheduler.py справедливый порядок обработки товаров между магазинами
+"""
+Без планировщика товары цикла идут в порядке выборки, и магазин с десятками
+тысяч SKU занимает семафор и прокси, пока маленькие магазины ждут конца цикла.
+Здесь товары раскладываются по магазинам и чередуются по deficit round-robin:
+каждый раунд магазин получает квант, пропорциональный весу его тарифа
+(kaspi_stores.plan_tier). Сверх часовой квоты тарифа товары магазина
+откладываются до следующего цикла.
+
+Отставание (сколько секунд назад товар проверяли последний раз) считается по
+каждому товару и публикуется по магазинам в метрике demper_store_lag_seconds.
+"""
+import os
+import time
+from collections import defaultdict, deque
+
+from checkpoint import restore_id
+from core.metrics import counter, gauge
+
+
+def _parse_tiers(value: str) -> dict[str, float]:
+    """"basic=1,pro=2" -> {"basic": 1.0, "pro": 2.0}"""
+    result = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        if name.strip() and number.strip():
+            result[name.strip()] = float(number)
+    return result
+
+
+DEFAULT_TIER = "basic"
+# вес тарифа: сколько товаров магазина берём за раунд относительно basic
+TIER_WEIGHTS = _parse_tiers(os.getenv("FAIR_TIER_WEIGHTS", "basic=1,pro=2,business=4"))
+# сколько товаров магазина можно проверить за час (0 или нет в списке — без ограничения)
+TIER_HOURLY_QUOTAS = _parse_tiers(os.getenv("FAIR_TIER_QUOTAS", ""))
+# товаров за раунд у магазина с весом 1
+FAIR_QUANTUM = max(1, int(os.getenv("FAIR_QUANTUM", "1")))
+
+QUOTA_WINDOW = 3600
+
+store_lag = gauge("demper_store_lag_seconds", "Сколько секунд назад проверялись товары магазина",
+                  ("store", "stat"), aggregate="max")
+quota_deferred = counter("demper_quota_deferred_total", "Товары, отложенные из-за часовой квоты магазина",
+                         ("store",))
+
+
+class FairScheduler:
+    def __init__(self, quota_share: float = 1.0):
+        # доля квоты магазина на этот процесс (товары магазина делятся между шардами)
+        self.quota_share = quota_share
+        self.tiers: dict = {}                                  # store_id -> plan_tier
+        self._admitted: dict = defaultdict(deque)              # store_id -> время допуска товаров за час
+        self._last_checked: dict = {}                          # product_id -> время последней проверки
+        self._started = time.time()
+
+    def set_tiers(self, tiers: dict) -> None:
+        self.tiers = tiers
+
+    def weight(self, store_id) -> float:
+        tier = self.tiers.get(store_id, DEFAULT_TIER)
+        return max(TIER_WEIGHTS.get(tier, TIER_WEIGHTS.get(DEFAULT_TIER, 1.0)), 0.01)
+
+    def hourly_quota(self, store_id) -> int | None:
+        quota = TIER_HOURLY_QUOTAS.get(self.tiers.get(store_id, DEFAULT_TIER))
+        if not quota:
+            return None
+        return max(1, int(quota * self.quota_share))
+
+    # ── Квоты ────────────────────────────────────────────────────────────────
+    def _remaining(self, store_id, now: float) -> int | None:
+        quota = self.hourly_quota(store_id)
+        if quota is None:
+            return None
+        admitted = self._admitted[store_id]
+        while admitted and now - admitted[0] >= QUOTA_WINDOW:
+            admitted.popleft()
+        return max(0, quota - len(admitted))
+
+    # ── Планирование ─────────────────────────────────────────────────────────
+    def plan(self, products, active=None) -> list:
+        """
+        Товары цикла в справедливом порядке (deficit round-robin по магазинам)
+        с учётом часовых квот. Заодно обновляет метрики отставания по всем
+        активным товарам (active; по умолчанию — products).
+        """
+        now = time.time()
+        self.update_lag(products if active is None else active, now)
+
+        queues: dict = {}
+        for p in products:
+            queues.setdefault(p["store_id"], deque()).append(p)
+
+        for store_id, queue in queues.items():
+            remaining = self._remaining(store_id, now)
+            if remaining is not None and len(queue) > remaining:
+                # первыми пропускаем товары, которые дольше всех не проверялись
+                oldest_first = sorted(queue, key=lambda p: self._last_checked.get(p["id"], 0))
+                quota_deferred.inc(len(queue) - remaining, store=store_id)
+                queues[store_id] = deque(oldest_first[:remaining])
+
+        ordered = []
+        deficits = dict.fromkeys(queues, 0.0)
+        rotation = deque(sid for sid, queue in queues.items() if queue)
+        while rotation:
+            store_id = rotation.popleft()
+            queue = queues[store_id]
+            deficits[store_id] += FAIR_QUANTUM * self.weight(store_id)
+            while queue and deficits[store_id] >= 1:
+                ordered.append(queue.popleft())
+                deficits[store_id] -= 1
+            if queue:
+                rotation.append(store_id)
+
+        for p in ordered:
+            if self.hourly_quota(p["store_id"]) is not None:
+                self._admitted[p["store_id"]].append(now)
+        return ordered
+
+    # ── Отставание ───────────────────────────────────────────────────────────
+    def record(self, product_id, checked_at: float | None = None) -> None:
+        """Товар проверен (конкуренты получены)"""
+        self._last_checked[product_id] = checked_at or time.time()
+
+    def update_lag(self, products, now: float | None = None) -> dict:
+        """Максимальное и медианное отставание по магазинам; {store_id: (max, p50)}"""
+        now = now or time.time()
+        lags = defaultdict(list)
+        for p in products:
+            lags[p["store_id"]].append(now - self._last_checked.get(p["id"], self._started))
+
+        if len(self._last_checked) > 2 * len(products):
+            self.forget(p["id"] for p in products)
+
+        store_lag.clear()
+        result = {}
+        for store_id, values in lags.items():
+            values.sort()
+            result[store_id] = (values[-1], values[len(values) // 2])
+            store_lag.set(round(values[-1], 1), store=store_id, stat="max")
+            store_lag.set(round(values[len(values) // 2], 1), store=store_id, stat="p50")
+        return result
+
+    def forget(self, active_ids) -> None:
+        """Убирает из учёта товары, которых больше нет среди активных"""
+        for product_id in set(self._last_checked) - set(active_ids):
+            del self._last_checked[product_id]
+
+    # ── Чекпоинт ─────────────────────────────────────────────────────────────
+    def dump(self) -> dict:
+        """Время последних проверок товаров и допусков по квотам за час, для JSON"""
+        now = time.time()
+        admitted = {}
+        for store_id, times in self._admitted.items():
+            recent = [round(t, 1) for t in times if now - t < QUOTA_WINDOW]
+            if recent:
+                admitted[str(store_id)] = recent
+        return {
+            "started": self._started,
+            "last_checked": {str(pid): round(t, 1) for pid, t in self._last_checked.items()},
+            "admitted": admitted,
+        }
+
+    def restore(self, state: dict | None) -> int:
+        """Восстанавливает состояние из dump(), возвращает число товаров с известной проверкой"""
+        if not state:
+            return 0
+        now = time.time()
+        self._started = min(self._started, float(state.get("started", self._started)))
+        for product_id, checked_at in (state.get("last_checked") or {}).items():
+            self._last_checked[restore_id(product_id)] = float(checked_at)
+        for store_id, times in (state.get("admitted") or {}).items():
+            recent = sorted(float(t) for t in times if now - float(t) < QUOTA_WINDOW)
+            if recent:
+                self._admitted[restore_id(store_id)] = deque(recent)
+        return len(self._last_checked)
+
+
+fair_scheduler = FairScheduler()
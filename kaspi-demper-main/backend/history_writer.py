@@ -0,0 +1,194 @@
+# history_writer.py история цен конкурентов и решений демпера (offer_snapshots / price_decisions)
+"""
+Таблицы только на добавление, секционированы по дням (ts). Горячий путь
+перерасчёта лишь складывает кортежи в буфер в памяти — без await и без
+обращений к БД; фоновая задача раз в HISTORY_FLUSH_INTERVAL секунд (или когда
+буфер набрал HISTORY_BATCH строк) пишет их через COPY (copy_records_to_table).
+Если БД недоступна, буфер ограничен HISTORY_MAX_BUFFER строками: лишнее
+отбрасываем и считаем, но перерасчёт не ждёт.
+
+Секции создаются на несколько дней вперёд, старше срока хранения — удаляются
+целиком (DROP TABLE секции вместо DELETE).
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from core.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+PRICE_HISTORY = os.getenv("PRICE_HISTORY", "false").lower() in ("1", "true", "yes")
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "5"))
+HISTORY_BATCH = int(os.getenv("HISTORY_BATCH", "5000"))
+HISTORY_MAX_BUFFER = int(os.getenv("HISTORY_MAX_BUFFER", "500000"))
+# срок хранения, дней: снимки конкурентов объёмнее, решений меньше и они ценнее
+SNAPSHOT_RETENTION_DAYS = int(os.getenv("SNAPSHOT_RETENTION_DAYS", "14"))
+DECISION_RETENTION_DAYS = int(os.getenv("DECISION_RETENTION_DAYS", "90"))
+# на сколько дней вперёд держим готовые секции
+PARTITIONS_AHEAD = 2
+PARTITION_MAINTENANCE_EVERY = 3600  # сек
+
+# ключ advisory-lock, чтобы процессы демпера не создавали секции одновременно
+PARTITION_LOCK_KEY = 7_051_044
+
+SNAPSHOT_COLUMNS = ("ts", "product_id", "city_id", "merchant_id", "price")
+DECISION_COLUMNS = ("ts", "product_id", "old_price", "new_price", "competitor_min", "result")
+
+# таблица -> срок хранения
+HISTORY_TABLES = {
+    "offer_snapshots": SNAPSHOT_RETENTION_DAYS,
+    "price_decisions": DECISION_RETENTION_DAYS,
+}
+
+history_rows = counter("demper_history_rows_total", "Строки истории цен по таблицам и исходу записи",
+                       ("table", "result"))
+
+
+def _tenge(value) -> int:
+    """Цена в целых тенге для компактного хранения"""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.to_integral_value())
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+async def ensure_partitions(conn, today: date | None = None) -> None:
+    """Создаёт секции на сегодня и PARTITIONS_AHEAD дней вперёд, удаляет устаревшие"""
+    today = today or datetime.now(timezone.utc).date()
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_KEY)
+        for table, retention_days in HISTORY_TABLES.items():
+            for offset in range(PARTITIONS_AHEAD + 1):
+                day = today + timedelta(days=offset)
+                await conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {partition_name(table, day)}
+                        PARTITION OF {table}
+                        FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')
+                    """
+                )
+
+            oldest_kept = partition_name(table, today - timedelta(days=retention_days))
+            partitions = await conn.fetch(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = $1
+                """,
+                table
+            )
+            # имена вида <table>_pYYYYMMDD сравниваются как даты
+            for row in partitions:
+                if row["relname"] < oldest_kept:
+                    await conn.execute(f"DROP TABLE IF EXISTS {row['relname']}")
+                    logger.info(f"История цен: удалена секция {row['relname']}")
+
+
+class HistoryWriter:
+    def __init__(self):
+        self.enabled = PRICE_HISTORY
+        self._snapshots: list[tuple] = []
+        self._decisions: list[tuple] = []
+        self._pool = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+
+    # ── Горячий путь: только добавление в буфер ──────────────────────────────
+    def _has_room(self, table: str, rows: int) -> bool:
+        if len(self._snapshots) + len(self._decisions) + rows <= HISTORY_MAX_BUFFER:
+            return True
+        history_rows.inc(rows, table=table, result="dropped")
+        return False
+
+    def add_snapshots(self, product_id, city_offers: dict) -> None:
+        """Цены конкурентов товара по городам: {city_id: [(merchant_id, price), ...]}"""
+        if not self.enabled or self._stopped:
+            return
+        ts = datetime.now(timezone.utc)
+        rows = [(ts, product_id, int(city), str(merchant), _tenge(price))
+                for city, offers in city_offers.items() for merchant, price in offers or ()]
+        if rows and self._has_room("offer_snapshots", len(rows)):
+            self._snapshots.extend(rows)
+            self._maybe_wakeup()
+
+    def add_decision(self, product_id, old_price, new_price, competitor_min, result: str) -> None:
+        if not self.enabled or self._stopped:
+            return
+        if self._has_room("price_decisions", 1):
+            self._decisions.append((datetime.now(timezone.utc), product_id, _tenge(old_price), _tenge(new_price),
+                                    _tenge(competitor_min), result))
+            self._maybe_wakeup()
+
+    def _maybe_wakeup(self):
+        if len(self._snapshots) >= HISTORY_BATCH or len(self._decisions) >= HISTORY_BATCH:
+            self._wakeup.set()
+
+    # ── Фоновая запись ───────────────────────────────────────────────────────
+    def start(self, pool) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._pool = pool
+        self._task = asyncio.create_task(self._run())
+
+    async def _copy(self, table: str, columns, records: list) -> None:
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.copy_records_to_table(table, records=records, columns=columns)
+            history_rows.inc(len(records), table=table, result="written")
+        except Exception as e:
+            history_rows.inc(len(records), table=table, result="dropped")
+            logger.error(f"История цен: не удалось записать {len(records)} строк в {table}: {e}")
+
+    async def flush(self) -> None:
+        snapshots, self._snapshots = self._snapshots, []
+        decisions, self._decisions = self._decisions, []
+        if snapshots:
+            await self._copy("offer_snapshots", SNAPSHOT_COLUMNS, snapshots)
+        if decisions:
+            await self._copy("price_decisions", DECISION_COLUMNS, decisions)
+
+    async def _maintain_partitions(self) -> None:
+        try:
+            async with self._pool.acquire() as conn:
+                await ensure_partitions(conn)
+        except Exception as e:
+            logger.error(f"История цен: ошибка обслуживания секций: {e}")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        await self._maintain_partitions()
+        maintained_at = loop.time()
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=HISTORY_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if loop.time() - maintained_at > PARTITION_MAINTENANCE_EVERY:
+                await self._maintain_partitions()
+                maintained_at = loop.time()
+            await self.flush()
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и дописывает буфер (вызывается при остановке демпера)"""
+        if self._task is None:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        await self._task
+        await self.flush()
+        self._task = None
+
+
+history_writer = HistoryWriter()
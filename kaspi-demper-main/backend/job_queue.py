@@ -0,0 +1,362 @@
+# job_queue.py очередь задач демпера в Postgres (таблица demper_jobs)
+# Задачи могут ставить API, синхронизация и планировщик; разбирают их любые процессы
+# демпера через FOR UPDATE SKIP LOCKED, так что одна задача достаётся одному воркеру.
+import asyncio
+import logging
+import os
+import socket
+from collections import defaultdict
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# ── Типы задач ────────────────────────────────────────────────────────────────
+JOB_REPRICE_PRODUCT = "reprice_product"
+JOB_SYNC_STORE = "sync_store"
+
+# ── Приоритеты: меньше — раньше ───────────────────────────────────────────────
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 100
+PRIORITY_LOW = 200
+
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# задачу, захваченную дольше этого, считаем брошенной упавшим воркером
+JOB_LOCK_TIMEOUT = timedelta(seconds=float(os.getenv("JOB_LOCK_TIMEOUT", "600")))
+# базовая пауза перед повтором, растёт как 2^(attempts-1)
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "10"))
+
+
+def dedupe_key(kind: str, product_id=None, store_id=None) -> str:
+    return f"{kind}:{product_id or store_id}"
+
+
+async def enqueue(pool, kind: str, *, product_id=None, store_id=None,
+                  priority: int = PRIORITY_NORMAL, delay: float = 0) -> None:
+    """
+    Ставит задачу в очередь. Если такая же задача уже ждёт — поднимает ей
+    приоритет и переносит run_after на более ранний срок.
+    """
+    await enqueue_many(pool, kind, [(product_id, store_id)], priority=priority, delay=delay)
+
+
+async def enqueue_many(pool, kind: str, targets, *,
+                       priority: int = PRIORITY_NORMAL, delay: float = 0) -> int:
+    """
+    Пакетная постановка задач одного типа; targets — пары (product_id, store_id).
+    id задач растут в порядке targets, а при равных priority и run_after задачи
+    захватываются по id — так сохраняется порядок fair_scheduler.plan.
+    """
+    targets = list(targets)
+    if not targets:
+        return 0
+
+    product_ids = [str(p) if p is not None else None for p, _ in targets]
+    store_ids = [str(s) if s is not None else None for _, s in targets]
+    keys = [dedupe_key(kind, p, s) for p, s in zip(product_ids, store_ids)]
+
+    async with pool.acquire() as conn:
+        result = await conn.execute(
+            """
+            INSERT INTO demper_jobs (kind, product_id, store_id, dedupe_key, priority, run_after)
+            SELECT $1, t.product_id, t.store_id, t.dedupe_key, $5, now() + make_interval(secs => $6)
+            FROM unnest($2::uuid[], $3::uuid[], $4::text[]) WITH ORDINALITY AS t(product_id, store_id, dedupe_key, n)
+            ORDER BY t.n
+            ON CONFLICT (dedupe_key) WHERE locked_at IS NULL AND dead_at IS NULL
+            DO UPDATE SET priority  = LEAST(demper_jobs.priority, EXCLUDED.priority),
+                          run_after = LEAST(demper_jobs.run_after, EXCLUDED.run_after)
+            """,
+            kind, product_ids, store_ids, keys, priority, float(delay)
+        )
+    return int(result.split()[-1])
+
+
+async def request_reprice(pool, store_id, product_ids, priority: int = PRIORITY_HIGH) -> int:
+    """
+    Срочный перерасчёт товаров после изменения цены или настроек. Ошибку только
+    логируем: вызывающему (API, синхронизация) она не мешает, а товар в любом
+    случае попадёт в обычный цикл демпера.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    try:
+        return await enqueue_many(pool, JOB_REPRICE_PRODUCT, ((pid, store_id) for pid in product_ids),
+                                  priority=priority)
+    except Exception as e:
+        logger.warning(f"Не удалось поставить перерасчёт {len(product_ids)} товаров магазина {store_id}: {e}")
+        return 0
+
+
+async def enqueue_store_reprice(pool, store_id, priority: int = PRIORITY_HIGH) -> int:
+    """Ставит перерасчёт всех активных товаров магазина, возвращает число задач"""
+    async with pool.acquire() as conn:
+        result = await conn.execute(
+            """
+            INSERT INTO demper_jobs (kind, product_id, store_id, dedupe_key, priority)
+            SELECT $1, id, store_id, $1 || ':' || id::text, $3
+            FROM products
+            WHERE store_id = $2
+              AND bot_active = TRUE
+              AND delisted_at IS NULL
+            ON CONFLICT (dedupe_key) WHERE locked_at IS NULL AND dead_at IS NULL
+            DO UPDATE SET priority  = LEAST(demper_jobs.priority, EXCLUDED.priority),
+                          run_after = LEAST(demper_jobs.run_after, EXCLUDED.run_after)
+            """,
+            JOB_REPRICE_PRODUCT, str(store_id), priority
+        )
+    return int(result.split()[-1])
+
+
+async def claim_jobs(pool, worker_id: str, limit: int = JOB_BATCH_SIZE, kinds=None) -> list:
+    """Захватывает до limit готовых задач, пропуская уже захваченные другими воркерами"""
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            UPDATE demper_jobs j
+            SET locked_at = now(),
+                locked_by = $1,
+                attempts  = j.attempts + 1
+            FROM (SELECT id
+                  FROM demper_jobs
+                  WHERE locked_at IS NULL
+                    AND dead_at IS NULL
+                    AND run_after <= now()
+                    AND ($3::text[] IS NULL OR kind = ANY ($3::text[]))
+                  ORDER BY priority, run_after, id
+                  LIMIT $2 FOR UPDATE SKIP LOCKED) picked
+            WHERE j.id = picked.id
+            RETURNING j.id, j.kind, j.product_id, j.store_id, j.priority, j.attempts, j.max_attempts
+            """,
+            worker_id, limit, list(kinds) if kinds else None
+        )
+
+
+async def complete_job(pool, job_id: int) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM demper_jobs WHERE id = $1", job_id)
+
+
+class JobDeferred(Exception):
+    """
+    Обработчик не стал выполнять задачу (например, процесс останавливается);
+    delay — через сколько секунд её можно брать снова
+    """
+
+    def __init__(self, delay: float = 0):
+        super().__init__()
+        self.delay = delay
+
+
+async def _drop_if_requeued(conn, job_id: int) -> bool:
+    """Удаляет захваченную задачу, если такую же уже снова поставили в очередь"""
+    dropped = await conn.fetchval(
+        """
+        DELETE FROM demper_jobs j
+        WHERE j.id = $1
+          AND EXISTS (SELECT 1
+                      FROM demper_jobs d
+                      WHERE d.dedupe_key = j.dedupe_key
+                        AND d.id <> j.id
+                        AND d.locked_at IS NULL
+                        AND d.dead_at IS NULL)
+        RETURNING j.id
+        """,
+        job_id
+    )
+    return dropped is not None
+
+
+async def release_job(pool, job, delay: float = 0) -> None:
+    """Возвращает задачу в очередь, не засчитывая попытку; delay откладывает её следующий захват"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if await _drop_if_requeued(conn, job["id"]):
+                return
+            await conn.execute(
+                """
+                UPDATE demper_jobs
+                SET locked_at = NULL, locked_by = NULL, attempts = GREATEST(attempts - 1, 0),
+                    run_after = GREATEST(run_after, now() + make_interval(secs => $2))
+                WHERE id = $1
+                """,
+                job["id"], float(delay)
+            )
+
+
+async def fail_job(pool, job, error: str) -> None:
+    """
+    Возвращает задачу в очередь с экспоненциальной паузой или, если попытки
+    исчерпаны, помечает её dead_at. Если пока задача выполнялась, такую же
+    поставили заново — эту просто удаляем.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if job["attempts"] >= job["max_attempts"]:
+                await conn.execute(
+                    """
+                    UPDATE demper_jobs
+                    SET locked_at = NULL, locked_by = NULL, dead_at = now(), last_error = $2
+                    WHERE id = $1
+                    """,
+                    job["id"], error
+                )
+                logger.error(f"Задача {job['kind']} #{job['id']} исчерпала попытки: {error}")
+                return
+
+            if await _drop_if_requeued(conn, job["id"]):
+                return
+
+            backoff = JOB_RETRY_BASE * 2 ** (job["attempts"] - 1)
+            await conn.execute(
+                """
+                UPDATE demper_jobs
+                SET locked_at  = NULL,
+                    locked_by  = NULL,
+                    last_error = $2,
+                    run_after  = now() + make_interval(secs => $3)
+                WHERE id = $1
+                """,
+                job["id"], error, float(backoff)
+            )
+
+
+async def release_stale_jobs(pool, timeout: timedelta = JOB_LOCK_TIMEOUT) -> int:
+    """Освобождает задачи, захваченные упавшими воркерами"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # если такая же задача уже снова ждёт в очереди — брошенная не нужна;
+            # из нескольких брошенных копий одной задачи оставляем самую раннюю,
+            # иначе разблокировка ниже нарушит уникальный индекс по dedupe_key
+            await conn.execute(
+                """
+                DELETE FROM demper_jobs j
+                WHERE j.locked_at < now() - $1::interval
+                  AND EXISTS (SELECT 1
+                              FROM demper_jobs d
+                              WHERE d.dedupe_key = j.dedupe_key
+                                AND d.dead_at IS NULL
+                                AND (d.locked_at IS NULL
+                                     OR (d.locked_at < now() - $1::interval AND d.id < j.id)))
+                """,
+                timeout
+            )
+            result = await conn.execute(
+                """
+                UPDATE demper_jobs
+                SET locked_at = NULL, locked_by = NULL, last_error = 'lock timeout'
+                WHERE locked_at < now() - $1::interval
+                """,
+                timeout
+            )
+    return int(result.split()[-1])
+
+
+async def queue_depth(pool) -> dict:
+    """Количество готовых к выполнению задач по типам"""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT kind, count(*) AS n
+            FROM demper_jobs
+            WHERE locked_at IS NULL
+              AND dead_at IS NULL
+            GROUP BY kind
+            """
+        )
+    return {r["kind"]: r["n"] for r in rows}
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobWorker:
+    """
+    Разбирает очередь demper_jobs. handlers — {kind: async fn(job)}; исключение
+    из обработчика означает неудачную попытку, задача уйдёт на повтор.
+    batch_handlers — {kind: async fn(jobs) -> list}: все захваченные за раз задачи
+    этого типа одним вызовом; на каждую задачу возвращается None (выполнена)
+    или исключение (JobDeferred — отложить, иное — неудачная попытка).
+    """
+
+    def __init__(self, pool, handlers: dict, worker_id: str | None = None,
+                 batch_size: int = JOB_BATCH_SIZE, poll_interval: float = JOB_POLL_INTERVAL,
+                 batch_handlers: dict | None = None):
+        self.pool = pool
+        self.handlers = handlers
+        self.batch_handlers = batch_handlers or {}
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stopped = False
+
+    async def _settle(self, job, error: Exception | None):
+        """Завершает, откладывает или засчитывает неудачу задачи по итогу обработчика"""
+        if error is None:
+            await complete_job(self.pool, job["id"])
+        elif isinstance(error, JobDeferred):
+            await release_job(self.pool, job, error.delay)
+        else:
+            logger.warning(f"Задача {job['kind']} #{job['id']} (попытка {job['attempts']}): {error}")
+            await fail_job(self.pool, job, str(error))
+
+    async def _run_job(self, job):
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"Нет обработчика для задач {job['kind']}")
+            await handler(job)
+        except Exception as e:
+            await self._settle(job, e)
+        else:
+            await self._settle(job, None)
+
+    async def _run_jobs(self, kind: str, jobs: list):
+        try:
+            errors = await self.batch_handlers[kind](jobs)
+        except Exception as e:
+            errors = [e] * len(jobs)
+        await asyncio.gather(*(self._settle(job, error) for job, error in zip(jobs, errors)))
+
+    async def run_batch(self) -> int:
+        """Захватывает и выполняет одну пачку задач, возвращает их количество"""
+        kinds = {*self.handlers, *self.batch_handlers}
+        jobs = await claim_jobs(self.pool, self.worker_id, self.batch_size, kinds=kinds)
+        if jobs:
+            grouped = defaultdict(list)
+            for job in jobs:
+                if job["kind"] in self.batch_handlers:
+                    grouped[job["kind"]].append(job)
+            await asyncio.gather(*(self._run_job(job) for job in jobs if job["kind"] not in grouped),
+                                 *(self._run_jobs(kind, group) for kind, group in grouped.items()))
+        return len(jobs)
+
+    async def drain(self) -> int:
+        """Выполняет задачи, пока в очереди есть готовые"""
+        total = 0
+        while not self._stopped:
+            done = await self.run_batch()
+            if not done:
+                break
+            total += done
+        return total
+
+    async def run_forever(self):
+        """Фоновый цикл: разбирает очередь и периодически освобождает брошенные задачи"""
+        polls = 0
+        while not self._stopped:
+            try:
+                if polls % 60 == 0:
+                    released = await release_stale_jobs(self.pool)
+                    if released:
+                        logger.warning(f"Освобождено брошенных задач: {released}")
+                polls += 1
+                if not await self.drain():
+                    await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                logger.error(f"Ошибка воркера очереди: {e}", exc_info=False)
+                await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        self._stopped = True
@@ -0,0 +1,259 @@
+# kaspi_replay.py запись трафика к Kaspi и локальный сервер, проигрывающий его обратно
+# Запуск из backend/:
+#   python -m kaspi_replay serve --dir recordings --port 8899 --latency-scale 1.0
+#   python -m kaspi_replay summary --dir recordings
+"""
+Режим записи (KASPI_RECORD_DIR): api_parser складывает пары запрос/ответ для
+offer-view, списка офферов кабинета, pricefeed и orderTabs вместе со статусом и
+временем ответа в jsonl.gz — по файлу на процесс. Заголовки и куки не пишутся,
+персональные поля покупателей в ответах маскируются.
+
+Режим проигрывания: `serve` поднимает aiohttp-приложение, которое отвечает
+записанным телом и статусом с исходной задержкой, умноженной на --latency-scale
+(0 — без задержки). Демпер направляется на него через KASPI_REPLAY_URL: все
+базовые адреса Kaspi в api_parser подменяются, прокси не используются. Так
+записанный цикл повторяется офлайн, а пропускная способность сравнивается по
+/metrics демпера (demper_products_per_second) и /__replay/stats сервера.
+"""
+import argparse
+import asyncio
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# адрес сервера проигрывания; если задан, весь трафик к Kaspi идёт на него без прокси
+KASPI_REPLAY_URL = os.getenv("KASPI_REPLAY_URL", "").rstrip("/")
+# витрина (offer-view) и кабинет продавца (список офферов, pricefeed, orderTabs)
+KASPI_BASE_URL = KASPI_REPLAY_URL or os.getenv("KASPI_BASE_URL", "https://kaspi.kz").rstrip("/")
+KASPI_MC_URL = KASPI_REPLAY_URL or os.getenv("KASPI_MC_URL", "https://mc.shop.kaspi.kz").rstrip("/")
+
+# каталог для записи трафика; пусто — запись выключена
+KASPI_RECORD_DIR = os.getenv("KASPI_RECORD_DIR", "")
+
+# семейство запросов к кабинету, которого нет в rate_budget (заказы, синхронный requests)
+FAMILY_ORDER_TABS = "order_tabs"
+
+# поля тела запроса, по которым ответ ищется при проигрывании (цена в ключ не входит)
+KEY_BODY_FIELDS = ("cityId", "id", "sku", "merchantUid")
+# части имён ключей ответа, значения которых маскируются при записи
+SENSITIVE_KEYS = ("phone", "email", "address", "firstname", "lastname", "customer", "password", "token", "cookie")
+MASK = "***"
+
+
+def _scrub(value):
+    """Копия JSON-значения с замаскированными персональными полями"""
+    if isinstance(value, dict):
+        return {k: MASK if any(s in k.lower() for s in SENSITIVE_KEYS) else _scrub(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_scrub(v) for v in value]
+    return value
+
+
+def request_key(method: str, path: str, query: str, body) -> str:
+    """Ключ запроса: метод, путь, параметры и значимые поля тела"""
+    parts = [method.upper(), path]
+    if query:
+        parts.append("&".join(f"{k}={v}" for k, v in sorted(parse_qsl(query))))
+    if isinstance(body, dict):
+        parts.extend(f"{field}={body[field]}" for field in KEY_BODY_FIELDS if field in body)
+    return " ".join(parts)
+
+
+class KaspiRecorder:
+    def __init__(self, directory: str = KASPI_RECORD_DIR):
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.records = 0
+        self._file = None
+        self._started = time.monotonic()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"kaspi-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl.gz")
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        atexit.register(self.close)
+        logger.info(f"Запись трафика Kaspi: {path}")
+
+    def record(self, family: str, method: str, url: str, body, status, latency: float, response) -> None:
+        """Одна пара запрос/ответ; ошибки записи не мешают запросу"""
+        if not self.enabled:
+            return
+        try:
+            if self._file is None:
+                self._open()
+            if isinstance(response, (bytes, bytearray)):
+                response = response.decode("utf-8", errors="replace")
+            if response:
+                try:
+                    response = json.dumps(_scrub(json.loads(response)), ensure_ascii=False)
+                except ValueError:
+                    pass
+            parts = urlsplit(url)
+            self._file.write(json.dumps({
+                "t": round(time.monotonic() - self._started, 4),
+                "family": family,
+                "method": method.upper(),
+                "path": parts.path,
+                "query": parts.query,
+                "body": body,
+                "status": status,
+                "latency": round(latency, 4),
+                "response": response,
+            }, ensure_ascii=False, default=str) + "\n")
+            self.records += 1
+        except Exception as e:
+            logger.warning(f"Не удалось записать запрос к Kaspi: {e}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+kaspi_recorder = KaspiRecorder()
+
+
+# ── Проигрывание ─────────────────────────────────────────────────────────────
+def load_records(directory: str) -> list[dict]:
+    """Все записи каталога; оборванный хвост файла (процесс убит) пропускается"""
+    records = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz"))):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except (EOFError, ValueError) as e:
+            logger.warning(f"{path}: запись оборвана ({e}), используем прочитанное")
+    return records
+
+
+class ReplayStore:
+    """
+    Ответы по ключу запроса. Повторы одного запроса отдаются по кругу в порядке
+    записи; если точного совпадения нет, берётся ответ того же метода и пути
+    (например, pricefeed с другим SKU) и засчитывается как fallback.
+    """
+
+    def __init__(self, records: list[dict]):
+        self._by_key = defaultdict(list)
+        self._by_path = defaultdict(list)
+        self._cursor = defaultdict(int)
+        for r in records:
+            self._by_key[request_key(r["method"], r["path"], r["query"], r["body"])].append(r)
+            self._by_path[(r["method"], self._path_family(r["path"]))].append(r)
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def _path_family(path: str) -> str:
+        # offer-view: /yml/offer-view/offers/{sku} — SKU в пути, для fallback отбрасываем
+        return path.rsplit("/", 1)[0] if "/offer-view/offers/" in path else path
+
+    def _next(self, bucket: dict, key) -> dict:
+        items = bucket[key]
+        i = self._cursor[key]
+        self._cursor[key] = i + 1
+        return items[i % len(items)]
+
+    def lookup(self, method: str, path: str, query: str, body) -> dict | None:
+        key = request_key(method, path, query, body)
+        if key in self._by_key:
+            self.stats["hit"] += 1
+            return self._next(self._by_key, key)
+        path_key = (method.upper(), self._path_family(path))
+        if path_key in self._by_path:
+            self.stats["fallback"] += 1
+            return self._next(self._by_path, path_key)
+        self.stats["miss"] += 1
+        return None
+
+
+def create_replay_app(records: list[dict], latency_scale: float = 1.0):
+    from aiohttp import web
+
+    store = ReplayStore(records)
+    started = time.monotonic()
+
+    async def handle_stats(_request):
+        elapsed = time.monotonic() - started
+        served = store.stats["hit"] + store.stats["fallback"]
+        return web.json_response({
+            **store.stats,
+            "records": len(records),
+            "latency_scale": latency_scale,
+            "uptime_seconds": round(elapsed, 1),
+            "requests_per_second": round(served / elapsed, 2) if elapsed else 0,
+        })
+
+    async def handle(request):
+        body = None
+        if request.can_read_body:
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+        record = store.lookup(request.method, request.path, request.query_string, body)
+        if record is None:
+            return web.json_response({"error": "no recorded response"}, status=404)
+        if latency_scale > 0:
+            await asyncio.sleep(record["latency"] * latency_scale)
+        status = record["status"] if isinstance(record["status"], int) else 504
+        return web.Response(status=status, text=record["response"] or "", content_type="application/json")
+
+    app = web.Application(client_max_size=16 * 1024 ** 2)
+    app.router.add_get("/__replay/stats", handle_stats)
+    app.router.add_route("*", "/{tail:.*}", handle)
+    return app
+
+
+def _summary(records: list[dict]) -> dict:
+    by_family = defaultdict(list)
+    for r in records:
+        by_family[r["family"]].append(r["latency"])
+    result = {}
+    for family, latencies in sorted(by_family.items()):
+        latencies.sort()
+        result[family] = {
+            "requests": len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проигрывание записанного трафика Kaspi")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="локальный сервер с записанными ответами")
+    serve.add_argument("--dir", required=True, help="каталог с kaspi-*.jsonl.gz")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8899)
+    serve.add_argument("--latency-scale", type=float, default=1.0,
+                       help="множитель записанных задержек (0 — отвечать сразу)")
+    summary = sub.add_parser("summary", help="число запросов и задержки по семействам")
+    summary.add_argument("--dir", required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    records = load_records(args.dir)
+    if args.command == "summary":
+        print(json.dumps(_summary(records), ensure_ascii=False, indent=2))
+        return
+
+    from aiohttp import web
+    print(f"Записей: {len(records)}; KASPI_REPLAY_URL=http://{args.host}:{args.port}")
+    web.run_app(create_replay_app(records, args.latency_scale), host=args.host, port=args.port,
+                access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -45,7 +45,9 @@ from routes.products import router as products_router
 from routes.kaspi import router as kaspi_router
 from routes.admin import router as admin_router
 from utils import set_supabase_client, has_active_subscription, has_existing_store
+from core.logger import KIND_NO_COMPETITORS, KIND_PRICE_PUSHED, async_handlers, log_sampler
 from db import create_pool
+from schema import ensure_schema
 
 app = FastAPI()
 
@@ -139,6 +141,10 @@ async def startup_event():
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     set_supabase_client(supabase)
     logging.info("Supabase client initialized")
+    try:
+        await ensure_schema()
+    except Exception as e:
+        logging.error(f"Не удалось применить схему БД: {e}")
 
 
 print('Starting FastAPI application...')
@@ -528,7 +534,7 @@ async def update_product_price(payload: PriceUpdateRequest):
         result = await sync_product(payload.product_id, payload.price)
 
         return {
-            "success": True,
+            "success": result["success"],
             "data": result
         }
     except Exception as e:
@@ -564,12 +570,14 @@ async def check_and_update_prices():
     # можно отключить распространение:
     clogger.propagate = False
 
-    # А добавить свой хендлер, например в файл:
+    # А добавить свой хендлер, например в файл (пишет отдельный поток, частые сообщения прореживаются):
     chandler = logging.FileHandler("demping_cron.log", encoding="utf-8")
     chandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-    clogger.addHandler(chandler)
+    for handler in async_handlers(chandler, filters=(log_sampler,)):
+        clogger.addHandler(handler)
     
     pool = await create_pool()
+    cycle = 0
     
     while True:
         try:
@@ -580,6 +588,7 @@ async def check_and_update_prices():
                     SELECT id, store_id, kaspi_sku, external_kaspi_id, price, min_profit
                     FROM products
                     WHERE bot_active = TRUE
+                      AND delisted_at IS NULL
                     """
                 )
             
@@ -593,7 +602,7 @@ async def check_and_update_prices():
 
                 product_data = await parse_product_by_sku(product_external_id)
                 if product_data and len(product_data):
-                    min_offer_price = min(Decimal(offer["price"]) for offer in product_data)
+                    min_offer_price = min(Decimal(price) for _, price in product_data)
                     # clogger.info(f"Minimum offer price for SKU {sku} is {min_offer_price}")
 
                     if current_price > max(min_offer_price, product['min_profit']):
@@ -613,7 +622,8 @@ async def check_and_update_prices():
                                     """,
                                     int(new_price), product_id
                                 )
-                            clogger.info(f"Демпер: Успешно - [{sku}] -> {new_price}")
+                            clogger.info(f"Демпер: Успешно - [{sku}] -> {new_price}",
+                                         extra={"kind": KIND_PRICE_PUSHED})
                             # clogger.info(f"Update response: {update_response}")
                         else:
                             pass
@@ -624,7 +634,7 @@ async def check_and_update_prices():
                         # clogger.info(
                         #     f"No update needed for product ID {product_id}. Current price {current_price} is already optimal.")
                 else:
-                    clogger.warning(f"Конкурентов нет [{sku}]")
+                    clogger.warning(f"Конкурентов нет [{sku}]", extra={"kind": KIND_NO_COMPETITORS})
                 time.sleep(random.uniform(0.1, 0.3))
             store_ids = {p["store_id"] for p in products}
             for sid in store_ids:
@@ -636,6 +646,8 @@ async def check_and_update_prices():
         except Exception as e:
             clogger.error(f"Error during price check/update: {e}", exc_info=True)
 
+        log_sampler.log_cycle_summary(clogger, cycle)
+        cycle += 1
         await asyncio.sleep(5)
 
 
@@ -818,10 +830,15 @@ async def get_store_products_for_preorders(store_id: str):
         async with pool.acquire() as conn:
             rows = await conn.fetch(
                 """
-                SELECT id, kaspi_product_id, name, price, image_url, category, 
-                       kaspi_sku, external_kaspi_id, created_at
-                FROM products
-                WHERE store_id = $1
+                SELECT p.id, p.kaspi_product_id,
+                       COALESCE(m.name, p.name)           AS name,
+                       p.price,
+                       COALESCE(m.image_url, p.image_url) AS image_url,
+                       COALESCE(m.category, p.category)   AS category,
+                       p.kaspi_sku, p.external_kaspi_id, p.created_at
+                FROM products p
+                LEFT JOIN kaspi_master_products m ON m.kaspi_id = p.master_id
+                WHERE p.store_id = $1
                 ORDER BY name
                 """,
                 store_id
@@ -0,0 +1,37 @@
+# offer_cache.py кэш последних снимков цен конкурентов (ответов offer-view) в памяти процесса
+import os
+import time
+
+from core.ttl_cache import TTLCache
+
+# сколько секунд снимок считается свежим; один мастер-товар часто продают несколько
+# наших магазинов — в пределах TTL они используют один запрос к Kaspi
+OFFER_CACHE_TTL = float(os.getenv("OFFER_CACHE_TTL", "30"))
+OFFER_CACHE_MAX_SIZE = int(os.getenv("OFFER_CACHE_MAX_SIZE", "200000"))
+
+
+class OfferCache(TTLCache):
+    """Снимки [(merchant_id, price), ...] по ключу (external_kaspi_id, при необходимости с городом)"""
+
+    def __init__(self, ttl: float = OFFER_CACHE_TTL, max_size: int = OFFER_CACHE_MAX_SIZE):
+        super().__init__(ttl, max_size)
+
+    # ── Чекпоинт ─────────────────────────────────────────────────────────────
+    def dump(self) -> list:
+        """Свежие снимки в виде, пригодном для JSON"""
+        self.evict_expired()
+        return [[key, checked_at, [list(o) for o in offers]]
+                for key, (checked_at, offers) in self._items.items()]
+
+    def restore(self, items: list) -> int:
+        """Загружает снимки из чекпоинта, пропуская устаревшие"""
+        deadline = time.time() - self.ttl
+        restored = 0
+        for key, checked_at, offers in items or ():
+            if checked_at >= deadline:
+                self.put(key, [tuple(o) for o in offers], checked_at)
+                restored += 1
+        return restored
+
+
+offer_cache = OfferCache()
@@ -0,0 +1,172 @@
+# offers.py компактное представление офферов Kaspi и быстрый разбор JSON
+import json
+import math
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson опционален, без него работаем на stdlib json
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec опционален, без него разбираем ответ целиком
+    msgspec = None
+
+# ID мастер-товара в ссылке вида /shop/p/nazvanie-tovara-123456/
+SHOP_LINK_RE = re.compile(r'/p/.*-(\d+)/')
+
+IMAGE_URL_PREFIX = "https://resources.cdn-kaspi.kz/img/m/p/"
+
+
+def json_loads(raw: bytes | str):
+    """Декодирует JSON через orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class Offer:
+    """Оффер из кабинета продавца (offer-view/list) без лишних словарей"""
+
+    __slots__ = (
+        "kaspi_product_id",
+        "kaspi_sku",
+        "name",
+        "category",
+        "price",
+        "image",
+        "external_kaspi_id",
+        "updated_at",
+    )
+
+    def __init__(self, kaspi_product_id, kaspi_sku, name, category, price, image, external_kaspi_id, updated_at):
+        self.kaspi_product_id = kaspi_product_id
+        self.kaspi_sku = kaspi_sku
+        self.name = name
+        self.category = category
+        self.price = price
+        self.image = image
+        self.external_kaspi_id = external_kaspi_id
+        self.updated_at = updated_at
+
+    @property
+    def image_url(self) -> str | None:
+        # полный URL собираем по требованию, храним только идентификатор картинки
+        return f"{IMAGE_URL_PREFIX}{self.image}" if self.image else None
+
+    def __getitem__(self, key):
+        # совместимость со старым кодом, который работал со словарём
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def as_dict(self) -> dict:
+        return {
+            "kaspi_product_id": self.kaspi_product_id,
+            "kaspi_sku": self.kaspi_sku,
+            "name": self.name,
+            "category": self.category,
+            "price": self.price,
+            "image_url": self.image_url,
+            "external_kaspi_id": self.external_kaspi_id,
+            "updated_at": self.updated_at,
+        }
+
+    def __repr__(self):
+        return f"Offer(sku={self.kaspi_sku!r}, price={self.price!r}, external_kaspi_id={self.external_kaspi_id!r})"
+
+
+def map_offer(raw_offer: dict) -> Offer:
+    """Преобразует сырой оффер из кабинета Kaspi в Offer"""
+    get = raw_offer.get
+
+    # ID товара из ссылки на витрину используем как external_kaspi_id
+    shop_link = get("shopLink")
+    match = SHOP_LINK_RE.search(shop_link) if shop_link else None
+
+    images = get("images")
+
+    return Offer(
+        get("offerId"),  # offerId остаётся kaspi_product_id
+        get("sku"),
+        get("masterTitle"),
+        get("masterCategory"),
+        get("minPrice", {}),
+        images[0] if images else None,
+        match.group(1) if match else None,
+        get("updatedAt"),
+    )
+
+
+def offer_price(value) -> int | float | None:
+    """
+    Цена конкурента из offer-view: число как есть, строку ("129990", "125000.5")
+    приводим к числу. Нечисловая строка (и "nan"/"inf") — цены нет. Общая для обоих путей разбора.
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+        if not math.isfinite(value):
+            return None
+        return int(value) if value.is_integer() else value
+    return value
+
+
+if msgspec is not None:
+    class _OfferPrice(msgspec.Struct):
+        merchantId: str | int | None = None
+        price: int | float | str | None = None
+
+    class _OfferView(msgspec.Struct):
+        offers: list[_OfferPrice] | None = None
+
+    # Декодер пропускает все поля, кроме merchantId и price, не создавая для них объектов
+    _offer_view_decoder = msgspec.json.Decoder(_OfferView)
+else:
+    _offer_view_decoder = None
+
+
+def parse_offer_view(raw: bytes) -> list[tuple]:
+    """
+    Разбирает сырой ответ offer-view/offers в компактный список (merchant_id, price).
+    Берём только поля, нужные для расчёта цены.
+    """
+    if _offer_view_decoder is not None:
+        try:
+            offers = _offer_view_decoder.decode(raw).offers
+        except msgspec.DecodeError as e:
+            raise ValueError(f"Некорректный ответ offer-view: {e}") from e
+        if offers is None:
+            raise ValueError("Ответ не содержит данных о предложениях")
+        result = []
+        for o in offers:
+            price = offer_price(o.price)
+            if o.merchantId and price:
+                result.append((o.merchantId, price))
+        return result
+
+    try:
+        data = json_loads(raw)
+    except ValueError as e:  # orjson.JSONDecodeError и json.JSONDecodeError наследуют ValueError
+        raise ValueError(f"Некорректный ответ offer-view: {e}") from e
+    return extract_offer_prices(data)
+
+
+def extract_offer_prices(response_data: dict) -> list[tuple]:
+    """Достаёт пары (merchant_id, price) из уже декодированного ответа offer-view"""
+    offers = response_data.get('offers') if isinstance(response_data, dict) else None
+    if offers is None:
+        raise ValueError("Ответ не содержит данных о предложениях")
+
+    result = []
+    append = result.append
+    for offer in offers:
+        merchant_id = offer.get('merchantId')
+        price = offer_price(offer.get('price'))
+        if merchant_id and price:
+            append((merchant_id, price))
+    return result
@@ -0,0 +1,171 @@
+# pricing_engine.py пакетный расчёт новых цен на массивах NumPy (все суммы — в тиынах)
+"""
+Решение по цене отделено от запросов к Kaspi: сначала собираем цены товаров,
+границы (min_profit / max_profit) и минимумы конкурентов пачки в массивы,
+затем одним векторным проходом считаем новые цены и отдаём только изменившиеся.
+
+Офлайн-прогон стратегии по всему каталогу (без запросов к Kaspi):
+    python pricing_engine.py --checkpoint state/demper.checkpoint.json
+    python pricing_engine.py --synthetic 1000000
+"""
+import argparse
+import asyncio
+import json
+import time
+from decimal import Decimal
+
+import numpy as np
+
+TIYN = 100
+# на сколько дешевле минимального конкурента ставим цену (1 тенге)
+DEFAULT_STEP = 1 * TIYN
+NO_VALUE = -1  # нет конкурентов / граница не задана
+
+
+def to_tiyn(value) -> int:
+    """Тенге (int / float / Decimal / None) -> целые тиыны; None -> NO_VALUE"""
+    if value is None:
+        return NO_VALUE
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * TIYN).to_integral_value())
+
+
+def from_tiyn(value: int) -> Decimal:
+    return Decimal(int(value)) / TIYN
+
+
+def decide_prices(prices: np.ndarray, floors: np.ndarray, ceilings: np.ndarray,
+                  competitor_mins: np.ndarray, step: int = DEFAULT_STEP) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Векторный расчёт цен. Все массивы int64 в тиынах, NO_VALUE — нет значения.
+
+    Правило демпера: если наша цена выше и минимального конкурента, и нижней
+    границы, ставим цену на step ниже конкурента, но не выше max_profit и не
+    ниже min_profit. Нижняя граница применяется последней: при max_profit ниже
+    min_profit цена остаётся на min_profit. Возвращает (индексы изменившихся
+    строк, их новые цены).
+    """
+    has_competitor = competitor_mins > 0
+    floor = np.maximum(floors, 0)
+
+    target = competitor_mins - step
+    has_ceiling = ceilings > 0
+    target = np.where(has_ceiling, np.minimum(target, ceilings), target)
+    np.maximum(target, floor, out=target)
+    # Kaspi принимает цены в целых тенге: округляем вверх, чтобы не уйти ниже min_profit
+    target = -(-target // TIYN) * TIYN
+
+    should_lower = has_competitor & (prices > np.maximum(competitor_mins, floor))
+    changed = np.flatnonzero(should_lower & (target != prices) & (target > 0))
+    return changed, target[changed]
+
+
+class PricingBatch:
+    """Состояние пачки товаров в массивах; строки добавляются по одной, решение — сразу для всех"""
+
+    def __init__(self):
+        self.rows: list = []
+        self._prices: list[int] = []
+        self._floors: list[int] = []
+        self._ceilings: list[int] = []
+        self._mins: list[int] = []
+
+    def add(self, row, price, min_profit, max_profit, competitor_min) -> None:
+        self.rows.append(row)
+        self._prices.append(to_tiyn(price))
+        self._floors.append(to_tiyn(min_profit) if min_profit else 0)
+        self._ceilings.append(to_tiyn(max_profit) if max_profit else 0)
+        self._mins.append(to_tiyn(competitor_min))
+
+    def arrays(self) -> tuple[np.ndarray, ...]:
+        return (np.asarray(self._prices, dtype=np.int64),
+                np.asarray(self._floors, dtype=np.int64),
+                np.asarray(self._ceilings, dtype=np.int64),
+                np.asarray(self._mins, dtype=np.int64))
+
+    def decide(self, step: int = DEFAULT_STEP) -> list[tuple]:
+        """[(row, новая цена в тенге как Decimal), ...] только для изменившихся строк"""
+        if not self.rows:
+            return []
+        changed, new_prices = decide_prices(*self.arrays(), step=step)
+        return [(self.rows[i], from_tiyn(p)) for i, p in zip(changed.tolist(), new_prices.tolist())]
+
+    def __len__(self):
+        return len(self.rows)
+
+
+# ── Офлайн-прогон ─────────────────────────────────────────────────────────────
+def _report(title: str, prices, floors, ceilings, mins, step: int) -> dict:
+    started = time.perf_counter()
+    changed, new_prices = decide_prices(prices, floors, ceilings, mins, step)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    deltas = (prices[changed] - new_prices) / TIYN if len(changed) else np.zeros(0)
+    return {
+        "source": title,
+        "products": int(len(prices)),
+        "with_competitors": int((mins > 0).sum()),
+        "changed": int(len(changed)),
+        "at_floor": int((new_prices == np.maximum(floors[changed], 0)).sum()) if len(changed) else 0,
+        "mean_drop_tenge": round(float(deltas.mean()), 2) if len(deltas) else 0.0,
+        "max_drop_tenge": round(float(deltas.max()), 2) if len(deltas) else 0.0,
+        "decide_ms": round(elapsed_ms, 3),
+    }
+
+
+def synthetic_arrays(n: int, seed: int = 42) -> tuple[np.ndarray, ...]:
+    rng = np.random.default_rng(seed)
+    prices = rng.integers(1_000, 500_000, n, dtype=np.int64) * TIYN
+    mins = (prices * rng.uniform(0.8, 1.2, n)).astype(np.int64) // TIYN * TIYN
+    mins[rng.random(n) < 0.1] = NO_VALUE  # у части товаров конкурентов нет
+    floors = np.where(rng.random(n) < 0.5, (prices * 0.9).astype(np.int64), 0)
+    ceilings = np.where(rng.random(n) < 0.2, (prices * 1.5).astype(np.int64), 0)
+    return prices, floors, ceilings, mins
+
+
+async def checkpoint_arrays(checkpoint_file: str) -> tuple[np.ndarray, ...]:
+    """Активные товары из БД + минимумы конкурентов из снимков в чекпоинте демпера"""
+    from db import create_pool
+    from repricing import fetch_products
+
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    # ключ снимка — "external_id:city"; цена одна на все города, берём минимум
+    mins_by_external: dict[str, Decimal] = {}
+    for key, _, offers in state.get("offers", ()):
+        if not offers:
+            continue
+        external_id = key.rsplit(":", 1)[0]
+        best = min(Decimal(str(price)) for _, price in offers)
+        current = mins_by_external.get(external_id)
+        mins_by_external[external_id] = best if current is None else min(current, best)
+
+    pool = await create_pool()
+    batch = PricingBatch()
+    for p in await fetch_products(pool):
+        batch.add(p["id"], p["price"], p["min_profit"], p["max_profit"],
+                  mins_by_external.get(str(p["external_kaspi_id"])))
+    return batch.arrays()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-прогон стратегии демпера по каталогу")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--checkpoint", help="чекпоинт демпера со снимками конкурентов")
+    source.add_argument("--synthetic", type=int, help="сгенерировать N случайных товаров")
+    parser.add_argument("--step", type=float, default=1.0, help="шаг снижения цены, тенге")
+    args = parser.parse_args()
+
+    step = to_tiyn(args.step)
+    if args.synthetic:
+        arrays = synthetic_arrays(args.synthetic)
+        title = f"synthetic:{args.synthetic}"
+    else:
+        arrays = asyncio.run(checkpoint_arrays(args.checkpoint))
+        title = args.checkpoint
+    print(json.dumps(_report(title, *arrays, step=step), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
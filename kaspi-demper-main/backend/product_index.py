@@ -0,0 +1,204 @@
+# product_index.py индекс активных товаров демпера в памяти, обновляемый через LISTEN/NOTIFY
+import logging
+import os
+import uuid
+from decimal import Decimal
+
+from db import DATABASE_LISTEN_URL, create_listen_connection
+from offers import json_loads
+from repricing import fetch_products
+
+logger = logging.getLogger(__name__)
+
+# канал, в который пишет триггер products_notify_changed (см. schema.py)
+PRODUCTS_CHANNEL = "products_changed"
+# полное перечитывание раз в N циклов — страховка от потерянных уведомлений
+INDEX_RELOAD_EVERY = max(1, int(os.getenv("INDEX_RELOAD_EVERY", "30")))
+
+
+def _to_decimal(value):
+    # числа из JSON приходят как int/float — через str, чтобы не тащить погрешность float
+    return Decimal(str(value)) if value is not None else None
+
+
+def _to_uuid(value):
+    # asyncpg отдаёт uuid.UUID, а в JSON уведомления id приходят строками
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return value
+
+
+def _discard(mapping: dict, key, product_id: str):
+    ids = mapping.get(key)
+    if ids is not None:
+        ids.discard(product_id)
+        if not ids:
+            del mapping[key]
+
+
+class ActiveProductIndex:
+    """
+    Активные товары (bot_active и не сняты с продажи), загруженные один раз при старте.
+    Дальше индекс обновляется по уведомлениям триггера, без полного SELECT каждый цикл,
+    и раз в INDEX_RELOAD_EVERY циклов перечитывается целиком. При потере
+    LISTEN-соединения индекс перечитывается на следующем цикле, а без прямого
+    адреса Postgres (DATABASE_LISTEN_URL) — каждый цикл, как до индекса.
+    """
+
+    def __init__(self, shard: tuple[int, int] | None = None):
+        self.shard = shard
+        self.by_id: dict[str, dict] = {}
+        self.by_store: dict = {}
+        self.by_external: dict = {}
+        self._pool = None
+        self._conn = None
+        self._stale = True
+        self._cycles_since_reload = 0
+        # уведомления, пришедшие во время reload(); None — перечитывания нет
+        self._pending: list | None = None
+
+    # ── Загрузка и подписка ──────────────────────────────────────────────────
+    async def start(self, pool):
+        self._pool = pool
+        if not DATABASE_LISTEN_URL:
+            logger.error("DATABASE_LISTEN_URL не задан: через pgbouncer уведомления не доходят, "
+                         "индекс товаров будет перечитываться каждый цикл")
+        await self.ensure_fresh()
+
+    @property
+    def listening(self) -> bool:
+        return not self._stale and self._conn is not None and not self._conn.is_closed()
+
+    async def ensure_fresh(self):
+        """
+        Вызывается в начале цикла. Переподписывается и перечитывает индекс, если
+        LISTEN-соединение потеряно; без LISTEN и раз в INDEX_RELOAD_EVERY циклов
+        просто перечитывает товары.
+        """
+        self._cycles_since_reload += 1
+        if self.listening:
+            if self._cycles_since_reload >= INDEX_RELOAD_EVERY:
+                await self.reload()
+            return
+        if DATABASE_LISTEN_URL:
+            await self._close_listener()
+            try:
+                self._conn = await create_listen_connection()
+                self._conn.add_termination_listener(self._on_terminated)
+                await self._conn.add_listener(PRODUCTS_CHANNEL, self._on_notify)
+            except Exception as e:
+                logger.error(f"Не удалось подписаться на {PRODUCTS_CHANNEL}: {e}, перечитываем индекс",
+                             exc_info=False)
+                await self._close_listener()
+            else:
+                # сначала подписка, потом загрузка — чтобы не потерять изменения между ними
+                self._stale = False
+        await self.reload()
+
+    async def reload(self):
+        # уведомления во время выборки копим и применяем поверх неё: снимок мог быть сделан до них
+        self._pending = []
+        try:
+            rows = await fetch_products(self._pool, shard=self.shard)
+        except BaseException:
+            self._pending = None
+            raise
+        pending, self._pending = self._pending, None
+        self.by_id.clear()
+        self.by_store.clear()
+        self.by_external.clear()
+        for row in rows:
+            self._put(dict(row))
+        for event in pending:
+            self._apply_safely(event)
+        self._cycles_since_reload = 0
+        logger.info(f"Индекс активных товаров загружен: {len(self.by_id)}"
+                    + (f", применено отложенных уведомлений: {len(pending)}" if pending else ""))
+
+    async def close(self):
+        await self._close_listener()
+
+    async def _close_listener(self):
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия LISTEN-соединения: {e}")
+
+    def _on_terminated(self, conn):
+        logger.warning("LISTEN-соединение потеряно, индекс будет перечитан")
+        self._stale = True
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json_loads(payload)
+        except Exception as e:
+            logger.error(f"Ошибка разбора уведомления {channel}: {e}", exc_info=False)
+            self._stale = True
+            return
+        if self._pending is not None:
+            self._pending.append(event)
+            return
+        self._apply_safely(event)
+
+    def _apply_safely(self, event: dict):
+        try:
+            self.apply(event)
+        except Exception as e:
+            # пропущенное уведомление — повод перечитать индекс целиком
+            logger.error(f"Ошибка применения уведомления {PRODUCTS_CHANNEL}: {e}", exc_info=False)
+            self._stale = True
+
+    # ── Обновление индекса ───────────────────────────────────────────────────
+    def _in_shard(self, h) -> bool:
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return h % count == index
+
+    def apply(self, event: dict):
+        """Применяет одно уведомление триггера notify_products_changed"""
+        product_id = str(event["id"])
+        if event["op"] == "DELETE" or not event.get("active") or not self._in_shard(event["h"]):
+            self._remove(product_id)
+            return
+
+        self._remove(product_id)
+        self._put({
+            "id": _to_uuid(event["id"]),
+            "store_id": _to_uuid(event["store_id"]),
+            "kaspi_sku": event["kaspi_sku"],
+            "external_kaspi_id": event["external_kaspi_id"],
+            "price": _to_decimal(event["price"]),
+            "min_profit": _to_decimal(event["min_profit"]),
+            "max_profit": _to_decimal(event.get("max_profit")),
+        })
+
+    def _put(self, product: dict):
+        product_id = str(product["id"])
+        self.by_id[product_id] = product
+        self.by_store.setdefault(product["store_id"], set()).add(product_id)
+        external_id = product["external_kaspi_id"]
+        if external_id is not None:
+            self.by_external.setdefault(str(external_id), set()).add(product_id)
+
+    def _remove(self, product_id: str):
+        product = self.by_id.pop(product_id, None)
+        if product is None:
+            return
+        _discard(self.by_store, product["store_id"], product_id)
+        external_id = product["external_kaspi_id"]
+        if external_id is not None:
+            _discard(self.by_external, str(external_id), product_id)
+
+    # ── Чтение ───────────────────────────────────────────────────────────────
+    def products(self) -> list[dict]:
+        return list(self.by_id.values())
+
+    def store_products(self, store_id) -> list[dict]:
+        return [self.by_id[pid] for pid in self.by_store.get(store_id, ())]
+
+    def __len__(self):
+        return len(self.by_id)
@@ -1,11 +1,17 @@
 # proxy_balancer.py
+import random
 import time
 from typing import Dict
 
 from proxy_config import (
-    get_pool_size, get_current_index, get_current_proxy, rotate_proxy
+    PROXY_POOL, get_pool_size, get_current_index, get_current_proxy, rotate_proxy
 )
 
+# после стольких ошибок подряд прокси не считается здоровым (до первого успешного ответа)
+UNHEALTHY_AFTER_FAILURES = 3
+# вес нового замера в скользящей средней задержки прокси
+LATENCY_EWMA_ALPHA = 0.2
+
 
 class ProxyBalancer:
     def __init__(self):
@@ -15,6 +21,8 @@ class ProxyBalancer:
         self.user_proxy_index = {}  # user_id -> pool_index
         self.last_reset_time = time.time()
         self.reset_interval = 3600  # сек
+        # port -> [средняя задержка, ошибок подряд]; по ним выбираем прокси для хеджирования
+        self.proxy_health = {}
 
     def _tick_reset(self):
         if time.time() - self.last_reset_time > self.reset_interval:
@@ -55,12 +63,42 @@ class ProxyBalancer:
             return self.get_proxy_for_user(identifier)  # выглядит как email → закрепляем
         return self.get_proxy_for_store(identifier or "generic")
 
+    def record_result(self, proxy: Dict | None, latency: float, ok: bool):
+        """Запоминает задержку и исход запроса через прокси"""
+        if not proxy:
+            return
+        health = self.proxy_health.setdefault(proxy["port"], [latency, 0])
+        if ok:
+            health[0] += LATENCY_EWMA_ALPHA * (latency - health[0])
+            health[1] = 0
+        else:
+            health[1] += 1
+
+    def is_healthy(self, proxy: Dict) -> bool:
+        health = self.proxy_health.get(proxy["port"])
+        return health is None or health[1] < UNHEALTHY_AFTER_FAILURES
+
+    def get_hedge_proxy(self, exclude: Dict | None = None, sample: int = 8) -> Dict | None:
+        """
+        Другой здоровый прокси для повторного (хеджирующего) запроса: из случайной
+        выборки берём самый быстрый по средней задержке, незнакомые считаем быстрыми
+        """
+        exclude_port = exclude["port"] if exclude else None
+        candidates = [p for p in random.sample(PROXY_POOL, min(sample, len(PROXY_POOL)))
+                      if p["port"] != exclude_port and self.is_healthy(p)]
+        if not candidates:
+            return None
+        proxy = min(candidates, key=lambda p: self.proxy_health.get(p["port"], (0.0, 0))[0])
+        self._mark_used(PROXY_POOL.index(proxy))
+        return proxy
+
     def get_stats(self) -> Dict:
         total = sum(self.proxy_usage_count.values())
         return {
             "total_requests": total,
             "pool_size": get_pool_size(),
             "usage": self.proxy_usage_count,
+            "unhealthy": sum(1 for _, failures in self.proxy_health.values() if failures >= UNHEALTHY_AFTER_FAILURES),
             "time_to_reset": max(0, self.reset_interval - (time.time() - self.last_reset_time)),
         }
 
@@ -0,0 +1,139 @@
+# rate_budget.py общий для всех процессов лимит запросов к Kaspi (token bucket в Postgres)
+# Ведра — по семействам эндпоинтов Kaspi и по каждому прокси. Чтобы не ходить в базу
+# на каждый запрос, процесс забирает токены пачкой и расходует их локально.
+import asyncio
+import logging
+import os
+import time
+
+from db import create_pool
+
+logger = logging.getLogger(__name__)
+
+RATE_BUDGET_ENABLED = os.getenv("KASPI_RATE_BUDGET", "false").lower() in ("1", "true", "yes")
+# сколько токенов процесс забирает из общего ведра за один запрос к базе
+RATE_BUDGET_BATCH = int(os.getenv("KASPI_RATE_BATCH", "10"))
+# неизрасходованные локальные токены сгорают, чтобы процесс не копил чужую долю
+RATE_LEASE_TTL = float(os.getenv("KASPI_RATE_LEASE_TTL", "2"))
+
+# ── Семейства эндпоинтов Kaspi ───────────────────────────────────────────────
+FAMILY_OFFER_VIEW = "offer_view"        # kaspi.kz/yml/offer-view/offers (цены конкурентов)
+FAMILY_MERCHANT_LIST = "merchant_list"  # mc.shop.kaspi.kz/bff/offer-view/list (каталог магазина)
+FAMILY_PRICEFEED = "pricefeed"          # mc.shop.kaspi.kz/pricefeed (обновление цен)
+
+
+def _rate_from_env(name: str, default: str) -> tuple[float, float]:
+    """KASPI_RATE_<NAME>="<запросов в секунду>[/<ёмкость ведра>]" """
+    raw = os.getenv(f"KASPI_RATE_{name.upper()}", default)
+    rate, _, burst = raw.partition("/")
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+# (скорость пополнения в секунду, ёмкость ведра)
+FAMILY_LIMITS = {
+    FAMILY_OFFER_VIEW: _rate_from_env(FAMILY_OFFER_VIEW, "50"),
+    FAMILY_MERCHANT_LIST: _rate_from_env(FAMILY_MERCHANT_LIST, "10"),
+    FAMILY_PRICEFEED: _rate_from_env(FAMILY_PRICEFEED, "20"),
+}
+PROXY_LIMIT = _rate_from_env("per_proxy", "2/4")
+
+
+def proxy_bucket(proxy_dict: dict | None) -> str | None:
+    if not proxy_dict:
+        return None
+    return f"proxy:{proxy_dict['host']}:{proxy_dict['port']}"
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires_at", "lock")
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class RateBudget:
+    """
+    Клиент общего бюджета запросов. acquire() ждёт, пока в каждом из вёдер
+    (семейство эндпоинта и прокси) не найдётся токен. Если база недоступна,
+    запрос пропускается без лимита — демпер не должен вставать из-за бюджета.
+    """
+
+    def __init__(self, batch: int = RATE_BUDGET_BATCH, lease_ttl: float = RATE_LEASE_TTL):
+        self.batch = batch
+        self.lease_ttl = lease_ttl
+        self._leases: dict[str, _Lease] = {}
+        self._known: set[str] = set()  # вёдра, строки которых уже созданы в базе
+
+    async def acquire(self, family: str, proxy_dict: dict | None = None):
+        if not RATE_BUDGET_ENABLED:
+            return
+        await self._take(family, *FAMILY_LIMITS[family])
+        bucket = proxy_bucket(proxy_dict)
+        if bucket is not None:
+            await self._take(bucket, *PROXY_LIMIT)
+
+    async def _take(self, bucket: str, rate: float, capacity: float):
+        lease = self._leases.get(bucket)
+        if lease is None:
+            lease = self._leases[bucket] = _Lease()
+
+        async with lease.lock:
+            while True:
+                now = time.monotonic()
+                if lease.tokens > 0 and now < lease.expires_at:
+                    lease.tokens -= 1
+                    return
+
+                try:
+                    granted = await self._claim(bucket, rate, capacity, min(self.batch, int(capacity) or 1))
+                except Exception as e:
+                    logger.warning(f"Бюджет запросов Kaspi недоступен ({bucket}): {e}")
+                    return
+
+                if granted:
+                    lease.tokens = granted - 1
+                    lease.expires_at = time.monotonic() + self.lease_ttl
+                    return
+
+                # ведро пустое — ждём примерно один токен
+                await asyncio.sleep(max(0.05, 1.0 / rate) if rate > 0 else 1.0)
+
+    async def _claim(self, bucket: str, rate: float, capacity: float, want: int) -> int:
+        """Атомарно пополняет ведро по прошедшему времени и забирает до want токенов"""
+        pool = await create_pool()
+        async with pool.acquire() as conn:
+            if bucket not in self._known:
+                await conn.execute(
+                    """
+                    INSERT INTO kaspi_rate_buckets (bucket, tokens, capacity, refill_rate)
+                    VALUES ($1, $3, $3, $2)
+                    ON CONFLICT (bucket) DO NOTHING
+                    """,
+                    bucket, float(rate), float(capacity)
+                )
+                self._known.add(bucket)
+
+            return await conn.fetchval(
+                """
+                UPDATE kaspi_rate_buckets b
+                SET tokens      = cur.available - LEAST($4, floor(cur.available)),
+                    capacity    = $3,
+                    refill_rate = $2,
+                    updated_at  = clock_timestamp()
+                FROM (SELECT bucket,
+                             LEAST($3, tokens + GREATEST(0, extract(EPOCH FROM clock_timestamp() - updated_at)) * $2)
+                                 AS available
+                      FROM kaspi_rate_buckets
+                      WHERE bucket = $1
+                          FOR UPDATE) cur
+                WHERE b.bucket = cur.bucket
+                RETURNING LEAST($4, floor(cur.available))::int
+                """,
+                bucket, float(rate), float(capacity), want
+            ) or 0
+
+
+kaspi_budget = RateBudget()
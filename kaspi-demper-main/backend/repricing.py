@@ -0,0 +1,570 @@
+# repricing.py общие шаги цикла демпера для demper.py и demper_instance.py
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from api_parser import (DEFAULT_CITY_ID, get_store_offer_prices, kaspi_city_requests, parse_product_by_sku, sync_product,
+                        sync_store_api)
+from checkpoint import restore_id, save_checkpoint
+from core.logger import (KIND_BATCH_SUMMARY, KIND_CITY_MINIMUMS, KIND_NO_COMPETITORS, KIND_PRICE_PUSHED,
+                         KIND_PRODUCT_ERROR, KIND_STAGE_TIMEOUT)
+from core.metrics import counter, gauge, histogram
+from db import close_pool
+from deadlines import (STAGE_DB, STAGE_DECIDE, STAGE_FETCH, STAGE_LOOKUP, STAGE_PUSH, TIMEOUT_RETRY_DELAY, StageTimeout,
+                       run_stage, stage_seconds, stage_timeout, stage_timeouts)
+from fair_scheduler import fair_scheduler, store_lag
+from history_writer import history_writer
+from job_queue import JOB_REPRICE_PRODUCT, JOB_SYNC_STORE, PRIORITY_LOW, JobDeferred, enqueue_many, queue_depth
+from kaspi_replay import kaspi_recorder
+from offer_cache import offer_cache
+from pricing_engine import PricingBatch
+from proxy_balancer import proxy_balancer
+from run_report import FAIL_LOOKUP, FAIL_PUSH, FAIL_SKIPPED, FAIL_TIMEOUT, record_cache_hit, record_product, record_push
+
+# ── Параллелизм внутри процесса ───────────────────────────────────────────────
+MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", "100"))
+semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+# у отправки цен свои слоты: иначе каждая отправка ждёт в очереди семафора за всеми
+# ещё не начатыми поисками конкурентов пачки и не укладывается в бюджет цикла
+MAX_CONCURRENT_PUSHES = int(os.getenv("MAX_CONCURRENT_PUSHES", "20"))
+push_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PUSHES)
+
+# ── Двухфазный режим ──────────────────────────────────────────────────────────
+# 1) одним проходом по списку офферов кабинета (100 офферов на запрос) отбираем
+#    товары, которые дороже minPrice; 2) offer-view запрашиваем только для них.
+TWO_PHASE_SCAN = os.getenv("TWO_PHASE_SCAN", "false").lower() in ("1", "true", "yes")
+# раз в N циклов всё равно делаем полный проход по всем товарам
+TWO_PHASE_FULL_EVERY = max(1, int(os.getenv("TWO_PHASE_FULL_EVERY", "12")))
+
+# ── Очередь задач ─────────────────────────────────────────────────────────────
+# цикл не обрабатывает товары сам, а ставит задачи в demper_jobs и разбирает
+# очередь вместе с остальными процессами демпера
+USE_JOB_QUEUE = os.getenv("USE_JOB_QUEUE", "false").lower() in ("1", "true", "yes")
+
+# не больше стольких готовых ответов конкурентов за один векторный расчёт цен
+REPRICE_BATCH_SIZE = max(1, int(os.getenv("REPRICE_BATCH_SIZE", "500")))
+
+PRODUCT_COLUMNS = "id, store_id, kaspi_sku, external_kaspi_id, price, min_profit, max_profit"
+
+products_checked = counter("demper_products_checked_total", "Товары, по которым запрошены конкуренты", ("result",))
+price_updates = counter("demper_price_updates_total", "Отправленные в Kaspi новые цены", ("result",))
+cycle_seconds = histogram("demper_cycle_seconds", "Длительность цикла демпера",
+                          buckets=(5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+cycle_products = gauge("demper_cycle_products", "Товаров в последнем цикле")
+products_per_second = gauge("demper_products_per_second", "Скорость обработки товаров в последнем цикле")
+semaphore_in_use = gauge("demper_semaphore_in_use", "Занятые слоты семафора запросов", ("limit",))
+# глубину общей очереди каждый процесс читает из одной таблицы — суммировать нельзя
+jobs_ready = gauge("demper_queue_depth", "Готовые к выполнению задачи demper_jobs", ("kind",), aggregate="max")
+proxy_requests = gauge("demper_proxy_requests", "Запросы через прокси с последнего сброса счётчиков", ("proxy",))
+proxy_pool = gauge("demper_proxy_pool", "Прокси в пуле процесса", ("state",))
+
+# отметки результата поиска конкурентов
+_SKIPPED = object()
+_FAILED = object()
+_TIMED_OUT = object()
+
+# статус товара, не уложившегося в дедлайн этапа: его переносим, а не считаем ошибкой
+TIMED_OUT = "timeout"
+# товары, которые в прошлом цикле не уложились в дедлайн — проверим их в следующем
+_retry_ids: set = set()
+
+# ── Настройки магазинов ───────────────────────────────────────────────────────
+# store_id -> города, в которых смотрим конкурентов (kaspi_stores.city_ids)
+store_cities: dict = {}
+
+
+async def refresh_store_settings(pool) -> None:
+    """Города магазинов и их тарифы (вес и квота в fair_scheduler)"""
+    async with pool.acquire() as connection:
+        rows = await connection.fetch("SELECT id, city_ids, plan_tier FROM kaspi_stores")
+    store_cities.clear()
+    for row in rows:
+        store_cities[row["id"]] = tuple(row["city_ids"] or ()) or (DEFAULT_CITY_ID,)
+    fair_scheduler.set_tiers({row["id"]: row["plan_tier"] for row in rows})
+
+
+def cities_for_store(store_id) -> tuple:
+    return store_cities.get(store_id) or (DEFAULT_CITY_ID,)
+
+
+async def _lookup_city(external_id: str, city_id: str) -> list:
+    # свежий снимок конкурентов мог уже получить другой магазин с тем же товаром
+    cache_key = f"{external_id}:{city_id}"
+    offers = offer_cache.get(cache_key)
+    if offers is None:
+        offers = await parse_product_by_sku(external_id, city_id)
+        if offers:
+            offer_cache.put(cache_key, offers)
+    else:
+        record_cache_hit()
+    return offers
+
+
+async def lookup_competitors(external_id: str, city_ids) -> dict:
+    """Конкуренты по каждому городу магазина, запросы по городам идут параллельно"""
+    if len(city_ids) == 1:
+        return {city_ids[0]: await _lookup_city(external_id, city_ids[0])}
+    results = await asyncio.gather(*(_lookup_city(external_id, city) for city in city_ids))
+    return dict(zip(city_ids, results))
+
+
+def city_minimums(city_offers: dict) -> dict:
+    """Минимальная цена конкурентов по каждому городу, где они есть"""
+    return {city: min(Decimal(price) for _, price in offers)
+            for city, offers in city_offers.items() if offers}
+
+
+def city_request_summary() -> dict:
+    """Сколько запросов offer-view ушло по каждому городу с начала работы процесса"""
+    totals = defaultdict(int)
+    for labels, value in kaspi_city_requests.samples():
+        totals[labels["city"]] += int(value)
+    return dict(totals)
+
+
+# ── Остановка ─────────────────────────────────────────────────────────────────
+# после SIGTERM начатые товары доделываем, а ещё не начатые пропускаем
+_stopping = False
+
+
+def request_stop():
+    global _stopping
+    _stopping = True
+
+
+def is_stopping() -> bool:
+    return _stopping
+
+
+async def _lookup(product, clogger):
+    """Минимум конкурентов по городам магазина; None — конкурентов нет"""
+    async with semaphore:
+        if _stopping:
+            return _SKIPPED
+        if stage_timeout(STAGE_LOOKUP) <= 0:
+            # бюджет цикла исчерпан — переносим товар без запроса и без паузы
+            stage_timeouts.inc(stage=STAGE_LOOKUP)
+            return _TIMED_OUT
+        sku = product["kaspi_sku"]
+        try:
+            city_offers = await run_stage(STAGE_LOOKUP, lookup_competitors(str(product["external_kaspi_id"]),
+                                                                           cities_for_store(product["store_id"])))
+            history_writer.add_snapshots(product["id"], city_offers)
+            city_mins = city_minimums(city_offers)
+            if not city_mins:
+                clogger.warning(f"Конкурентов нет [{sku}]", extra={"kind": KIND_NO_COMPETITORS})
+                return None
+            if len(city_offers) > 1:
+                mins = ", ".join(f"{city}: {price}" for city, price in city_mins.items())
+                clogger.info(f"Минимумы по городам [{sku}]: {mins}", extra={"kind": KIND_CITY_MINIMUMS})
+            # цена у магазина одна на все города — ориентируемся на самый дешёвый
+            return min(city_mins.values())
+        except StageTimeout as e:
+            clogger.warning(f"Поиск конкурентов [{sku}]: {e}, переносим", extra={"kind": KIND_STAGE_TIMEOUT})
+            return _TIMED_OUT
+        except Exception as e:
+            clogger.error(f"Ошибка при обработке продукта [{sku}]: {e}", exc_info=False,
+                          extra={"kind": KIND_PRODUCT_ERROR})
+            return _FAILED
+        finally:
+            # легкая рандомная задержка, чтобы не долбить API синхронно
+            await asyncio.sleep(random.uniform(0.1, 0.3))
+
+
+async def _save_price(pool, product_id, new_price) -> None:
+    # Обновляем цену продукта в нашей БД
+    async with pool.acquire() as connection:
+        await connection.execute(
+            """
+            UPDATE products
+            SET price = $1
+            WHERE id = $2
+            """,
+            int(new_price), product_id
+        )
+
+
+async def _push(product, new_price, clogger, pool) -> bool | str:
+    """
+    Отправляет новую цену в Kaspi и сохраняет её в БД. True — Kaspi принял цену,
+    False — не принял или запрос упал, TIMED_OUT — не уложились в дедлайн
+    """
+    sku = product["kaspi_sku"]
+    async with push_semaphore:
+        try:
+            # Синхронизация с Kaspi
+            sync_result = await run_stage(STAGE_PUSH, sync_product(product["id"], new_price))
+
+            if not sync_result.get('success'):
+                clogger.error(f"Цена не обновлена [{sku}] -> {new_price}: {sync_result.get('message')}",
+                              extra={"kind": KIND_PRODUCT_ERROR})
+                return False
+            await run_stage(STAGE_DB, _save_price(pool, product["id"], new_price))
+            clogger.info(f"Демпер: OK [{sku}] -> {new_price}", extra={"kind": KIND_PRICE_PUSHED})
+            return True
+        except StageTimeout as e:
+            clogger.warning(f"Обновление цены [{sku}]: {e}, переносим", extra={"kind": KIND_STAGE_TIMEOUT})
+            return TIMED_OUT
+        except Exception as e:
+            clogger.error(f"Ошибка при обновлении цены [{sku}]: {e}", exc_info=False,
+                          extra={"kind": KIND_PRODUCT_ERROR})
+            return False
+
+
+def _lookup_status(found):
+    if found is _SKIPPED:
+        return None
+    if found is _TIMED_OUT:
+        return TIMED_OUT
+    return found is not _FAILED
+
+
+# статус товара -> класс неудачи в отчёте цикла (run_report.py)
+_LOOKUP_FAILURES = {None: FAIL_SKIPPED, False: FAIL_LOOKUP, TIMED_OUT: FAIL_TIMEOUT}
+_PUSH_FAILURES = {False: FAIL_PUSH, TIMED_OUT: FAIL_TIMEOUT}
+
+
+def _result_label(status) -> str:
+    if status is None:
+        return "skipped"
+    if status == TIMED_OUT:
+        return TIMED_OUT
+    return "ok" if status else "error"
+
+
+async def reprice_batch(products, clogger, pool) -> list:
+    """
+    Перерасчёт цен конвейером: минимумы конкурентов запрашиваются параллельно
+    (в пределах семафора), а ответы по мере готовности идут микропачками до
+    REPRICE_BATCH_SIZE в векторный PricingBatch; изменившиеся цены сразу
+    отправляются в Kaspi через свой push_semaphore, не дожидаясь ни медленных,
+    ни ещё не начатых запросов остальных товаров.
+    Для каждого товара возвращает True, False (обработка упала), TIMED_OUT (не
+    уложились в дедлайн, товар перенесён на следующий цикл) или None (пропущен
+    из-за остановки).
+    """
+    statuses: list = [None] * len(products)
+    if not products:
+        return statuses
+    ready = asyncio.Queue()
+
+    async def lookup(i):
+        found = _FAILED
+        try:
+            found = await _lookup(products[i], clogger)
+        finally:
+            ready.put_nowait((i, found))
+
+    async def push(i, new_price, competitor_min):
+        ok = await _push(products[i], new_price, clogger, pool)
+        statuses[i] = ok
+        price_updates.inc(result=_result_label(ok))
+        record_push(products[i]["store_id"], ok is True, _PUSH_FAILURES.get(ok))
+        history_writer.add_decision(products[i]["id"], products[i]["price"], new_price, competitor_min,
+                                    _result_label(ok))
+
+    def decide(results) -> list:
+        checked_at = time.time()
+        batch = PricingBatch()
+        for i, found in results:
+            status = _lookup_status(found)
+            statuses[i] = status
+            products_checked.inc(result=_result_label(status))
+            record_product(products[i]["store_id"], status is not None, _LOOKUP_FAILURES.get(status))
+            if status is True:
+                fair_scheduler.record(products[i]["id"], checked_at)
+            if isinstance(found, Decimal):
+                batch.add(i, products[i]["price"], products[i]["min_profit"], products[i]["max_profit"], found)
+        minimums = dict(results)
+        return [asyncio.create_task(push(i, new_price, minimums[i])) for i, new_price in batch.decide()]
+
+    started = time.time()
+    lookups = [asyncio.create_task(lookup(i)) for i in range(len(products))]
+    pushes = []
+    decide_ms = 0.0
+    try:
+        remaining = len(products)
+        while remaining:
+            # всё, что уже пришло, решаем одной пачкой; пустая очередь — ждём следующий ответ
+            results = [await ready.get()]
+            while len(results) < REPRICE_BATCH_SIZE and not ready.empty():
+                results.append(ready.get_nowait())
+            remaining -= len(results)
+
+            decide_started = time.perf_counter()
+            pushes += decide(results)
+            elapsed = time.perf_counter() - decide_started
+            decide_ms += elapsed * 1000
+            stage_seconds.observe(elapsed, stage=STAGE_DECIDE)
+        lookup_time = time.time() - started
+        await asyncio.gather(*pushes)
+    finally:
+        # отмена цикла (например, по остановке) не должна оставлять висящие запросы
+        leftovers = [task for task in (*lookups, *pushes) if not task.done()]
+        for task in leftovers:
+            task.cancel()
+        if leftovers:
+            await asyncio.gather(*leftovers, return_exceptions=True)
+
+    for product, status in zip(products, statuses):
+        if status == TIMED_OUT:
+            _retry_ids.add(product["id"])
+
+    # в режиме очереди пачек много и они мелкие — сообщение прореживается (LOG_SAMPLING)
+    clogger.info(f"Пачка {len(products)} товаров: конкуренты {lookup_time:.2f} сек, "
+                 f"расчёт {decide_ms:.2f} мс, новых цен {len(pushes)}", extra={"kind": KIND_BATCH_SUMMARY})
+    return statuses
+
+
+async def fetch_products(pool, shard: tuple[int, int] | None = None):
+    """
+    Извлекает активные товары (кроме снятых с продажи). Если передан shard=(index, count) —
+    только свой шард: mod(abs(hashtext(id::text)), count) = index
+    """
+    async with pool.acquire() as connection:
+        if shard is None:
+            query = f"""
+                    SELECT {PRODUCT_COLUMNS}
+                    FROM products
+                    WHERE bot_active = TRUE
+                      AND delisted_at IS NULL
+                    """
+            return await connection.fetch(query)
+
+        index, count = shard
+        query = f"""
+                SELECT {PRODUCT_COLUMNS}
+                FROM products
+                WHERE bot_active = TRUE
+                  AND delisted_at IS NULL
+                  AND mod(abs(hashtext(id::text)), $1) = $2
+                """
+        return await connection.fetch(query, count, index)
+
+
+async def fetch_products_by_ids(pool, product_ids) -> dict:
+    """Активные товары по id: {id: товар}; выключенных и снятых с продажи в ответе нет"""
+    async with pool.acquire() as connection:
+        rows = await connection.fetch(
+            f"""
+            SELECT {PRODUCT_COLUMNS}
+            FROM products
+            WHERE id = ANY ($1::uuid[])
+              AND bot_active = TRUE
+              AND delisted_at IS NULL
+            """,
+            [str(pid) for pid in product_ids]
+        )
+    return {row["id"]: row for row in rows}
+
+
+async def sync_store(sid, clogger):
+    """Синхронизация магазина"""
+    async with semaphore:
+        if _stopping:
+            return
+        try:
+            result = await sync_store_api(sid)
+            clogger.info(f"Синхронизирован магазин {sid}: {result}")
+        except Exception as e:
+            clogger.error(f"Ошибка sync_store_api для {sid}: {e}", exc_info=False)
+
+
+def needs_lookup(product, list_min_price) -> bool:
+    """Нужен ли запрос offer-view: мы дороже minPrice из кабинета и есть куда снижать"""
+    if list_min_price is None:
+        return True
+    current_price = Decimal(product["price"])
+    min_profit = Decimal(product['min_profit']) if product['min_profit'] else Decimal('0.00')
+    return current_price > max(Decimal(list_min_price), min_profit)
+
+
+async def _scan_store(store_id, products, clogger) -> list:
+    async with semaphore:
+        try:
+            list_prices = await get_store_offer_prices(store_id)
+        except Exception as e:
+            clogger.error(f"Ошибка сканирования офферов магазина {store_id}: {e}", exc_info=False)
+            list_prices = None
+
+    # без данных кабинета проверяем все товары магазина как раньше
+    if list_prices is None:
+        return list(products)
+    return [p for p in products if needs_lookup(p, list_prices.get(p["kaspi_sku"]))]
+
+
+async def select_candidates(products, clogger) -> list:
+    """
+    Первая фаза: по списку офферов каждого магазина отбирает товары,
+    для которых нужен полный запрос конкурентов.
+    """
+    by_store = defaultdict(list)
+    for p in products:
+        by_store[p["store_id"]].append(p)
+
+    scanned = await asyncio.gather(*(_scan_store(sid, items, clogger) for sid, items in by_store.items()))
+    candidates = [p for store_candidates in scanned for p in store_candidates]
+    clogger.info(f"Двухфазный режим: {len(candidates)} кандидатов из {len(products)} "
+                 f"по {len(by_store)} магазинам.")
+    return candidates
+
+
+def is_full_cycle(cycle: int) -> bool:
+    """В двухфазном режиме каждый TWO_PHASE_FULL_EVERY-й цикл — полный проход"""
+    return not TWO_PHASE_SCAN or cycle % TWO_PHASE_FULL_EVERY == 0
+
+
+async def products_for_cycle(products, cycle: int, clogger) -> list:
+    """
+    Товары, по которым в этом цикле нужно запрашивать конкурентов, в справедливом
+    порядке: магазины чередуются по весу тарифа, сверх часовой квоты — откладываются
+    """
+    if is_full_cycle(cycle):
+        to_check = list(products)
+    else:
+        to_check = await select_candidates(products, clogger)
+        # не уложившиеся в дедлайн в прошлом цикле проверяем, даже если они не кандидаты
+        selected = {p["id"] for p in to_check}
+        to_check += [p for p in products if p["id"] in _retry_ids and p["id"] not in selected]
+    _retry_ids.clear()
+    planned = fair_scheduler.plan(to_check, products)
+    if len(planned) < len(to_check):
+        clogger.info(f"По часовым квотам магазинов отложено {len(to_check) - len(planned)} товаров.")
+    return planned
+
+
+def lag_summary(top: int = 5) -> str:
+    """Магазины с наибольшим отставанием проверки товаров, для лога цикла"""
+    worst = sorted(((value, labels["store"]) for labels, value in store_lag.samples() if labels["stat"] == "max"),
+                   reverse=True)[:top]
+    return ", ".join(f"{store}: {value:.0f} сек" for value, store in worst)
+
+
+# ── Метрики ───────────────────────────────────────────────────────────────────
+def observe_fetch(started: float) -> None:
+    """Время получения списка товаров цикла (started — time.monotonic())"""
+    stage_seconds.observe(time.monotonic() - started, stage=STAGE_FETCH)
+
+
+def record_cycle(started: float, products_count: int) -> None:
+    """Длительность и скорость цикла (started — time.monotonic() в начале цикла)"""
+    elapsed = time.monotonic() - started
+    cycle_seconds.observe(elapsed)
+    cycle_products.set(products_count)
+    products_per_second.set(round(products_count / elapsed, 2) if elapsed > 0 else 0)
+
+
+def metrics_collectors(pool) -> list:
+    """Сборщики gauge, которые обновляются при каждом чтении /metrics"""
+
+    def collect_semaphore():
+        semaphore_in_use.set(MAX_CONCURRENT_TASKS - semaphore._value, limit=MAX_CONCURRENT_TASKS)
+
+    def collect_proxies():
+        stats = proxy_balancer.get_stats()
+        proxy_requests.clear()
+        for index, used in stats["usage"].items():
+            if used:
+                proxy_requests.set(used, proxy=index)
+        proxy_pool.set(stats["pool_size"], state="total")
+        proxy_pool.set(stats["unhealthy"], state="unhealthy")
+
+    async def collect_queue():
+        depth = await queue_depth(pool)
+        jobs_ready.clear()
+        for kind in (JOB_REPRICE_PRODUCT, JOB_SYNC_STORE, *depth):
+            jobs_ready.set(depth.get(kind, 0), kind=kind)
+
+    return [collect_semaphore, collect_proxies, collect_queue]
+
+
+# ── Чекпоинт ──────────────────────────────────────────────────────────────────
+def dump_state(cycle: int) -> dict:
+    """
+    Состояние планирования для чекпоинта: номер цикла, время последних проверок
+    и квоты магазинов (fair_scheduler), перенесённые по дедлайну товары и ещё
+    не просроченные снимки конкурентов
+    """
+    return {
+        "cycle": cycle,
+        "scheduler": fair_scheduler.dump(),
+        "retry_ids": [str(product_id) for product_id in _retry_ids],
+        "offers": offer_cache.dump(),
+    }
+
+
+def restore_state(state: dict, clogger) -> int:
+    """Восстанавливает состояние из чекпоинта, возвращает номер цикла"""
+    if not state:
+        return 0
+    checked = fair_scheduler.restore(state.get("scheduler"))
+    _retry_ids.update(restore_id(product_id) for product_id in state.get("retry_ids") or ())
+    restored = offer_cache.restore(state.get("offers"))
+    cycle = int(state.get("cycle", 0))
+    clogger.info(f"Тёплый старт: цикл {cycle}, известно время проверки {checked} товаров, "
+                 f"перенесённых товаров {len(_retry_ids)}, снимков конкурентов {restored}")
+    return cycle
+
+
+async def shutdown(worker, worker_task, index, checkpoint_file: str, cycle: int, clogger) -> None:
+    """Корректная остановка: дожидаемся начатых задач, сохраняем чекпоинт, закрываем соединения"""
+    request_stop()
+    worker.stop()
+    try:
+        await worker_task
+    except Exception as e:
+        clogger.error(f"Ошибка при остановке воркера очереди: {e}", exc_info=False)
+
+    save_checkpoint(checkpoint_file, dump_state(cycle))
+    # буфер истории цен дописываем до закрытия пула
+    await history_writer.stop()
+    kaspi_recorder.close()
+    await index.close()
+    await close_pool()
+    clogger.info("Демпер остановлен")
+
+
+# ── Задачи очереди ────────────────────────────────────────────────────────────
+def job_handlers(pool, clogger) -> tuple[dict, dict]:
+    """Обработчики задач demper_jobs для JobWorker: (handlers, batch_handlers)"""
+
+    def outcome(product, ok):
+        if ok is None:
+            return JobDeferred()
+        if ok == TIMED_OUT:
+            _retry_ids.discard(product["id"])  # повтор — через очередь, а не через цикл
+            return JobDeferred(delay=TIMEOUT_RETRY_DELAY)
+        if not ok:
+            return RuntimeError(f"не удалось обработать товар {product['kaspi_sku']}")
+        return None
+
+    async def reprice_products(jobs):
+        # все захваченные задачи перерасчёта — одной пачкой через векторный PricingBatch
+        if _stopping:
+            return [JobDeferred() for _ in jobs]
+        found = await fetch_products_by_ids(pool, [job["product_id"] for job in jobs])
+        # товар, который выключили или сняли с продажи, пока задача ждала, просто пропускаем
+        products = [found.get(job["product_id"]) for job in jobs]
+        batch = [product for product in products if product is not None]
+        statuses = iter(await reprice_batch(batch, clogger, pool))
+        return [None if product is None else outcome(product, next(statuses)) for product in products]
+
+    async def sync_store_job(job):
+        async with semaphore:
+            if _stopping:
+                raise JobDeferred()
+            result = await sync_store_api(str(job["store_id"]))
+        clogger.info(f"Синхронизирован магазин {job['store_id']}: {result}")
+
+    return {JOB_SYNC_STORE: sync_store_job}, {JOB_REPRICE_PRODUCT: reprice_products}
+
+
+async def enqueue_cycle(pool, products, store_ids, clogger) -> None:
+    """Ставит в очередь задачи одного цикла: перерасчёт товаров и синхронизацию магазинов"""
+    queued = await enqueue_many(pool, JOB_REPRICE_PRODUCT, ((p["id"], p["store_id"]) for p in products))
+    synced = await enqueue_many(pool, JOB_SYNC_STORE, ((None, sid) for sid in store_ids),
+                                priority=PRIORITY_LOW)
+    clogger.info(f"В очередь поставлено: товаров {queued}, магазинов {synced}.")
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Dict, Any, List
 import asyncio
+import json
 import psutil
 import os
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 from datetime import datetime
+from uuid import UUID
 
 from db import create_pool
 from utils import get_supabase_client
@@ -297,4 +299,152 @@ async def get_process_stats(admin_user_id: str):
 @router.post("/system/restart")
 async def restart_service(service: str, admin_user_id: str):
     await verify_admin(admin_user_id)
-    return {"message": f"Restart command sent for {service}", "status": "pending"}
\ No newline at end of file
+    return {"message": f"Restart command sent for {service}", "status": "pending"}
+
+# ── Отчёты о циклах демпера (demper_runs) ──────────────────────────────────────
+class DemperRun(BaseModel):
+    id: int
+    instance: str
+    cycle: int
+    store_id: Optional[str] = None
+    started_at: datetime
+    finished_at: datetime
+    duration_sec: float
+    products: int
+    lookups: int
+    cache_hits: int
+    pushes: int
+    failures: Dict[str, int]
+    stage_p50_ms: Dict[str, float]
+    stage_p95_ms: Dict[str, float]
+
+class DemperTrendPoint(BaseModel):
+    bucket: datetime
+    cycles: int
+    avg_duration_sec: float
+    max_duration_sec: float
+    products: int
+    lookups: int
+    cache_hits: int
+    pushes: int
+    failures: int
+
+RUN_COLUMNS = """
+    id, instance, cycle, store_id, started_at, finished_at, products, lookups, cache_hits, pushes,
+    failures, stage_p50_ms, stage_p95_ms
+"""
+
+def _run_from_row(row) -> DemperRun:
+    return DemperRun(
+        id=row["id"],
+        instance=row["instance"],
+        cycle=row["cycle"],
+        store_id=str(row["store_id"]) if row["store_id"] else None,
+        started_at=row["started_at"],
+        finished_at=row["finished_at"],
+        duration_sec=(row["finished_at"] - row["started_at"]).total_seconds(),
+        products=row["products"],
+        lookups=row["lookups"],
+        cache_hits=row["cache_hits"],
+        pushes=row["pushes"],
+        failures=json.loads(row["failures"]),
+        stage_p50_ms=json.loads(row["stage_p50_ms"]),
+        stage_p95_ms=json.loads(row["stage_p95_ms"]),
+    )
+
+@router.get("/demper/runs", response_model=List[DemperRun])
+async def get_demper_runs(admin_user_id: str, limit: int = Query(50, ge=1, le=500), instance: Optional[str] = None):
+    """Последние циклы демпера (итоговые строки)"""
+    await verify_admin(admin_user_id)
+    pool = await create_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT {RUN_COLUMNS}
+            FROM demper_runs
+            WHERE store_id IS NULL
+              AND ($2::text IS NULL OR instance = $2)
+            ORDER BY started_at DESC
+            LIMIT $1
+            """,
+            limit, instance
+        )
+    return [_run_from_row(row) for row in rows]
+
+@router.get("/demper/runs/{run_id}/stores", response_model=List[DemperRun])
+async def get_demper_run_stores(run_id: int, admin_user_id: str, limit: int = Query(100, ge=1, le=5000)):
+    """Строки магазинов одного цикла, сначала магазины с наибольшим числом неудач"""
+    await verify_admin(admin_user_id)
+    pool = await create_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT {RUN_COLUMNS}
+            FROM demper_runs
+            WHERE run_id = $1
+            ORDER BY (SELECT COALESCE(SUM(value::int), 0) FROM jsonb_each_text(failures)) DESC, products DESC
+            LIMIT $2
+            """,
+            run_id, limit
+        )
+    return [_run_from_row(row) for row in rows]
+
+@router.get("/demper/stores/{store_id}/runs", response_model=List[DemperRun])
+async def get_demper_store_runs(store_id: UUID, admin_user_id: str, limit: int = Query(50, ge=1, le=500)):
+    """История циклов по одному магазину"""
+    await verify_admin(admin_user_id)
+    pool = await create_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT {RUN_COLUMNS}
+            FROM demper_runs
+            WHERE store_id = $1
+            ORDER BY started_at DESC
+            LIMIT $2
+            """,
+            store_id, limit
+        )
+    return [_run_from_row(row) for row in rows]
+
+@router.get("/demper/trends", response_model=List[DemperTrendPoint])
+async def get_demper_trends(admin_user_id: str, hours: int = Query(24, ge=1, le=24 * 90),
+                            bucket: str = Query("hour", pattern="^(hour|day)$")):
+    """Тренды по циклам: длительность, объём и неудачи по часам или дням"""
+    await verify_admin(admin_user_id)
+    pool = await create_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT date_trunc($1, started_at)                                          AS bucket,
+                   COUNT(*)                                                            AS cycles,
+                   AVG(EXTRACT(EPOCH FROM finished_at - started_at))                   AS avg_duration,
+                   MAX(EXTRACT(EPOCH FROM finished_at - started_at))                   AS max_duration,
+                   SUM(products)                                                       AS products,
+                   SUM(lookups)                                                        AS lookups,
+                   SUM(cache_hits)                                                     AS cache_hits,
+                   SUM(pushes)                                                         AS pushes,
+                   SUM((SELECT COALESCE(SUM(value::int), 0) FROM jsonb_each_text(failures)
+                        WHERE key <> 'skipped'))                                       AS failures
+            FROM demper_runs
+            WHERE store_id IS NULL
+              AND started_at >= now() - make_interval(hours => $2)
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            bucket, hours
+        )
+    return [
+        DemperTrendPoint(
+            bucket=row["bucket"],
+            cycles=row["cycles"],
+            avg_duration_sec=float(row["avg_duration"] or 0),
+            max_duration_sec=float(row["max_duration"] or 0),
+            products=row["products"] or 0,
+            lookups=row["lookups"] or 0,
+            cache_hits=row["cache_hits"] or 0,
+            pushes=row["pushes"] or 0,
+            failures=row["failures"] or 0,
+        )
+        for row in rows
+    ]
@@ -6,6 +6,7 @@ from datetime import datetime
 from pydantic import BaseModel, Field
 from uuid import uuid4
 from db import create_pool
+from job_queue import enqueue_store_reprice
 
 router = APIRouter(prefix="/kaspi/stores", tags=["stores"])
 
@@ -38,6 +39,10 @@ class KaspiStore(BaseModel):
         }
 
 
+class StoreCitiesRequest(BaseModel):
+    city_ids: list[str] = Field(..., min_length=1, description="Коды городов Kaspi, например 750000000 (Алматы)")
+
+
 @router.post("/", response_model=KaspiStore)
 async def create_kaspi_store(store: KaspiStore):
     try:
@@ -158,6 +163,85 @@ async def check_store_session(store_id: str):
             detail=f"Ошибка при проверке сессии магазина: {str(e)}"
         )
         
+@router.put("/{store_id}/cities")
+async def update_store_cities(store_id: str, request: StoreCitiesRequest):
+    """Города, в которых демпер смотрит цены конкурентов для товаров магазина"""
+    city_ids = list(dict.fromkeys(city.strip() for city in request.city_ids))
+    invalid = [city for city in city_ids if not (city.isdigit() and len(city) == 9)]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректные коды городов: {', '.join(invalid)}"
+        )
+
+    try:
+        pool = await create_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE kaspi_stores SET city_ids = $1 WHERE id = $2
+                """,
+                city_ids, store_id
+            )
+
+        if result == "UPDATE 0":
+            logger.warning(f"Store {store_id} not found")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Store not found"
+            )
+
+        logger.info(f"Города магазина {store_id}: {city_ids}")
+        return {
+            "success": True,
+            "city_ids": city_ids,
+            "message": "Города для отслеживания конкурентов обновлены"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении городов магазина {store_id}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при обновлении городов магазина: {str(e)}"
+        )
+
+@router.post("/{store_id}/reprice")
+async def reprice_kaspi_store(store_id: str):
+    """Срочный перерасчёт цен всех активных товаров магазина через очередь демпера"""
+    try:
+        pool = await create_pool()
+        async with pool.acquire() as conn:
+            store = await conn.fetchrow(
+                """
+                SELECT id FROM kaspi_stores WHERE id = $1
+                """,
+                store_id
+            )
+
+        if not store:
+            logger.warning(f"Store {store_id} not found")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Store not found"
+            )
+
+        queued = await enqueue_store_reprice(pool, store_id)
+        logger.info(f"Поставлен перерасчёт {queued} товаров магазина {store_id}")
+        return {
+            "success": True,
+            "queued": queued,
+            "message": f"Перерасчёт цен запущен для товаров: {queued}"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при запуске перерасчёта магазина {store_id}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при запуске перерасчёта магазина: {str(e)}"
+        )
+
 @router.delete("/{store_id}")
 async def delete_kaspi_store(store_id: str, user_id: str):
     try:
@@ -2,8 +2,11 @@ from fastapi import APIRouter, HTTPException, status, Query
 from pydantic import BaseModel, Field
 from uuid import UUID
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from core.ttl_cache import TTLCache
 from db import create_pool
+from downsample import lttb
+from job_queue import request_reprice
 import logging
 import re
 import time
@@ -68,6 +71,27 @@ class PaginatedProductResponse(BaseModel):
     page: int
     page_size: int
 
+class PricePoint(BaseModel):
+    ts: datetime
+    price: float
+
+class PriceHistoryResponse(BaseModel):
+    product_id: UUID
+    date_from: datetime
+    date_to: datetime
+    bucket_seconds: int
+    competitor_min: List[PricePoint]
+    own_price: List[PricePoint]
+
+# популярные диапазоны (последние сутки/неделя) запрашивают многие вкладки панели сразу;
+# ключ — диапазон, выровненный по ширине корзины, так что соседние запросы совпадают
+PRICE_HISTORY_CACHE_TTL = 60
+price_history_cache = TTLCache(ttl=PRICE_HISTORY_CACHE_TTL, max_size=5000)
+# разрешение записи истории — 5 секунд, мельче корзины не делаем
+MIN_BUCKET_SECONDS = 5
+# SQL отдаёт до points * BUCKETS_PER_POINT корзин, LTTB сокращает их до points
+BUCKETS_PER_POINT = 4
+
     
 
 @router.post("/batch_enable", response_model=BatchResponse)
@@ -96,8 +120,12 @@ async def batch_enable_products(request: BatchProductRequest):
                 UPDATE products 
                 SET bot_active = TRUE 
                 WHERE kaspi_product_id = ANY($1) AND store_id = $2
+                RETURNING id
             """
-            await conn.execute(query, valid_ids, str(request.store_id))
+            enabled = await conn.fetch(query, valid_ids, str(request.store_id))
+
+        # включённые товары пересчитываем сразу, не дожидаясь очереди в цикле демпера
+        await request_reprice(pool, request.store_id, [row["id"] for row in enabled])
 
         updated_count = len(valid_ids)
         logger.info(f"Enabled bot_active for {updated_count} products in store {request.store_id}, took {time.time() - start_time:.2f} seconds")
@@ -185,12 +213,17 @@ async def list_products(
 
         pool = await create_pool()
         
+        # name/category/image_url берём из общего справочника мастер-товаров
         base_query = """
-            SELECT id, store_id, kaspi_product_id, name, price, image_url, 
-                   category, bot_active, min_profit, max_profit, 
-                   external_kaspi_id, kaspi_sku, strategy
-            FROM products 
-            WHERE store_id = $1
+            SELECT p.id, p.store_id, p.kaspi_product_id,
+                   COALESCE(m.name, p.name) AS name, p.price,
+                   COALESCE(m.image_url, p.image_url) AS image_url,
+                   COALESCE(m.category, p.category) AS category,
+                   p.bot_active, p.min_profit, p.max_profit,
+                   p.external_kaspi_id, p.kaspi_sku, p.strategy
+            FROM products p
+            LEFT JOIN kaspi_master_products m ON m.kaspi_id = p.master_id
+            WHERE p.store_id = $1
         """
         params = [str(store_id)]
         param_count = 1
@@ -198,24 +231,24 @@ async def list_products(
         if name:
             sanitized_name = sanitize_name_filter(name)
             param_count += 1
-            base_query += f" AND name ILIKE ${param_count}"
+            base_query += f" AND COALESCE(m.name, p.name) ILIKE ${param_count}"
             params.append(f"%{sanitized_name}%")
 
         if active is not None:
             param_count += 1
-            base_query += f" AND bot_active = ${param_count}"
+            base_query += f" AND p.bot_active = ${param_count}"
             params.append(active)
             
         normalized_direction = order_direction.value
 
         if order_by == "id":
-            base_query += f" ORDER BY id {normalized_direction}"
+            base_query += f" ORDER BY p.id {normalized_direction}"
         elif order_by == "price":
-            base_query += f" ORDER BY price {normalized_direction}, id ASC"
+            base_query += f" ORDER BY p.price {normalized_direction}, p.id ASC"
         elif order_by == "bot_active":
-            base_query += f" ORDER BY bot_active {normalized_direction}, id ASC"
+            base_query += f" ORDER BY p.bot_active {normalized_direction}, p.id ASC"
         else:
-            base_query += " ORDER BY id ASC"
+            base_query += " ORDER BY p.id ASC"
 
         offset = (page - 1) * page_size
         base_query += f" LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
@@ -226,20 +259,21 @@ async def list_products(
 
         count_query = """
             SELECT COUNT(*) as total
-            FROM products 
-            WHERE store_id = $1
+            FROM products p
+            LEFT JOIN kaspi_master_products m ON m.kaspi_id = p.master_id
+            WHERE p.store_id = $1
         """
         count_params = [str(store_id)]
         count_param_count = 1
 
         if name:
             count_param_count += 1
-            count_query += f" AND name ILIKE ${count_param_count}"
+            count_query += f" AND COALESCE(m.name, p.name) ILIKE ${count_param_count}"
             count_params.append(f"%{sanitized_name}%")
 
         if active is not None:
             count_param_count += 1
-            count_query += f" AND bot_active = ${count_param_count}"
+            count_query += f" AND p.bot_active = ${count_param_count}"
             count_params.append(active)
 
         async with pool.acquire() as conn:
@@ -369,17 +403,22 @@ async def update_product_strategy(
             UPDATE products 
             SET {', '.join(update_fields)}
             WHERE id = $2 AND store_id = $1
+            RETURNING id, bot_active
         """
         
         async with pool.acquire() as conn:
-            result = await conn.execute(update_query, *params)
+            updated = await conn.fetchrow(update_query, *params)
             
-            if result == 'UPDATE 0':
+            if updated is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Продукт не найден в указанном магазине"
                 )
 
+        # новые границы цены применяем сразу, если бот для товара включён
+        if updated["bot_active"]:
+            await request_reprice(pool, store_id, [updated["id"]])
+
         logger.info(f"Updated product strategy for product {product_id} in store {store_id}, took {time.time() - start_time:.2f} seconds")
         return {
             "success": True,
@@ -394,4 +433,103 @@ async def update_product_strategy(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error during strategy update: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/{product_id}/price_history", response_model=PriceHistoryResponse)
+async def get_price_history(
+    product_id: UUID,
+    store_id: UUID = Query(..., description="ID of the store"),
+    date_from: Optional[datetime] = Query(None, description="Начало периода (по умолчанию — 7 дней назад)"),
+    date_to: Optional[datetime] = Query(None, description="Конец периода (по умолчанию — сейчас)"),
+    points: int = Query(500, ge=10, le=5000, description="Сколько точек вернуть в каждом ряду")
+):
+    """
+    История цены товара для графика: минимальная цена конкурентов (offer_snapshots)
+    и наша цена по успешным решениям демпера (price_decisions). Ряды агрегируются
+    по корзинам времени в SQL и прореживаются LTTB до points точек.
+    """
+    start_time = time.time()
+    try:
+        date_to = date_to or datetime.now(timezone.utc)
+        date_from = date_from or date_to - timedelta(days=7)
+        if date_to.tzinfo is None:
+            date_to = date_to.replace(tzinfo=timezone.utc)
+        if date_from.tzinfo is None:
+            date_from = date_from.replace(tzinfo=timezone.utc)
+        if date_from >= date_to:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="date_from должен быть раньше date_to"
+            )
+
+        span = (date_to - date_from).total_seconds()
+        bucket_seconds = max(MIN_BUCKET_SECONDS, int(span // (points * BUCKETS_PER_POINT)))
+        # выравниваем границы по корзине, чтобы повторные запросы попадали в кэш
+        epoch_to = int(date_to.timestamp()) // bucket_seconds * bucket_seconds + bucket_seconds
+        epoch_from = int(date_from.timestamp()) // bucket_seconds * bucket_seconds
+        cache_key = f"{product_id}:{store_id}:{epoch_from}:{epoch_to}:{points}"
+        cached = price_history_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        pool = await create_pool()
+        async with pool.acquire() as conn:
+            exists = await conn.fetchval(
+                "SELECT 1 FROM products WHERE id = $1 AND store_id = $2", product_id, store_id
+            )
+            if not exists:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Продукт не найден в указанном магазине"
+                )
+
+            range_from = datetime.fromtimestamp(epoch_from, timezone.utc)
+            range_to = datetime.fromtimestamp(epoch_to, timezone.utc)
+            competitor_rows = await conn.fetch(
+                """
+                SELECT floor(extract(epoch FROM ts) / $4) * $4 AS bucket, MIN(price) AS price
+                FROM offer_snapshots
+                WHERE product_id = $1 AND ts >= $2 AND ts < $3
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                product_id, range_from, range_to, bucket_seconds
+            )
+            own_rows = await conn.fetch(
+                """
+                SELECT floor(extract(epoch FROM ts) / $4) * $4 AS bucket,
+                       (array_agg(new_price ORDER BY ts DESC))[1] AS price
+                FROM price_decisions
+                WHERE product_id = $1 AND ts >= $2 AND ts < $3 AND result = 'ok'
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                product_id, range_from, range_to, bucket_seconds
+            )
+
+        def series(rows) -> List[PricePoint]:
+            raw = [(float(row["bucket"]), float(row["price"])) for row in rows]
+            return [PricePoint(ts=datetime.fromtimestamp(x, timezone.utc), price=y) for x, y in lttb(raw, points)]
+
+        response = PriceHistoryResponse(
+            product_id=product_id,
+            date_from=range_from,
+            date_to=range_to,
+            bucket_seconds=bucket_seconds,
+            competitor_min=series(competitor_rows),
+            own_price=series(own_rows),
+        )
+        price_history_cache.put(cache_key, response)
+
+        logger.info(f"Fetched price history for product {product_id}, took {time.time() - start_time:.2f} seconds")
+        return response
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_price_history: {str(e)}, took {time.time() - start_time:.2f} seconds")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error during price history retrieval: {str(e)}"
+        )
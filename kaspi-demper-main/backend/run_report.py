@@ -0,0 +1,154 @@
+# run_report.py итоги каждого цикла демпера (и по магазинам внутри цикла) в таблице demper_runs
+"""
+Шаги цикла (repricing.py) отмечают здесь каждый товар, запрос конкурентов,
+попадание в кэш и отправку цены. В конце цикла итог пишется одной строкой цикла
+и строкой на каждый затронутый магазин; перцентили этапов считаются по разнице
+корзин гистограммы demper_stage_seconds между началом и концом цикла.
+"""
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+from core.metrics import bucket_quantile
+from deadlines import STAGES, stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# сколько дней храним отчёты; чистим раз в DEMPER_RUNS_CLEANUP_EVERY циклов
+DEMPER_RUNS_RETENTION_DAYS = int(os.getenv("DEMPER_RUNS_RETENTION_DAYS", "30"))
+DEMPER_RUNS_CLEANUP_EVERY = 100
+
+# классы неудач товара в failures
+FAIL_LOOKUP = "lookup_error"
+FAIL_TIMEOUT = "timeout"
+FAIL_PUSH = "push_error"
+FAIL_SKIPPED = "skipped"
+
+
+class StoreStats:
+    __slots__ = ("products", "lookups", "pushes", "failures")
+
+    def __init__(self):
+        self.products = 0
+        self.lookups = 0
+        self.pushes = 0
+        self.failures = Counter()
+
+
+class CycleReport:
+    def __init__(self, instance: str, cycle: int):
+        self.instance = instance
+        self.cycle = cycle
+        self.started_at = datetime.now(timezone.utc)
+        self.cache_hits = 0
+        self.stores: dict = {}
+        self._stage_counts = {stage: stage_seconds.counts(stage=stage) for stage in STAGES}
+
+    def _store(self, store_id) -> StoreStats:
+        stats = self.stores.get(store_id)
+        if stats is None:
+            stats = self.stores[store_id] = StoreStats()
+        return stats
+
+    def stage_percentiles(self, q: float) -> dict:
+        """Перцентиль длительности этапов за этот цикл, мс"""
+        result = {}
+        for stage, before in self._stage_counts.items():
+            delta = [now - then for now, then in zip(stage_seconds.counts(stage=stage), before)]
+            value = bucket_quantile(stage_seconds.buckets, delta, q)
+            if value is not None:
+                result[stage] = round(value * 1000, 1)
+        return result
+
+    def totals(self) -> StoreStats:
+        total = StoreStats()
+        for stats in self.stores.values():
+            total.products += stats.products
+            total.lookups += stats.lookups
+            total.pushes += stats.pushes
+            total.failures.update(stats.failures)
+        return total
+
+
+# отчёт текущего цикла процесса; None — цикл не идёт (например, разовый запуск)
+_current: CycleReport | None = None
+
+
+def begin_cycle(instance: str, cycle: int) -> CycleReport:
+    global _current
+    _current = CycleReport(instance, cycle)
+    return _current
+
+
+def record_product(store_id, looked_up: bool, failure: str | None = None) -> None:
+    if _current is None:
+        return
+    stats = _current._store(store_id)
+    stats.products += 1
+    if looked_up:
+        stats.lookups += 1
+    if failure:
+        stats.failures[failure] += 1
+
+
+def record_push(store_id, ok: bool, failure: str | None = None) -> None:
+    if _current is None:
+        return
+    stats = _current._store(store_id)
+    if ok:
+        stats.pushes += 1
+    elif failure:
+        stats.failures[failure] += 1
+
+
+def record_cache_hit() -> None:
+    if _current is not None:
+        _current.cache_hits += 1
+
+
+async def finish_cycle(pool) -> int | None:
+    """Пишет итог текущего цикла и строки магазинов; возвращает id строки цикла"""
+    global _current
+    report, _current = _current, None
+    if report is None:
+        return None
+
+    finished_at = datetime.now(timezone.utc)
+    total = report.totals()
+    p50 = json.dumps(report.stage_percentiles(0.5))
+    p95 = json.dumps(report.stage_percentiles(0.95))
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                run_id = await conn.fetchval(
+                    """
+                    INSERT INTO demper_runs (instance, cycle, started_at, finished_at, products, lookups,
+                                             cache_hits, pushes, failures, stage_p50_ms, stage_p95_ms)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9::jsonb, $10::jsonb, $11::jsonb)
+                    RETURNING id
+                    """,
+                    report.instance, report.cycle, report.started_at, finished_at, total.products,
+                    total.lookups, report.cache_hits, total.pushes, json.dumps(total.failures), p50, p95
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO demper_runs (run_id, instance, cycle, store_id, started_at, finished_at,
+                                             products, lookups, pushes, failures)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10::jsonb)
+                    """,
+                    [(run_id, report.instance, report.cycle, store_id, report.started_at, finished_at,
+                      stats.products, stats.lookups, stats.pushes, json.dumps(stats.failures))
+                     for store_id, stats in report.stores.items()]
+                )
+            if report.cycle % DEMPER_RUNS_CLEANUP_EVERY == 0:
+                await conn.execute(
+                    "DELETE FROM demper_runs WHERE run_id IS NULL AND started_at < now() - make_interval(days => $1)",
+                    DEMPER_RUNS_RETENTION_DAYS
+                )
+        return run_id
+    except Exception as e:
+        # отчёт — вспомогательный: из-за него цикл не должен падать
+        logger.error(f"Не удалось записать отчёт цикла {report.cycle}: {e}")
+        return None
@@ -0,0 +1,281 @@
+# schema.py доработки схемы БД, которые бэкенд и демпер применяют сами при старте
+import hashlib
+import logging
+
+from db import create_pool
+
+logger = logging.getLogger(__name__)
+
+# ключ advisory-lock, чтобы несколько инстансов не накатывали схему одновременно
+SCHEMA_LOCK_KEY = 7_051_001
+
+SCHEMA_STATEMENTS = [
+    # ── Tombstone снятых с продажи офферов ────────────────────────────────────
+    # существующим строкам last_seen_at проставится время миграции
+    """
+    ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMPTZ DEFAULT now()
+    """,
+    """
+    ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS delisted_at TIMESTAMPTZ
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_products_bot_active_listed
+        ON products (store_id)
+        WHERE bot_active = TRUE AND delisted_at IS NULL
+    """,
+    # ── Общий справочник мастер-товаров Kaspi ─────────────────────────────────
+    # name/category/image_url одного мастер-товара хранятся один раз на все магазины;
+    # копии в products синхронизация пока тоже обновляет — их читает фронтенд через Supabase
+    """
+    CREATE TABLE IF NOT EXISTS kaspi_master_products (
+        kaspi_id   TEXT PRIMARY KEY,
+        name       TEXT,
+        category   TEXT,
+        image_url  TEXT,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS master_id TEXT REFERENCES kaspi_master_products (kaspi_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_products_master_id
+        ON products (master_id)
+    """,
+    # перенос метаданных из строк магазинов, ещё не привязанных к справочнику
+    """
+    INSERT INTO kaspi_master_products (kaspi_id, name, category, image_url)
+    SELECT DISTINCT ON (external_kaspi_id::text) external_kaspi_id::text, name, category, image_url
+    FROM products
+    WHERE master_id IS NULL
+      AND external_kaspi_id IS NOT NULL
+    ORDER BY external_kaspi_id::text
+    ON CONFLICT (kaspi_id) DO NOTHING
+    """,
+    """
+    UPDATE products
+    SET master_id = external_kaspi_id::text
+    WHERE master_id IS NULL
+      AND external_kaspi_id IS NOT NULL
+    """,
+    # ── NOTIFY об изменениях товаров для индекса активных товаров демпера ────
+    # шлём только изменения полей, которые нужны демперу; h — для шардирования
+    """
+    CREATE OR REPLACE FUNCTION notify_products_changed() RETURNS trigger AS
+    $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('products_changed', json_build_object(
+                'op', TG_OP,
+                'id', OLD.id,
+                'h', abs(hashtext(OLD.id::text))
+            )::text);
+            RETURN OLD;
+        END IF;
+
+        IF TG_OP = 'UPDATE' AND
+           (NEW.store_id, NEW.kaspi_sku, NEW.external_kaspi_id, NEW.price, NEW.min_profit,
+            NEW.max_profit, NEW.bot_active, NEW.delisted_at IS NULL)
+               IS NOT DISTINCT FROM
+           (OLD.store_id, OLD.kaspi_sku, OLD.external_kaspi_id, OLD.price, OLD.min_profit,
+            OLD.max_profit, OLD.bot_active, OLD.delisted_at IS NULL) THEN
+            RETURN NEW;
+        END IF;
+
+        PERFORM pg_notify('products_changed', json_build_object(
+            'op', TG_OP,
+            'id', NEW.id,
+            'store_id', NEW.store_id,
+            'kaspi_sku', NEW.kaspi_sku,
+            'external_kaspi_id', NEW.external_kaspi_id,
+            'price', NEW.price,
+            'min_profit', NEW.min_profit,
+            'max_profit', NEW.max_profit,
+            'active', NEW.bot_active AND NEW.delisted_at IS NULL,
+            'h', abs(hashtext(NEW.id::text))
+        )::text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO
+    $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1
+                       FROM pg_trigger
+                       WHERE tgname = 'products_notify_changed'
+                         AND tgrelid = 'products'::regclass) THEN
+            CREATE TRIGGER products_notify_changed
+                AFTER INSERT OR UPDATE OR DELETE
+                ON products
+                FOR EACH ROW
+            EXECUTE FUNCTION notify_products_changed();
+        END IF;
+    END
+    $$
+    """,
+    # ── Очередь задач демпера (см. job_queue.py) ─────────────────────────────
+    # dedupe_key не даёт копиться одинаковым задачам, пока они ждут выполнения
+    """
+    CREATE TABLE IF NOT EXISTS demper_jobs (
+        id           BIGSERIAL PRIMARY KEY,
+        kind         TEXT        NOT NULL,
+        product_id   UUID,
+        store_id     UUID,
+        dedupe_key   TEXT        NOT NULL,
+        priority     SMALLINT    NOT NULL DEFAULT 100,
+        run_after    TIMESTAMPTZ NOT NULL DEFAULT now(),
+        attempts     INTEGER     NOT NULL DEFAULT 0,
+        max_attempts INTEGER     NOT NULL DEFAULT 5,
+        locked_at    TIMESTAMPTZ,
+        locked_by    TEXT,
+        last_error   TEXT,
+        dead_at      TIMESTAMPTZ,
+        created_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_demper_jobs_pending_dedupe
+        ON demper_jobs (dedupe_key)
+        WHERE locked_at IS NULL AND dead_at IS NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_demper_jobs_claim
+        ON demper_jobs (priority, run_after, id)
+        WHERE locked_at IS NULL AND dead_at IS NULL
+    """,
+    # ── Общий бюджет запросов к Kaspi (см. rate_budget.py) ───────────────────
+    """
+    CREATE TABLE IF NOT EXISTS kaspi_rate_buckets (
+        bucket      TEXT PRIMARY KEY,
+        tokens      DOUBLE PRECISION NOT NULL,
+        capacity    DOUBLE PRECISION NOT NULL,
+        refill_rate DOUBLE PRECISION NOT NULL,
+        updated_at  TIMESTAMPTZ      NOT NULL DEFAULT clock_timestamp()
+    )
+    """,
+    # ── Города, в которых магазин следит за конкурентами ─────────────────────
+    """
+    ALTER TABLE kaspi_stores
+        ADD COLUMN IF NOT EXISTS city_ids TEXT[] NOT NULL DEFAULT ARRAY ['750000000']
+    """,
+    # ── Тариф магазина: вес в очереди демпера и часовая квота (fair_scheduler.py) ──
+    """
+    ALTER TABLE kaspi_stores
+        ADD COLUMN IF NOT EXISTS plan_tier TEXT NOT NULL DEFAULT 'basic'
+    """,
+    # ── Отчёты о циклах демпера (run_report.py) ──────────────────────────────
+    # строка с store_id IS NULL — итог цикла, строки магазинов ссылаются на неё через run_id
+    """
+    CREATE TABLE IF NOT EXISTS demper_runs (
+        id           BIGSERIAL PRIMARY KEY,
+        run_id       BIGINT REFERENCES demper_runs (id) ON DELETE CASCADE,
+        instance     TEXT        NOT NULL,
+        cycle        INTEGER     NOT NULL,
+        store_id     UUID,
+        started_at   TIMESTAMPTZ NOT NULL,
+        finished_at  TIMESTAMPTZ NOT NULL,
+        products     INTEGER     NOT NULL DEFAULT 0,
+        lookups      INTEGER     NOT NULL DEFAULT 0,
+        cache_hits   INTEGER     NOT NULL DEFAULT 0,
+        pushes       INTEGER     NOT NULL DEFAULT 0,
+        failures     JSONB       NOT NULL DEFAULT '{}',
+        stage_p50_ms JSONB       NOT NULL DEFAULT '{}',
+        stage_p95_ms JSONB       NOT NULL DEFAULT '{}'
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_demper_runs_cycles
+        ON demper_runs (started_at DESC) WHERE store_id IS NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_demper_runs_run_id
+        ON demper_runs (run_id) WHERE run_id IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_demper_runs_store
+        ON demper_runs (store_id, started_at DESC) WHERE store_id IS NOT NULL
+    """,
+    # ── История цен (history_writer.py): секции по дням создаёт и удаляет демпер ──
+    """
+    CREATE TABLE IF NOT EXISTS offer_snapshots (
+        ts          TIMESTAMPTZ NOT NULL,
+        product_id  UUID        NOT NULL,
+        city_id     INTEGER     NOT NULL,
+        merchant_id TEXT        NOT NULL,
+        price       INTEGER     NOT NULL
+    ) PARTITION BY RANGE (ts)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_offer_snapshots_product
+        ON offer_snapshots (product_id, ts)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_decisions (
+        ts             TIMESTAMPTZ NOT NULL,
+        product_id     UUID        NOT NULL,
+        old_price      INTEGER     NOT NULL,
+        new_price      INTEGER     NOT NULL,
+        competitor_min INTEGER     NOT NULL,
+        result         TEXT        NOT NULL
+    ) PARTITION BY RANGE (ts)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_price_decisions_product
+        ON price_decisions (product_id, ts)
+    """,
+]
+
+
+# версия схемы — отпечаток SCHEMA_STATEMENTS: любая их правка накатывается заново
+SCHEMA_VERSION = hashlib.sha256("\n".join(SCHEMA_STATEMENTS).encode()).hexdigest()[:16]
+
+SCHEMA_VERSION_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS demper_schema_version (
+        id         BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version    TEXT        NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+async def _applied_version(conn) -> str | None:
+    if await conn.fetchval("SELECT to_regclass('demper_schema_version')") is None:
+        return None
+    return await conn.fetchval("SELECT version FROM demper_schema_version")
+
+
+async def ensure_schema(pool=None):
+    """
+    Применяет SCHEMA_STATEMENTS (все они идемпотентны), если эта версия схемы ещё
+    не накатана. Обычный перезапуск (в том числе рестарты воркеров супервизором)
+    читает одну строку demper_schema_version и не берёт блокировок на products.
+    """
+    if pool is None:
+        pool = await create_pool()
+
+    async with pool.acquire() as conn:
+        if await _applied_version(conn) == SCHEMA_VERSION:
+            logger.info(f"Схема БД актуальна (версия {SCHEMA_VERSION})")
+            return
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_KEY)
+            # пока ждали блокировку, схему мог накатить другой инстанс
+            if await _applied_version(conn) == SCHEMA_VERSION:
+                return
+            for statement in SCHEMA_STATEMENTS:
+                await conn.execute(statement)
+            await conn.execute(SCHEMA_VERSION_STATEMENT)
+            await conn.execute(
+                """
+                INSERT INTO demper_schema_version (version)
+                VALUES ($1)
+                ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, applied_at = now()
+                """,
+                SCHEMA_VERSION
+            )
+    logger.info(f"Схема БД обновлена до версии {SCHEMA_VERSION}")
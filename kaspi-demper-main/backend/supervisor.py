@@ -0,0 +1,200 @@
+# supervisor.py запускает несколько процессов демпера на одном хосте
+# nohup python3 supervisor.py > supervisor.log 2>&1 &
+"""
+Каждый воркер — отдельный процесс demper_instance.py со своим циклом событий
+и пулом соединений; шард задаётся через INSTANCE_INDEX / INSTANCE_COUNT.
+Супервизор перезапускает упавшие воркеры, а если воркер падает раз за разом —
+перераспределяет шарды между оставшимися. Метрики воркеров (снимки в
+METRICS_DIR) суммируются в METRICS_DIR/aggregate.json.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from core.metrics import merge_snapshots
+
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+WORKER_SCRIPT = os.getenv("SUPERVISOR_WORKER_SCRIPT", "demper_instance.py")
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+# пауза перед перезапуском растёт с каждым падением подряд, но не больше максимума
+RESTART_BACKOFF = float(os.getenv("SUPERVISOR_RESTART_BACKOFF", "2"))
+RESTART_BACKOFF_MAX = float(os.getenv("SUPERVISOR_RESTART_BACKOFF_MAX", "60"))
+# столько падений за CRASH_WINDOW секунд — и воркер исключается, шарды перераспределяются
+CRASH_LIMIT = int(os.getenv("SUPERVISOR_CRASH_LIMIT", "5"))
+CRASH_WINDOW = float(os.getenv("SUPERVISOR_CRASH_WINDOW", "300"))
+STOP_TIMEOUT = float(os.getenv("SUPERVISOR_STOP_TIMEOUT", "50"))
+AGGREGATE_INTERVAL = float(os.getenv("SUPERVISOR_AGGREGATE_INTERVAL", "15"))
+# снимок не живого процесса (упал, перезапускается) учитывается не дольше этого срока
+SNAPSHOT_MAX_AGE = AGGREGATE_INTERVAL * float(os.getenv("SUPERVISOR_SNAPSHOT_MAX_INTERVALS", "4"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [supervisor] %(message)s")
+logger = logging.getLogger("supervisor")
+
+
+class Worker:
+    def __init__(self):
+        self.process: asyncio.subprocess.Process | None = None
+        self.crashes: list[float] = []
+
+    def recent_crashes(self) -> int:
+        now = time.time()
+        self.crashes = [t for t in self.crashes if now - t < CRASH_WINDOW]
+        return len(self.crashes)
+
+
+class Supervisor:
+    def __init__(self, workers: int):
+        self.slots = [Worker() for _ in range(max(1, workers))]
+        self.stopping = False
+        self._generation = 0  # меняется при перераспределении шардов
+
+    # ── Процессы ─────────────────────────────────────────────────────────────
+    def _env(self, index: int, count: int) -> dict:
+        return {
+            **os.environ,
+            "INSTANCE_INDEX": str(index),
+            "INSTANCE_COUNT": str(count),
+            "METRICS_DIR": METRICS_DIR,
+        }
+
+    async def _spawn(self, worker: Worker, index: int, count: int):
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT, env=self._env(index, count)
+        )
+        logger.info(f"Воркер {index}/{count} запущен, pid {worker.process.pid}")
+
+    async def _watch(self, worker: Worker, generation: int):
+        """Держит воркер живым, пока не сменилось распределение шардов"""
+        failures_in_row = 0
+        while not self.stopping and generation == self._generation:
+            index, count = self.slots.index(worker), len(self.slots)
+            await self._spawn(worker, index, count)
+            started = time.time()
+            code = await worker.process.wait()
+            if self.stopping or generation != self._generation:
+                return
+
+            worker.crashes.append(time.time())
+            failures_in_row = failures_in_row + 1 if time.time() - started < CRASH_WINDOW else 1
+            logger.error(f"Воркер {index}/{count} завершился с кодом {code}")
+
+            if worker.recent_crashes() >= CRASH_LIMIT and len(self.slots) > 1:
+                logger.error(f"Воркер {index} падает {CRASH_LIMIT} раз подряд — перераспределяем шарды")
+                await self._rebalance(drop=worker)
+                return
+
+            await asyncio.sleep(min(RESTART_BACKOFF * 2 ** (failures_in_row - 1), RESTART_BACKOFF_MAX))
+
+    async def _rebalance(self, drop: Worker):
+        """Убирает воркер и перезапускает остальные с новым INSTANCE_COUNT"""
+        self._generation += 1
+        self.slots.remove(drop)
+        await self._terminate_all()
+        self._remove_extra_snapshots()
+        logger.info(f"Новое распределение: {len(self.slots)} воркеров")
+        self._start_watchers()
+
+    def _start_watchers(self):
+        generation = self._generation
+        for worker in self.slots:
+            asyncio.create_task(self._watch(worker, generation))
+
+    async def _terminate_all(self):
+        """SIGTERM всем воркерам; кто не уложился в STOP_TIMEOUT — SIGKILL"""
+        running = [w.process for w in self.slots if w.process and w.process.returncode is None]
+        for process in running:
+            process.terminate()
+        if not running:
+            return
+        _, pending = await asyncio.wait([asyncio.create_task(p.wait()) for p in running], timeout=STOP_TIMEOUT)
+        for process in running:
+            if process.returncode is None:
+                logger.warning(f"Воркер pid {process.pid} не остановился за {STOP_TIMEOUT} сек, убиваем")
+                process.kill()
+        if pending:
+            await asyncio.wait(pending)
+
+    # ── Метрики ──────────────────────────────────────────────────────────────
+    @staticmethod
+    def _snapshot_index(name: str) -> int | None:
+        """Номер воркера по имени снимка demper_<index>.json"""
+        if not name.startswith("demper_") or not name.endswith(".json"):
+            return None
+        index = name[len("demper_"):-len(".json")]
+        return int(index) if index.isdigit() else None
+
+    def _remove_extra_snapshots(self):
+        """Удаляет снимки воркеров, которых нет в текущем распределении (после перераспределения или прошлого запуска)"""
+        for name in os.listdir(METRICS_DIR):
+            index = self._snapshot_index(name)
+            if index is None or index < len(self.slots):
+                continue
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError as e:
+                logger.warning(f"Не удалось удалить снимок {name}: {e}")
+
+    def aggregate_metrics(self) -> dict:
+        snapshots, workers = [], {}
+        slots, now = list(self.slots), time.time()  # список может смениться при перераспределении
+        for name in sorted(os.listdir(METRICS_DIR)):
+            index = self._snapshot_index(name)
+            if index is None or index >= len(slots):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # живой воркер пишет снимок раз в цикл, а цикл бывает долгим — его не отбрасываем
+            process = slots[index].process
+            alive = process is not None and process.returncode is None and process.pid == data.get("pid")
+            age = now - data.get("written_at", 0)
+            if not alive and age > SNAPSHOT_MAX_AGE:
+                continue
+            snapshots.append(data["metrics"])
+            workers[name[:-5]] = {"pid": data.get("pid"), "cycle": data.get("cycle"), "age_sec": round(age, 1)}
+        return {"written_at": time.time(), "workers": workers, "metrics": merge_snapshots(snapshots)}
+
+    async def _aggregate_loop(self):
+        while not self.stopping:
+            await asyncio.sleep(AGGREGATE_INTERVAL)
+            try:
+                aggregate = await asyncio.to_thread(self.aggregate_metrics)
+                tmp_path = os.path.join(METRICS_DIR, "aggregate.json.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(aggregate, f, ensure_ascii=False)
+                os.replace(tmp_path, os.path.join(METRICS_DIR, "aggregate.json"))
+            except (OSError, KeyError, TypeError) as e:
+                logger.warning(f"Не удалось собрать метрики воркеров: {e!r}")
+                continue
+            totals = {name: sum(v for _, v in m["samples"]) for name, m in aggregate["metrics"].items()}
+            logger.info(f"Воркеров: {len(aggregate['workers'])}, метрики: {totals}")
+
+    # ── Запуск ───────────────────────────────────────────────────────────────
+    async def run(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._remove_extra_snapshots()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        logger.info(f"Запускаем {len(self.slots)} воркеров ({WORKER_SCRIPT})")
+        self._start_watchers()
+        aggregator = asyncio.create_task(self._aggregate_loop())
+
+        await stop.wait()
+        logger.info("Остановка: передаём SIGTERM воркерам")
+        self.stopping = True
+        aggregator.cancel()
+        await self._terminate_all()
+        logger.info("Все воркеры остановлены")
+
+
+if __name__ == "__main__":
+    asyncio.run(Supervisor(SUPERVISOR_WORKERS).run())
@@ -0,0 +1,157 @@
+# test_deadlines.py
+"""
+Тесты дедлайнов этапов (deadlines.py) и таймаутов запросов к Kaspi
+на медленном локальном сервере
+"""
+
+import asyncio
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import api_parser
+import deadlines
+from deadlines import STAGE_LOOKUP, STAGE_PUSH, StageTimeout, run_stage, start_cycle_deadline
+
+READ_TIMEOUT = 0.2
+
+
+@pytest_asyncio.fixture
+async def slow_kaspi(monkeypatch):
+    """Kaspi, который отвечает дольше таймаута чтения сокета"""
+
+    async def slow(request):
+        await asyncio.sleep(READ_TIMEOUT * 10)
+        return web.json_response({"offers": [], "status": "success"})
+
+    app = web.Application()
+    app.router.add_post("/yml/offer-view/offers/{sku}", slow)
+    app.router.add_post("/pricefeed/upload/merchant/process", slow)
+    server = TestServer(app)
+    await server.start_server()
+
+    url = str(server.make_url("")).rstrip("/")
+    monkeypatch.setattr(api_parser, "KASPI_BASE_URL", url)
+    monkeypatch.setattr(api_parser, "KASPI_MC_URL", url)
+    # с KASPI_REPLAY_URL запросы идут напрямую, без прокси
+    monkeypatch.setattr(api_parser, "KASPI_REPLAY_URL", url)
+    monkeypatch.setattr(api_parser, "HEDGE_LOOKUPS", False)
+    monkeypatch.setattr(api_parser, "kaspi_http_timeout",
+                        aiohttp.ClientTimeout(total=None, connect=1, sock_read=READ_TIMEOUT))
+    start_cycle_deadline(0)
+    yield url
+    await server.close()
+
+
+class TestRunStage:
+    """Тесты run_stage"""
+
+    @pytest.mark.asyncio
+    async def test_result(self):
+        """Этап, уложившийся в дедлайн, возвращает результат"""
+        start_cycle_deadline(0)
+
+        async def fast():
+            return 42
+
+        assert await run_stage(STAGE_LOOKUP, fast()) == 42
+
+    @pytest.mark.asyncio
+    async def test_stage_deadline(self, monkeypatch):
+        """Этап дольше своего потолка отменяется с StageTimeout"""
+        start_cycle_deadline(0)
+        monkeypatch.setitem(deadlines.STAGE_TIMEOUTS, STAGE_LOOKUP, 0.05)
+
+        with pytest.raises(StageTimeout):
+            await run_stage(STAGE_LOOKUP, asyncio.sleep(1))
+
+    @pytest.mark.asyncio
+    async def test_exhausted_cycle_budget(self):
+        """При исчерпанном бюджете цикла этап не начинается"""
+        start_cycle_deadline(0.001)
+        await asyncio.sleep(0.01)
+        started = asyncio.get_running_loop().time()
+
+        with pytest.raises(StageTimeout):
+            await run_stage(STAGE_LOOKUP, asyncio.sleep(1))
+        assert asyncio.get_running_loop().time() - started < 0.5
+
+
+class TestKaspiTimeouts:
+    """Таймауты aiohttp не должны превращаться в «нет конкурентов» или «цена отправлена»"""
+
+    @pytest.mark.asyncio
+    async def test_lookup_read_timeout_is_stage_timeout(self, slow_kaspi):
+        """Таймаут чтения offer-view поднимает StageTimeout, а не возвращает []"""
+        with pytest.raises(StageTimeout):
+            await run_stage(STAGE_LOOKUP, api_parser.parse_product_by_sku("100000001"))
+
+    @pytest.mark.asyncio
+    async def test_push_read_timeout_is_stage_timeout(self, slow_kaspi):
+        """Таймаут чтения pricefeed поднимает StageTimeout, а не возвращает {}"""
+        product_data = {"merchant_id": "M1", "kaspi_sku": "SKU-1", "sku": "1", "price": 1000.0}
+
+        with pytest.raises(StageTimeout):
+            await run_stage(STAGE_PUSH, api_parser.send_price_update_request(product_data, {}))
+
+
+class TestHedgedLookup:
+    """Отмена хеджированного поиска (дедлайн этапа) отменяет и основной, и дублирующий запрос"""
+
+    @pytest.fixture
+    def requests(self, monkeypatch):
+        started, cancelled = [], []
+
+        async def offer_view_request(sku, city_id, proxy_dict):
+            started.append(proxy_dict)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(proxy_dict)
+                raise
+
+        monkeypatch.setattr(api_parser, "_offer_view_request", offer_view_request)
+        monkeypatch.setattr(api_parser.proxy_balancer, "get_balanced_proxy", lambda key: "primary")
+        monkeypatch.setattr(api_parser.proxy_balancer, "get_hedge_proxy", lambda exclude: "hedge")
+        monkeypatch.setattr(api_parser, "_hedge_delay", lambda: 0.05)
+        return started, cancelled
+
+    @pytest.mark.asyncio
+    async def test_cancel_before_hedge(self, requests):
+        """Отмена до отправки дубля не оставляет основной запрос висеть"""
+        started, cancelled = requests
+        task = asyncio.create_task(api_parser._hedged_offer_view("100000001", "750000000"))
+        await asyncio.sleep(0.01)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert started == cancelled == ["primary"]
+
+    @pytest.mark.asyncio
+    async def test_cancel_without_hedge_budget(self, requests, monkeypatch):
+        """Дубль не отправлен (нет бюджета) — отмена всё равно доходит до основного"""
+        started, cancelled = requests
+        monkeypatch.setattr(api_parser, "_hedge_allowed", lambda: False)
+        monkeypatch.setitem(deadlines.STAGE_TIMEOUTS, STAGE_LOOKUP, 0.2)
+        start_cycle_deadline(0)
+
+        with pytest.raises(StageTimeout):
+            await run_stage(STAGE_LOOKUP, api_parser._hedged_offer_view("100000001", "750000000"))
+        assert started == cancelled == ["primary"]
+
+    @pytest.mark.asyncio
+    async def test_cancel_after_hedge(self, requests, monkeypatch):
+        started, cancelled = requests
+        monkeypatch.setattr(api_parser, "_hedge_allowed", lambda: True)
+        task = asyncio.create_task(api_parser._hedged_offer_view("100000001", "750000000"))
+        await asyncio.sleep(0.1)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert started == ["primary", "hedge"]
+        assert sorted(cancelled) == ["hedge", "primary"]
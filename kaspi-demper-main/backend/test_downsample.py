@@ -0,0 +1,84 @@
+# test_downsample.py
+"""
+Тесты прореживания рядов для графиков (downsample.py) и кэша ответов (core/ttl_cache.py)
+"""
+
+import math
+
+import pytest
+
+from core.ttl_cache import TTLCache
+from downsample import lttb
+
+
+def series(n):
+    return [(float(i), math.sin(i / 10)) for i in range(n)]
+
+
+class TestLTTB:
+    """Тесты Largest-Triangle-Three-Buckets"""
+
+    @pytest.mark.parametrize("n, threshold", [(1000, 100), (1000, 3), (101, 50), (5000, 997)])
+    def test_size_and_ends(self, n, threshold):
+        """Ровно threshold точек, первая и последняя сохраняются, x по возрастанию"""
+        points = series(n)
+
+        sampled = lttb(points, threshold)
+
+        assert len(sampled) == threshold
+        assert sampled[0] == points[0]
+        assert sampled[-1] == points[-1]
+        xs = [x for x, _ in sampled]
+        assert xs == sorted(xs) and len(set(xs)) == len(xs)
+        assert set(sampled) <= set(points)
+
+    @pytest.mark.parametrize("threshold", [0, 2, 10, 50])
+    def test_short_series_unchanged(self, threshold):
+        """Ряд не длиннее threshold (или threshold < 3) возвращается как есть"""
+        points = series(10)
+
+        assert lttb(points, threshold) == points
+
+    def test_empty(self):
+        assert lttb([], 100) == []
+
+    def test_keeps_spike(self):
+        """Одиночный выброс цены не теряется при прореживании"""
+        points = [(float(i), 1000.0) for i in range(1000)]
+        points[537] = (537.0, 500.0)
+
+        assert (537.0, 500.0) in lttb(points, 20)
+
+
+class TestTTLCache:
+    """Тесты кэша с временем жизни"""
+
+    def test_get_put(self):
+        cache = TTLCache(ttl=60, max_size=10)
+        cache.put("a", {"x": 1})
+
+        assert cache.get("a") == {"x": 1}
+        assert cache.get("b") is None
+        assert cache.get("b", "default") == "default"
+
+    def test_expired(self):
+        cache = TTLCache(ttl=60, max_size=10)
+        cache.put("a", 1, stored_at=0)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_evicts_oldest_when_full(self):
+        cache = TTLCache(ttl=60, max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("c", 3)
+
+        assert cache.get("a") is None
+        assert (cache.get("b"), cache.get("c")) == (2, 3)
+
+    def test_disabled(self):
+        cache = TTLCache(ttl=0, max_size=10)
+        cache.put("a", 1)
+
+        assert len(cache) == 0
@@ -0,0 +1,138 @@
+# test_fair_scheduler.py
+"""
+Тесты справедливого планировщика товаров (fair_scheduler.py)
+"""
+
+import time
+
+import pytest
+
+import fair_scheduler
+from fair_scheduler import FairScheduler, _parse_tiers
+
+
+def products(store_id, count):
+    return [{"id": f"{store_id}-{i}", "store_id": store_id} for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def tiers(monkeypatch):
+    monkeypatch.setattr(fair_scheduler, "TIER_WEIGHTS", {"basic": 1.0, "pro": 2.0, "business": 4.0})
+    monkeypatch.setattr(fair_scheduler, "TIER_HOURLY_QUOTAS", {})
+    monkeypatch.setattr(fair_scheduler, "FAIR_QUANTUM", 1)
+
+
+class TestParseTiers:
+    def test_parse(self):
+        assert _parse_tiers("basic=1, pro=2.5,,broken=") == {"basic": 1.0, "pro": 2.5}
+
+
+class TestWeights:
+    """Тесты чередования магазинов по весу тарифа"""
+
+    def test_round_robin(self):
+        """Магазины с одинаковым весом чередуются по одному товару"""
+        scheduler = FairScheduler()
+
+        order = [p["store_id"] for p in scheduler.plan(products("a", 3) + products("b", 3))]
+
+        assert order == ["a", "b", "a", "b", "a", "b"]
+
+    def test_weighted(self):
+        """Магазин с весом 2 получает два товара за раунд"""
+        scheduler = FairScheduler()
+        scheduler.set_tiers({"a": "pro", "b": "basic"})
+
+        order = [p["store_id"] for p in scheduler.plan(products("a", 4) + products("b", 4))]
+
+        assert order[:6] == ["a", "a", "b", "a", "a", "b"]
+        assert order[6:] == ["b", "b"]
+
+    def test_big_store_does_not_block_small(self):
+        """Маленький магазин не ждёт, пока пройдёт весь каталог большого"""
+        scheduler = FairScheduler()
+
+        order = [p["store_id"] for p in scheduler.plan(products("big", 1000) + products("small", 2))]
+
+        assert order.index("small") == 1
+        assert len(order) == 1002
+
+    def test_fractional_weight(self):
+        """Вес меньше 1 копит дефицит и всё равно доходит до товаров"""
+        fair_scheduler.TIER_WEIGHTS["slow"] = 0.5
+        scheduler = FairScheduler()
+        scheduler.set_tiers({"a": "slow"})
+
+        order = [p["store_id"] for p in scheduler.plan(products("a", 2) + products("b", 4))]
+
+        assert order == ["b", "a", "b", "b", "a", "b"]
+
+    def test_unknown_tier_uses_basic(self):
+        scheduler = FairScheduler()
+        scheduler.set_tiers({"a": "enterprise"})
+
+        assert scheduler.weight("a") == 1.0
+
+
+class TestQuotas:
+    """Тесты часовых квот тарифов"""
+
+    def test_quota_defers_extra_products(self, monkeypatch):
+        """Сверх квоты товары магазина откладываются, первыми идут давно не проверенные"""
+        monkeypatch.setattr(fair_scheduler, "TIER_HOURLY_QUOTAS", {"basic": 2})
+        scheduler = FairScheduler()
+        items = products("a", 4)
+        now = time.time()
+        for i, p in enumerate(items):
+            scheduler.record(p["id"], now - 100 * (4 - i))  # a-0 проверяли раньше всех
+
+        planned = scheduler.plan(items)
+
+        assert [p["id"] for p in planned] == ["a-0", "a-1"]
+        # квота на час уже выбрана
+        assert scheduler.plan(items) == []
+
+    def test_quota_share(self, monkeypatch):
+        """Квота делится между шардами, но не меньше одного товара"""
+        monkeypatch.setattr(fair_scheduler, "TIER_HOURLY_QUOTAS", {"basic": 10})
+
+        assert FairScheduler(quota_share=0.5).hourly_quota("a") == 5
+        assert FairScheduler(quota_share=0.01).hourly_quota("a") == 1
+
+    def test_quota_window(self, monkeypatch):
+        """Допуски старше часа не занимают квоту"""
+        monkeypatch.setattr(fair_scheduler, "TIER_HOURLY_QUOTAS", {"basic": 1})
+        scheduler = FairScheduler()
+        scheduler._admitted["a"].append(time.time() - fair_scheduler.QUOTA_WINDOW - 1)
+
+        assert len(scheduler.plan(products("a", 3))) == 1
+
+    def test_no_quota(self):
+        assert FairScheduler().hourly_quota("a") is None
+
+
+class TestLag:
+    """Тесты отставания проверки"""
+
+    def test_update_lag(self):
+        scheduler = FairScheduler()
+        now = time.time()
+        scheduler.record("a-0", now - 30)
+        scheduler.record("a-1", now - 10)
+        scheduler.record("a-2", now - 20)
+
+        lags = scheduler.update_lag(products("a", 3), now)
+
+        assert lags["a"] == pytest.approx((30, 20))
+
+    def test_forget_inactive(self):
+        """Учёт выключенных товаров чистится, когда их становится много"""
+        scheduler = FairScheduler()
+        for i in range(10):
+            scheduler.record(f"old-{i}")
+
+        scheduler.record("a-0")
+
+        scheduler.update_lag(products("a", 2))
+
+        assert set(scheduler._last_checked) == {"a-0"}
@@ -0,0 +1,242 @@
+# test_job_queue.py
+"""
+Тесты очереди задач демпера (job_queue.py) на подставном пуле соединений
+"""
+
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+
+import job_queue
+from job_queue import (JOB_REPRICE_PRODUCT, JOB_SYNC_STORE, PRIORITY_HIGH, JobDeferred, JobWorker, dedupe_key,
+                       enqueue_many, fail_job, release_job, release_stale_jobs, request_reprice)
+
+
+class FakeConn:
+    """Запоминает запросы; fetchval отвечает заданным значением (есть ли повторная задача)"""
+
+    def __init__(self, requeued: bool = False, execute_result: str = "INSERT 0 1"):
+        self.requeued = requeued
+        self.execute_result = execute_result
+        self.queries: list[tuple[str, tuple]] = []
+
+    async def execute(self, query, *args):
+        self.queries.append((query, args))
+        return self.execute_result
+
+    async def fetchval(self, query, *args):
+        self.queries.append((query, args))
+        return args[0] if self.requeued else None
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    def statements(self) -> list[str]:
+        return [" ".join(q.split())[:40] for q, _ in self.queries]
+
+
+class FakePool:
+    def __init__(self, conn: FakeConn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def job(attempts=1, max_attempts=5, kind=JOB_REPRICE_PRODUCT):
+    return {"id": 7, "kind": kind, "attempts": attempts, "max_attempts": max_attempts,
+            "product_id": uuid.uuid4(), "store_id": uuid.uuid4()}
+
+
+class TestEnqueue:
+    """Тесты постановки задач"""
+
+    def test_dedupe_key(self):
+        """Ключ дедупликации — по товару, для задач магазина — по магазину"""
+        assert dedupe_key(JOB_REPRICE_PRODUCT, "p1", "s1") == "reprice_product:p1"
+        assert dedupe_key(JOB_SYNC_STORE, None, "s1") == "sync_store:s1"
+
+    @pytest.mark.asyncio
+    async def test_enqueue_many_dedupes_waiting_jobs(self):
+        """Одинаковые ждущие задачи не копятся: конфликт по dedupe_key обновляет приоритет и срок"""
+        conn = FakeConn(execute_result="INSERT 0 2")
+        product_ids = [uuid.uuid4(), uuid.uuid4()]
+        store_id = uuid.uuid4()
+
+        count = await enqueue_many(FakePool(conn), JOB_REPRICE_PRODUCT, [(p, store_id) for p in product_ids],
+                                   priority=PRIORITY_HIGH, delay=5)
+
+        assert count == 2
+        query, args = conn.queries[0]
+        assert "ON CONFLICT (dedupe_key) WHERE locked_at IS NULL AND dead_at IS NULL" in query
+        assert "LEAST(demper_jobs.priority, EXCLUDED.priority)" in query
+        kind, pids, sids, keys, priority, delay = args
+        assert kind == JOB_REPRICE_PRODUCT
+        assert pids == [str(p) for p in product_ids]
+        assert sids == [str(store_id)] * 2
+        assert keys == [f"reprice_product:{p}" for p in product_ids]
+        assert (priority, delay) == (PRIORITY_HIGH, 5.0)
+
+    @pytest.mark.asyncio
+    async def test_enqueue_nothing(self):
+        conn = FakeConn()
+
+        assert await enqueue_many(FakePool(conn), JOB_REPRICE_PRODUCT, []) == 0
+        assert conn.queries == []
+
+    @pytest.mark.asyncio
+    async def test_request_reprice_swallows_errors(self):
+        """Срочный перерасчёт не роняет вызывающего, если очередь недоступна"""
+
+        class BrokenPool:
+            @asynccontextmanager
+            async def acquire(self):
+                raise ConnectionError("нет соединения")
+                yield
+
+        assert await request_reprice(BrokenPool(), uuid.uuid4(), [uuid.uuid4()]) == 0
+
+
+class TestRequeue:
+    """Тесты возврата задач в очередь"""
+
+    @pytest.mark.asyncio
+    async def test_release_keeps_attempt(self):
+        """Отложенная задача возвращается без засчитанной попытки и с паузой"""
+        conn = FakeConn()
+
+        await release_job(FakePool(conn), job(), delay=30)
+
+        query, args = conn.queries[-1]
+        assert "attempts = GREATEST(attempts - 1, 0)" in query
+        assert args == (7, 30.0)
+
+    @pytest.mark.asyncio
+    async def test_release_drops_if_requeued(self):
+        """Если такую же задачу уже поставили заново, захваченная просто удаляется"""
+        conn = FakeConn(requeued=True)
+
+        await release_job(FakePool(conn), job())
+
+        assert len(conn.queries) == 1
+        assert conn.statements()[0].startswith("DELETE FROM demper_jobs")
+
+    @pytest.mark.asyncio
+    async def test_fail_backoff(self):
+        """Неудачная попытка уходит на повтор с экспоненциальной паузой"""
+        conn = FakeConn()
+
+        await fail_job(FakePool(conn), job(attempts=3), "ошибка")
+
+        query, args = conn.queries[-1]
+        assert "run_after  = now() + make_interval(secs => $3)" in query
+        assert args == (7, "ошибка", job_queue.JOB_RETRY_BASE * 4)
+
+    @pytest.mark.asyncio
+    async def test_fail_dead_after_max_attempts(self):
+        """Исчерпавшая попытки задача помечается dead_at, даже если есть повторная"""
+        conn = FakeConn(requeued=True)
+
+        await fail_job(FakePool(conn), job(attempts=5, max_attempts=5), "ошибка")
+
+        assert len(conn.queries) == 1
+        assert "dead_at = now()" in conn.queries[0][0]
+
+    @pytest.mark.asyncio
+    async def test_release_stale_keeps_one_copy_per_key(self):
+        """
+        Две брошенные копии одной задачи: перед разблокировкой лишние удаляются,
+        остаётся копия с наименьшим id — иначе UPDATE нарушит уникальный индекс
+        """
+        conn = FakeConn(execute_result="UPDATE 1")
+
+        assert await release_stale_jobs(FakePool(conn)) == 1
+
+        assert [s.split()[0] for s in conn.statements()] == ["DELETE", "UPDATE"]
+        delete = " ".join(conn.queries[0][0].split())
+        assert "d.locked_at IS NULL" in delete
+        assert "d.locked_at < now() - $1::interval AND d.id < j.id" in delete
+
+
+class TestWorker:
+    """Тесты разбора задач воркером"""
+
+    @pytest.fixture
+    def calls(self, monkeypatch):
+        calls = []
+
+        async def complete_job(pool, job_id):
+            calls.append(("complete", job_id))
+
+        async def release_job(pool, job, delay=0):
+            calls.append(("release", delay))
+
+        async def fail_job(pool, job, error):
+            calls.append(("fail", error))
+
+        monkeypatch.setattr(job_queue, "complete_job", complete_job)
+        monkeypatch.setattr(job_queue, "release_job", release_job)
+        monkeypatch.setattr(job_queue, "fail_job", fail_job)
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_success(self, calls):
+        async def handler(j):
+            pass
+
+        await JobWorker(None, {JOB_REPRICE_PRODUCT: handler})._run_job(job())
+
+        assert calls == [("complete", 7)]
+
+    @pytest.mark.asyncio
+    async def test_deferred(self, calls):
+        async def handler(j):
+            raise JobDeferred(delay=30)
+
+        await JobWorker(None, {JOB_REPRICE_PRODUCT: handler})._run_job(job())
+
+        assert calls == [("release", 30)]
+
+    @pytest.mark.asyncio
+    async def test_error(self, calls):
+        async def handler(j):
+            raise RuntimeError("не удалось")
+
+        await JobWorker(None, {JOB_REPRICE_PRODUCT: handler})._run_job(job())
+
+        assert calls == [("fail", "не удалось")]
+
+    @pytest.mark.asyncio
+    async def test_unknown_kind(self, calls):
+        await JobWorker(None, {})._run_job(job(kind="unknown"))
+
+        assert calls[0][0] == "fail"
+
+    @pytest.mark.asyncio
+    async def test_batch_handler_gets_whole_claim(self, calls, monkeypatch):
+        """Задачи с пакетным обработчиком из одного захвата уходят в него одним вызовом"""
+        jobs = [{**job(), "id": i} for i in (1, 2, 3)] + [{**job(kind=JOB_SYNC_STORE), "id": 4}]
+        batches = []
+
+        async def claim_jobs(pool, worker_id, limit, kinds=None):
+            assert set(kinds) == {JOB_REPRICE_PRODUCT, JOB_SYNC_STORE}
+            return jobs
+
+        async def reprice(batch):
+            batches.append([j["id"] for j in batch])
+            return [None, JobDeferred(delay=30), RuntimeError("не удалось")]
+
+        async def sync(j):
+            pass
+
+        monkeypatch.setattr(job_queue, "claim_jobs", claim_jobs)
+        worker = JobWorker(None, {JOB_SYNC_STORE: sync}, batch_handlers={JOB_REPRICE_PRODUCT: reprice})
+
+        assert await worker.run_batch() == 4
+        assert batches == [[1, 2, 3]]
+        assert sorted(calls, key=str) == sorted([("complete", 4), ("complete", 1), ("release", 30),
+                                                 ("fail", "не удалось")], key=str)
+
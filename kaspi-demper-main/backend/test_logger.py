@@ -0,0 +1,123 @@
+# test_logger.py
+"""
+Тесты прореживания частых сообщений демпера (core/logger.py)
+"""
+
+import logging
+
+from core.logger import KIND_CYCLE_SUMMARY, KIND_NO_COMPETITORS, KIND_PRICE_PUSHED, SamplingFilter, _parse_sampling
+
+
+def record(kind=KIND_PRICE_PUSHED, level=logging.INFO) -> logging.LogRecord:
+    rec = logging.LogRecord("price_checker", level, __file__, 0, "сообщение", (), None)
+    if kind is not None:
+        rec.kind = kind
+    return rec
+
+
+class CollectHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestParseSampling:
+    def test_parse(self):
+        """Доля записей переводится в «каждая N-я», 0 — не писать совсем"""
+        every = _parse_sampling("price_pushed=0.01, no_competitors=0.1,,stage_timeout=0,city_minimums")
+
+        assert every == {"price_pushed": 100, "no_competitors": 10, "stage_timeout": 0, "city_minimums": 1}
+
+
+class TestSamplingFilter:
+    """Тесты SamplingFilter"""
+
+    def test_keeps_every_nth(self):
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 3})
+
+        kept = [sampler.filter(record()) for _ in range(7)]
+
+        assert kept == [True, False, False, True, False, False, True]
+        assert (sampler.seen[KIND_PRICE_PUSHED], sampler.kept[KIND_PRICE_PUSHED]) == (7, 3)
+
+    def test_zero_drops_all(self):
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 0})
+
+        assert not any(sampler.filter(record()) for _ in range(5))
+        assert sampler.seen[KIND_PRICE_PUSHED] == 5
+
+    def test_errors_never_dropped(self):
+        """ERROR и выше проходят при любом прореживании"""
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 0})
+
+        assert sampler.filter(record(level=logging.ERROR))
+        assert sampler.filter(record(level=logging.CRITICAL))
+        assert sampler.kept[KIND_PRICE_PUSHED] == 2
+
+    def test_records_without_kind_pass(self):
+        """Обычные записи и итоги цикла не прореживаются и не считаются"""
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 0, KIND_CYCLE_SUMMARY: 0})
+
+        assert sampler.filter(record(kind=None))
+        assert sampler.filter(record(kind=KIND_CYCLE_SUMMARY))
+        assert not sampler.seen
+
+    def test_decision_cached_on_record(self):
+        """Одна запись на нескольких обработчиках считается один раз и решается одинаково"""
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 2})
+        first, second = record(), record()
+
+        assert sampler.filter(first) and sampler.filter(first)
+        assert not sampler.filter(second) and not sampler.filter(second)
+        assert sampler.seen[KIND_PRICE_PUSHED] == 2
+
+    def test_handlers_share_decision(self):
+        """Файл и консоль получают одни и те же записи"""
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 2})
+        handlers = [CollectHandler(), CollectHandler()]
+        log = logging.getLogger("test_logger.shared")
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        for handler in handlers:
+            handler.addFilter(sampler)
+            log.addHandler(handler)
+        try:
+            for _ in range(4):
+                log.info("цена отправлена", extra={"kind": KIND_PRICE_PUSHED})
+        finally:
+            for handler in handlers:
+                log.removeHandler(handler)
+
+        assert len(handlers[0].records) == len(handlers[1].records) == 2
+        assert sampler.seen[KIND_PRICE_PUSHED] == 4
+
+
+class TestCycleSummary:
+    """Тесты итогов цикла"""
+
+    def test_summary(self, caplog):
+        sampler = SamplingFilter({KIND_PRICE_PUSHED: 2})
+        for _ in range(3):
+            sampler.filter(record())
+        sampler.filter(record(kind=KIND_NO_COMPETITORS))
+        target = logging.getLogger("test_logger.summary")
+
+        with caplog.at_level(logging.INFO, logger="test_logger.summary"):
+            sampler.log_cycle_summary(target, 5)
+
+        summary = caplog.records[-1]
+        assert summary.kind == KIND_CYCLE_SUMMARY
+        assert summary.counts == {KIND_PRICE_PUSHED: {"total": 3, "logged": 2},
+                                  KIND_NO_COMPETITORS: {"total": 1, "logged": 1}}
+        assert "Сообщения цикла 5" in summary.getMessage()
+        # счётчики сбрасываются к следующему циклу
+        assert not sampler.seen and not sampler.kept
+
+    def test_nothing_to_report(self, caplog):
+        with caplog.at_level(logging.INFO):
+            SamplingFilter({}).log_cycle_summary(logging.getLogger("test_logger.summary"), 1)
+
+        assert caplog.records == []
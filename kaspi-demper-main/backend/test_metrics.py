@@ -0,0 +1,74 @@
+# test_metrics.py
+"""
+Тесты метрик процесса и сведения снимков воркеров (core/metrics.py)
+"""
+
+import pytest
+
+from core.metrics import Counter, Gauge, Histogram, Registry, _metric_snapshot, merge_snapshots
+
+
+def snap(*metrics) -> dict:
+    return {metric.name: _metric_snapshot(metric) for metric in metrics}
+
+
+def values(merged: dict, name: str) -> dict:
+    return {tuple(sorted(labels.items())): value for labels, value in merged[name]["samples"]}
+
+
+class TestMergeSnapshots:
+    """Тесты сведения снимков нескольких воркеров в супервизоре"""
+
+    def test_counters_sum(self):
+        first, second = Counter("checked", "", ("result",)), Counter("checked", "", ("result",))
+        first.inc(3, result="ok")
+        second.inc(2, result="ok")
+        second.inc(1, result="error")
+
+        merged = merge_snapshots([snap(first), snap(second)])
+
+        assert values(merged, "checked") == {(("result", "ok"),): 5, (("result", "error"),): 1}
+
+    def test_throughput_gauge_sums(self):
+        """Скорость шардов складывается в скорость всего демпера"""
+        first, second = Gauge("speed", ""), Gauge("speed", "")
+        first.set(12.5)
+        second.set(7.5)
+
+        merged = merge_snapshots([snap(first), snap(second)])
+
+        assert values(merged, "speed") == {(): 20}
+
+    def test_lag_gauge_takes_max(self):
+        """Отставание магазина — худшее среди шардов"""
+        first, second = (Gauge("lag", "", ("store",), aggregate="max") for _ in range(2))
+        first.set(30, store="a")
+        second.set(90, store="a")
+        second.set(5, store="b")
+
+        merged = merge_snapshots([snap(first), snap(second)])
+
+        assert values(merged, "lag") == {(("store", "a"),): 90, (("store", "b"),): 5}
+
+    def test_histogram_sums(self):
+        first, second = Histogram("cycle", "", buckets=(1, 10)), Histogram("cycle", "", buckets=(1, 10))
+        first.observe(0.5)
+        second.observe(5)
+
+        merged = merge_snapshots([snap(first), snap(second)])
+
+        assert values(merged, "cycle")[(("le", "+Inf"),)] == 2
+        assert merged["cycle"]["sums"] == [[{}, 5.5]]
+
+    def test_unknown_aggregate(self):
+        with pytest.raises(ValueError):
+            Gauge("lag", "", aggregate="avg")
+
+
+class TestRegistry:
+    def test_register_returns_existing(self):
+        registry = Registry()
+        first = registry.register(Counter("checked", "первый"))
+
+        assert registry.register(Counter("checked", "второй")) is first
+        assert registry.get("checked") is first
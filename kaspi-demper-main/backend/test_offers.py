@@ -0,0 +1,93 @@
+# test_offers.py
+"""
+Тесты разбора офферов Kaspi (offers.py)
+"""
+
+import json
+
+import pytest
+
+import offers
+from offers import Offer, map_offer, parse_offer_view
+
+OFFER_VIEW = {
+    "offers": [
+        {"merchantId": "M1", "merchantName": "Магазин 1", "merchantRating": 4.9, "price": 129990,
+         "delivery": "2025-08-03T00:00:00.000+06:00", "kaspiDelivery": True},
+        {"merchantId": "M2", "merchantName": "Магазин 2", "price": 125000.5, "preorder": 0},
+        {"merchantId": "M3", "price": None},
+        {"merchantName": "Без id", "price": 100},
+    ],
+    "total": 4,
+    "offersCount": 4,
+}
+
+
+@pytest.fixture(params=["msgspec", "orjson", "json"])
+def decoder(request, monkeypatch):
+    """Все три пути разбора: msgspec, запасной на orjson и на stdlib json"""
+    if request.param == "msgspec" and offers._offer_view_decoder is None:
+        pytest.skip("msgspec не установлен")
+    if request.param == "orjson" and offers.orjson is None:
+        pytest.skip("orjson не установлен")
+    if request.param != "msgspec":
+        monkeypatch.setattr(offers, "_offer_view_decoder", None)
+    if request.param == "json":
+        monkeypatch.setattr(offers, "orjson", None)
+    return request.param
+
+
+class TestParseOfferView:
+    """Тесты разбора ответа offer-view/offers"""
+
+    def test_prices(self, decoder):
+        """Берутся только пары с merchantId и ценой, остальные поля пропускаются"""
+        result = parse_offer_view(json.dumps(OFFER_VIEW).encode())
+
+        assert result == [("M1", 129990), ("M2", 125000.5)]
+
+    def test_string_prices(self, decoder):
+        """Цена строкой разбирается одинаково на всех путях; нечисловая строка — цены нет"""
+        raw = json.dumps({"offers": [{"merchantId": "M1", "price": "129990"},
+                                     {"merchantId": "M2", "price": "125000.5"},
+                                     {"merchantId": "M3", "price": "нет в наличии"}]}).encode()
+
+        assert parse_offer_view(raw) == [("M1", 129990), ("M2", 125000.5)]
+
+    def test_empty_offers(self, decoder):
+        assert parse_offer_view(b'{"offers": [], "total": 0}') == []
+
+    @pytest.mark.parametrize("raw", [b'{"total": 0}', b'{"offers": null}'])
+    def test_missing_offers(self, decoder, raw):
+        """Ответ без offers — ошибка данных, а не «конкурентов нет»"""
+        with pytest.raises(ValueError, match="не содержит"):
+            parse_offer_view(raw)
+
+    @pytest.mark.parametrize("raw", [b"", b"<html>502 Bad Gateway</html>", b'{"offers": ['])
+    def test_malformed(self, decoder, raw):
+        with pytest.raises(ValueError):
+            parse_offer_view(raw)
+
+
+class TestMapOffer:
+    """Тесты оффера из кабинета продавца"""
+
+    def test_map(self):
+        offer = map_offer({
+            "offerId": "OFFER-1", "sku": "SKU-1", "masterTitle": "Смартфон", "masterCategory": "Smartphones",
+            "minPrice": 99990, "images": ["h1/h2/123.jpg"], "updatedAt": "2025-08-01T10:15:30.000+06:00",
+            "shopLink": "/shop/p/smartfon-128gb-chernyi-123456/",
+        })
+
+        assert isinstance(offer, Offer)
+        assert offer["kaspi_sku"] == "SKU-1"
+        assert offer.external_kaspi_id == "123456"
+        assert offer.image_url == "https://resources.cdn-kaspi.kz/img/m/p/h1/h2/123.jpg"
+        assert offer.as_dict()["price"] == 99990
+
+    def test_map_without_link_and_images(self):
+        offer = map_offer({"offerId": "OFFER-1", "sku": "SKU-1"})
+
+        assert offer.external_kaspi_id is None
+        assert offer.image_url is None
+        assert offer.get("missing", "default") == "default"
@@ -0,0 +1,98 @@
+# test_pricing_engine.py
+"""
+Тесты пакетного расчёта цен (pricing_engine.py)
+"""
+
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from pricing_engine import NO_VALUE, TIYN, PricingBatch, decide_prices, from_tiyn, to_tiyn
+
+
+def decide(price, competitor_min, floor=0, ceiling=0, step=TIYN):
+    """Одна строка в тенге -> новая цена в тенге или None, если цена не меняется"""
+    arrays = [np.asarray([value], dtype=np.int64) for value in (
+        to_tiyn(price), to_tiyn(floor), to_tiyn(ceiling),
+        to_tiyn(competitor_min) if competitor_min is not None else NO_VALUE)]
+    changed, new_prices = decide_prices(*arrays, step=step)
+    return from_tiyn(new_prices[0]) if len(changed) else None
+
+
+class TestConversion:
+    """Тесты перевода тенге <-> тиыны"""
+
+    @pytest.mark.parametrize("value, expected", [
+        (1000, 100_000), (Decimal("999.99"), 99_999), (12.5, 1_250), ("0.01", 1), (None, NO_VALUE),
+    ])
+    def test_to_tiyn(self, value, expected):
+        assert to_tiyn(value) == expected
+
+    def test_from_tiyn(self):
+        assert from_tiyn(99_999) == Decimal("999.99")
+
+
+class TestDecidePrices:
+    """Тесты правила демпера"""
+
+    def test_undercut_competitor(self):
+        """Цена встаёт на шаг ниже минимального конкурента"""
+        assert decide(price=1000, competitor_min=900) == Decimal(899)
+
+    def test_floor(self):
+        """Цена не опускается ниже min_profit, а уже стоящая на нём не меняется"""
+        assert decide(price=1000, competitor_min=900, floor=950) == Decimal(950)
+        assert decide(price=950, competitor_min=900, floor=950) is None
+        assert decide(price=1000, competitor_min=960, floor=959.5) == Decimal(960)
+
+    def test_ceiling(self):
+        """Цена не поднимается выше max_profit, даже если конкурент дороже"""
+        assert decide(price=1000, competitor_min=900, ceiling=850) == Decimal(850)
+
+    def test_ceiling_below_floor(self):
+        """max_profit ниже min_profit не уводит цену под нижнюю границу"""
+        assert decide(price=1000, competitor_min=900, floor=800, ceiling=700) == Decimal(800)
+
+    def test_rounding_up_to_whole_tenge(self):
+        """Цена округляется вверх до целых тенге"""
+        assert decide(price=1000, competitor_min=Decimal("900.50")) == Decimal(900)
+        assert decide(price=1000, competitor_min=900, floor=Decimal("899.10")) == Decimal(900)
+
+    def test_already_cheapest(self):
+        """Мы дешевле или равны конкуренту — цену не трогаем"""
+        assert decide(price=900, competitor_min=900) is None
+        assert decide(price=800, competitor_min=900) is None
+
+    def test_no_competitors(self):
+        """Без конкурентов цена не меняется"""
+        assert decide(price=1000, competitor_min=None) is None
+
+    def test_vector(self):
+        """Строки считаются независимо, возвращаются только изменившиеся"""
+        prices = np.asarray([100_000, 100_000, 90_000, 100_000], dtype=np.int64)
+        floors = np.asarray([0, 95_000, 0, 0], dtype=np.int64)
+        ceilings = np.zeros(4, dtype=np.int64)
+        mins = np.asarray([90_000, 90_000, 95_000, NO_VALUE], dtype=np.int64)
+
+        changed, new_prices = decide_prices(prices, floors, ceilings, mins)
+
+        assert changed.tolist() == [0, 1]
+        assert new_prices.tolist() == [89_900, 95_000]
+
+
+class TestPricingBatch:
+    """Тесты пачки товаров"""
+
+    def test_decide(self):
+        """В решение попадают только изменившиеся строки, цены — Decimal в тенге"""
+        batch = PricingBatch()
+        batch.add("a", Decimal(1000), Decimal(500), None, Decimal(900))
+        batch.add("b", Decimal(800), None, None, Decimal(900))
+        batch.add("c", Decimal(950), Decimal(950), Decimal(2000), Decimal(900))
+
+        assert len(batch) == 3
+        assert batch.decide() == [("a", Decimal(899))]
+
+    def test_empty(self):
+        assert PricingBatch().decide() == []
@@ -0,0 +1,169 @@
+# test_product_index.py
+"""
+Тесты индекса активных товаров (product_index.py)
+"""
+
+import json
+import uuid
+from decimal import Decimal
+
+import pytest
+
+import product_index
+from product_index import ActiveProductIndex
+
+STORE_A = uuid.UUID("00000000-0000-0000-0000-00000000000a")
+STORE_B = uuid.UUID("00000000-0000-0000-0000-00000000000b")
+
+
+def event(product_id, op="UPDATE", active=True, store_id=STORE_A, external_id="100", price=1000, h=0):
+    """Уведомление триггера notify_products_changed, как оно приходит после json"""
+    return {
+        "op": op, "id": str(product_id), "store_id": str(store_id), "kaspi_sku": f"SKU-{product_id}",
+        "external_kaspi_id": external_id, "price": price, "min_profit": 900, "max_profit": None,
+        "active": active, "h": h,
+    }
+
+
+def row(product_id, store_id=STORE_A, external_id="100", price=1000):
+    """Строка fetch_products"""
+    return {"id": product_id, "store_id": store_id, "kaspi_sku": f"SKU-{product_id}",
+            "external_kaspi_id": external_id, "price": Decimal(price), "min_profit": Decimal(900),
+            "max_profit": None}
+
+
+class TestApply:
+    """Тесты применения уведомлений"""
+
+    def test_insert_and_update(self):
+        """Новый товар попадает во все индексы, обновление переносит его между ними"""
+        index = ActiveProductIndex()
+        product_id = uuid.uuid4()
+
+        index.apply(event(product_id, op="INSERT"))
+        assert len(index) == 1
+        product = index.by_id[str(product_id)]
+        assert product["id"] == product_id
+        assert product["store_id"] == STORE_A
+        assert product["price"] == Decimal("1000")
+        assert index.by_external == {"100": {str(product_id)}}
+
+        index.apply(event(product_id, store_id=STORE_B, external_id="200", price=950))
+        assert len(index) == 1
+        assert index.by_id[str(product_id)]["price"] == Decimal("950")
+        assert STORE_A not in index.by_store
+        assert index.store_products(STORE_B)[0]["id"] == product_id
+        assert index.by_external == {"200": {str(product_id)}}
+
+    def test_price_is_decimal_without_float_error(self):
+        """Числа из JSON переводятся в Decimal через строку"""
+        index = ActiveProductIndex()
+        product_id = uuid.uuid4()
+
+        index.apply(event(product_id, price=0.1))
+
+        assert index.by_id[str(product_id)]["price"] == Decimal("0.1")
+
+    @pytest.mark.parametrize("change", [{"op": "DELETE"}, {"active": False}])
+    def test_remove(self, change):
+        """Удаление и выключение убирают товар из всех индексов"""
+        index = ActiveProductIndex()
+        product_id = uuid.uuid4()
+        index.apply(event(product_id))
+
+        index.apply({**event(product_id), **change})
+
+        assert len(index) == 0
+        assert index.by_store == {}
+        assert index.by_external == {}
+
+    def test_remove_unknown_is_noop(self):
+        """Уведомление о незнакомом товаре не ломает индекс"""
+        index = ActiveProductIndex()
+
+        index.apply({"op": "DELETE", "id": str(uuid.uuid4()), "h": 0})
+
+        assert len(index) == 0
+
+    def test_shard_filter(self):
+        """Товар чужого шарда не попадает в индекс, а при смене шарда удаляется"""
+        index = ActiveProductIndex(shard=(1, 3))
+        mine, other = uuid.uuid4(), uuid.uuid4()
+
+        index.apply(event(mine, h=4))
+        index.apply(event(other, h=5))
+
+        assert set(index.by_id) == {str(mine)}
+
+        index.apply(event(mine, h=5))
+        assert len(index) == 0
+
+
+class TestReload:
+    """Тесты перечитывания индекса"""
+
+    @pytest.mark.asyncio
+    async def test_notifications_during_reload_are_replayed(self, monkeypatch):
+        """Уведомление, пришедшее во время выборки, не затирается старым снимком"""
+        index = ActiveProductIndex()
+        changed, removed = uuid.uuid4(), uuid.uuid4()
+
+        async def fetch_products(pool, shard=None):
+            index._on_notify(None, 1, product_index.PRODUCTS_CHANNEL, json.dumps(event(changed, price=800)))
+            index._on_notify(None, 1, product_index.PRODUCTS_CHANNEL, json.dumps(event(removed, op="DELETE")))
+            return [row(changed, price=1000), row(removed)]
+
+        monkeypatch.setattr(product_index, "fetch_products", fetch_products)
+        await index.reload()
+
+        assert set(index.by_id) == {str(changed)}
+        assert index.by_id[str(changed)]["price"] == Decimal("800")
+        assert index._pending is None
+
+    @pytest.mark.asyncio
+    async def test_notification_outside_reload_applied_at_once(self):
+        """Без перечитывания уведомление применяется сразу"""
+        index = ActiveProductIndex()
+        product_id = uuid.uuid4()
+
+        index._on_notify(None, 1, product_index.PRODUCTS_CHANNEL, json.dumps(event(product_id)))
+
+        assert str(product_id) in index.by_id
+
+    @pytest.mark.asyncio
+    async def test_polls_every_cycle_without_listen_url(self, monkeypatch):
+        """Без прямого адреса Postgres индекс перечитывается каждый цикл"""
+        calls = []
+
+        async def fetch_products(pool, shard=None):
+            calls.append(shard)
+            return []
+
+        monkeypatch.setattr(product_index, "fetch_products", fetch_products)
+        monkeypatch.setattr(product_index, "DATABASE_LISTEN_URL", None)
+        index = ActiveProductIndex()
+
+        await index.start(pool=None)
+        await index.ensure_fresh()
+        await index.ensure_fresh()
+
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_periodic_reload_while_listening(self, monkeypatch):
+        """При живой подписке индекс всё равно перечитывается раз в INDEX_RELOAD_EVERY циклов"""
+        calls = []
+
+        async def fetch_products(pool, shard=None):
+            calls.append(shard)
+            return []
+
+        monkeypatch.setattr(product_index, "fetch_products", fetch_products)
+        monkeypatch.setattr(product_index, "INDEX_RELOAD_EVERY", 3)
+        monkeypatch.setattr(ActiveProductIndex, "listening", property(lambda self: True))
+        index = ActiveProductIndex()
+
+        for _ in range(7):
+            await index.ensure_fresh()
+
+        assert len(calls) == 2
@@ -0,0 +1,204 @@
+# test_repricing.py
+"""
+Тесты шагов цикла демпера (repricing.py) без Kaspi и без БД
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from decimal import Decimal
+
+import pytest
+
+import repricing
+from deadlines import start_cycle_deadline
+from fair_scheduler import QUOTA_WINDOW, FairScheduler
+from offer_cache import OfferCache
+
+clogger = logging.getLogger("test_repricing")
+
+
+def product(price=1000, min_profit=900, max_profit=None, store_id=None):
+    return {"id": uuid.uuid4(), "store_id": store_id or uuid.uuid4(), "kaspi_sku": "SKU-1",
+            "external_kaspi_id": "100000001", "price": Decimal(price), "min_profit": Decimal(min_profit),
+            "max_profit": Decimal(max_profit) if max_profit is not None else None}
+
+
+@pytest.fixture
+def saved_prices(monkeypatch):
+    """Цены, записанные в БД, вместо UPDATE products"""
+    saved = {}
+
+    async def save_price(pool, product_id, new_price):
+        saved[product_id] = new_price
+
+    monkeypatch.setattr(repricing, "_save_price", save_price)
+    start_cycle_deadline(0)
+    return saved
+
+
+class TestPush:
+    """Тесты отправки цены"""
+
+    @pytest.mark.asyncio
+    async def test_accepted(self, monkeypatch, saved_prices):
+        """Kaspi принял цену — она сохраняется в БД"""
+
+        async def sync_product(product_id, price):
+            return {"success": True}
+
+        monkeypatch.setattr(repricing, "sync_product", sync_product)
+        p = product()
+
+        assert await repricing._push(p, Decimal(950), clogger, pool=None) is True
+        assert saved_prices == {p["id"]: Decimal(950)}
+
+    @pytest.mark.asyncio
+    async def test_rejected(self, monkeypatch, saved_prices):
+        """Kaspi не принял цену — это неудача, в БД ничего не пишется"""
+
+        async def sync_product(product_id, price):
+            return {"success": False, "message": "нет ответа"}
+
+        monkeypatch.setattr(repricing, "sync_product", sync_product)
+
+        assert await repricing._push(product(), Decimal(950), clogger, pool=None) is False
+        assert saved_prices == {}
+
+    @pytest.mark.asyncio
+    async def test_error(self, monkeypatch, saved_prices):
+        """Исключение при отправке — неудача"""
+
+        async def sync_product(product_id, price):
+            raise RuntimeError("сессия протухла")
+
+        monkeypatch.setattr(repricing, "sync_product", sync_product)
+
+        assert await repricing._push(product(), Decimal(950), clogger, pool=None) is False
+        assert saved_prices == {}
+
+
+class TestRepriceBatch:
+    """Тесты конвейера поиск конкурентов -> расчёт -> отправка"""
+
+    @pytest.mark.asyncio
+    async def test_push_does_not_wait_for_slow_lookup(self, monkeypatch, saved_prices):
+        """
+        Цена быстрого товара уходит в Kaspi, пока медленные ещё ждут конкурентов:
+        семафор запросов меньше пачки, бюджет цикла конечен, а отправка идёт через
+        настоящий _push — она не должна стоять в очереди за ещё не начатыми поисками
+        """
+        fast = {**product(min_profit=0), "external_kaspi_id": "fast"}
+        slow = [product() for _ in range(5)]
+        release_slow = asyncio.Event()
+        pushed = asyncio.Event()
+
+        async def lookup_competitors(external_id, city_ids):
+            if external_id != "fast":
+                await release_slow.wait()
+            return {city_ids[0]: [("M1", 900)]}
+
+        async def sync_product(product_id, price):
+            if product_id == fast["id"]:
+                pushed.set()
+            return {"success": True}
+
+        monkeypatch.setattr(repricing, "semaphore", asyncio.Semaphore(2))
+        monkeypatch.setattr(repricing, "lookup_competitors", lookup_competitors)
+        monkeypatch.setattr(repricing, "sync_product", sync_product)
+        monkeypatch.setattr(repricing.random, "uniform", lambda a, b: 0)
+        monkeypatch.setattr(repricing, "_retry_ids", set())
+        start_cycle_deadline(5)
+        task = asyncio.create_task(repricing.reprice_batch([fast, *slow], clogger, pool=None))
+
+        await asyncio.wait_for(pushed.wait(), 1)
+        assert not task.done()
+        release_slow.set()
+
+        assert await task == [True] * 6
+        assert saved_prices[fast["id"]] == Decimal(899)
+
+    @pytest.mark.asyncio
+    async def test_statuses(self, monkeypatch):
+        """Статусы: без конкурентов — True без отправки, ошибка поиска — False, остановка — None"""
+        products = [product(), product(), product(), product(price=800)]
+        found = [None, repricing._FAILED, repricing._SKIPPED, Decimal(900)]
+        by_id = {p["id"]: f for p, f in zip(products, found)}
+        pushes = []
+
+        async def lookup(p, clogger):
+            return by_id[p["id"]]
+
+        async def push(p, new_price, clogger, pool):
+            pushes.append(p)
+            return True
+
+        monkeypatch.setattr(repricing, "_lookup", lookup)
+        monkeypatch.setattr(repricing, "_push", push)
+
+        assert await repricing.reprice_batch(products, clogger, pool=None) == [True, False, None, True]
+        assert pushes == []
+
+    @pytest.mark.asyncio
+    async def test_cancel_cancels_lookups(self, monkeypatch):
+        """Отмена перерасчёта не оставляет висящих запросов"""
+        started = asyncio.Event()
+        cancelled = []
+
+        async def lookup(p, clogger):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(p["id"])
+                raise
+
+        monkeypatch.setattr(repricing, "_lookup", lookup)
+        products = [product(), product()]
+        task = asyncio.create_task(repricing.reprice_batch(products, clogger, pool=None))
+        await started.wait()
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert sorted(cancelled) == sorted(p["id"] for p in products)
+
+
+class TestCheckpoint:
+    """Тесты тёплого старта: состояние планирования переживает перезапуск"""
+
+    def test_roundtrip(self, monkeypatch):
+        """Время проверок, квоты и перенесённые товары восстанавливаются с теми же id"""
+        before = FairScheduler()
+        monkeypatch.setattr(repricing, "fair_scheduler", before)
+        monkeypatch.setattr(repricing, "offer_cache", OfferCache(ttl=30))
+        monkeypatch.setattr(repricing, "_retry_ids", set())
+        checked, retried, store_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        now = time.time()
+        before.record(checked, now - 120)
+        before._admitted[store_id].extend([now - QUOTA_WINDOW - 10, now - 60])
+        repricing._retry_ids.add(retried)
+        repricing.offer_cache.put("100:750000000", [("M1", 900)])
+        repricing.offer_cache.put("200:750000000", [("M2", 800)], now - 60)
+
+        state = json.loads(json.dumps(repricing.dump_state(cycle=12)))
+
+        after = FairScheduler()
+        monkeypatch.setattr(repricing, "fair_scheduler", after)
+        monkeypatch.setattr(repricing, "offer_cache", OfferCache(ttl=30))
+        monkeypatch.setattr(repricing, "_retry_ids", set())
+
+        assert repricing.restore_state(state, clogger) == 12
+        assert after._last_checked == {checked: pytest.approx(now - 120, abs=0.1)}
+        # допуски старше часа в квоту не возвращаются
+        assert list(after._admitted) == [store_id]
+        assert len(after._admitted[store_id]) == 1
+        assert repricing._retry_ids == {retried}
+        # просроченный снимок конкурентов не сохраняется
+        assert repricing.offer_cache.get("100:750000000") == [("M1", 900)]
+        assert len(repricing.offer_cache) == 1
+
+    def test_empty_checkpoint(self):
+        assert repricing.restore_state({}, clogger) == 0
@@ -0,0 +1,76 @@
+# test_schema.py
+"""
+Тесты накатывания схемы (schema.py) на подставном соединении
+"""
+
+from contextlib import asynccontextmanager
+
+import pytest
+
+import schema
+from schema import SCHEMA_STATEMENTS, SCHEMA_VERSION, ensure_schema
+
+
+class FakeConn:
+    """Запоминает запросы; demper_schema_version содержит version (None — таблицы нет)"""
+
+    def __init__(self, version: str | None = None):
+        self.version = version
+        self.executed: list[str] = []
+
+    async def fetchval(self, query, *args):
+        if "to_regclass" in query:
+            return None if self.version is None else "demper_schema_version"
+        return self.version
+
+    async def execute(self, query, *args):
+        self.executed.append(query)
+        if "INSERT INTO demper_schema_version" in query:
+            self.version = args[0]
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    def __init__(self, conn: FakeConn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+class TestEnsureSchema:
+    """Тесты пропуска уже накатанной схемы"""
+
+    @pytest.mark.asyncio
+    async def test_current_version_skips_ddl(self):
+        """Перезапуск с той же версией схемы не выполняет ни одного ALTER и не берёт блокировку"""
+        conn = FakeConn(version=SCHEMA_VERSION)
+
+        await ensure_schema(FakePool(conn))
+
+        assert conn.executed == []
+
+    @pytest.mark.asyncio
+    async def test_new_database_applies_and_records_version(self):
+        conn = FakeConn()
+
+        await ensure_schema(FakePool(conn))
+
+        assert "pg_advisory_xact_lock" in conn.executed[0]
+        assert conn.executed[1:1 + len(SCHEMA_STATEMENTS)] == SCHEMA_STATEMENTS
+        assert conn.version == SCHEMA_VERSION
+
+    @pytest.mark.asyncio
+    async def test_changed_statements_reapply(self, monkeypatch):
+        """Правка SCHEMA_STATEMENTS меняет версию — схема накатывается заново"""
+        conn = FakeConn(version="old")
+        monkeypatch.setattr(schema, "SCHEMA_VERSION", "new")
+
+        await ensure_schema(FakePool(conn))
+
+        assert len(conn.executed) == len(SCHEMA_STATEMENTS) + 3
+        assert conn.version == "new"